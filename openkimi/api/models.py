@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Dict, Optional, Union
+from typing import Any, List, Dict, Optional, Union
 from datetime import datetime
 
 # Based on OpenAI Chat Completion API
@@ -16,6 +16,7 @@ class ChatCompletionRequest(BaseModel):
     # Add other common OpenAI params if needed (top_p, frequency_penalty, etc.)
     stream: Optional[bool] = False # Streaming not implemented in this version
     session_id: Optional[str] = Field(None, description="会话ID，用于保持会话状态")
+    include_spans: Optional[bool] = Field(False, description="是否在响应中返回本轮各阶段的计时区间")
 
 class ChoiceDelta(BaseModel):
     content: Optional[str] = None
@@ -39,6 +40,7 @@ class ChatCompletionResponse(BaseModel):
     choices: List[ChatCompletionChoice]
     usage: Optional[CompletionUsage] = None # Placeholder
     session_id: Optional[str] = Field(None, description="会话ID，用于保持会话状态")
+    spans: Optional[Dict[str, Any]] = Field(None, description="本轮各阶段的计时区间（请求 include_spans 时返回）")
 
 class ChatCompletionChunkChoice(BaseModel):
     index: int = 0
@@ -52,6 +54,47 @@ class ChatCompletionChunk(BaseModel):
     model: str
     choices: List[ChatCompletionChunkChoice]
 
+class CompressRequest(BaseModel):
+    text: str = Field(..., description="需要压缩的文本")
+    target_tokens: int = Field(..., gt=0, description="目标token数")
+    mode: Optional[str] = Field(None, description="'abstractive'（LLM摘要）或 'extractive'（不调用LLM），默认使用引擎配置")
+    query: Optional[str] = Field(None, description="抽取式压缩时优先保留与该查询相关的句子")
+    stream: Optional[bool] = Field(False, description="是否分段流式返回（适合超长文本）")
+
+class CompressResponse(BaseModel):
+    compressed: str = Field(..., description="压缩后的文本")
+    original_tokens: int
+    compressed_tokens: int
+    ratio: float = Field(..., description="compressed_tokens / original_tokens")
+    mode: str
+    cached: bool = Field(False, description="是否命中压缩结果缓存")
+    elapsed_seconds: float
+    usage: Optional[CompletionUsage] = None
+
+class RetrieveRequest(BaseModel):
+    query: str = Field(..., description="检索查询")
+    top_k: Optional[int] = Field(None, gt=0, description="最多返回的条数，默认按引擎配置")
+
+class BatchRetrieveRequest(BaseModel):
+    queries: List[str] = Field(..., description="检索查询列表")
+    top_k: Optional[int] = Field(None, gt=0, description="每个查询最多返回的条数，默认按引擎配置")
+
+class RetrievalHit(BaseModel):
+    text: str
+    score: float = Field(..., description="余弦相似度")
+    source: str = Field(..., description="'rag'（摘要）、'document'（原文块）或 'history'（移出窗口的对话）")
+
+class RetrieveResponse(BaseModel):
+    session_id: str
+    query: str
+    hits: List[RetrievalHit]
+    elapsed_ms: float
+
+class BatchRetrieveResponse(BaseModel):
+    session_id: str
+    results: List[RetrieveResponse]
+    elapsed_ms: float
+
 # ============= 用户和认证相关模型 =============
 
 class UserBase(BaseModel):
@@ -120,4 +163,7 @@ class SessionResponse(BaseModel):
     session_id: str = Field(..., description="会话ID")
     created_at: int = Field(..., description="创建时间戳")
     last_accessed: int = Field(..., description="最后访问时间戳")
-    expires_at: int = Field(..., description="过期时间戳") 
\ No newline at end of file
+    expires_at: int = Field(..., description="过期时间戳") 
+
+class TracingRequest(BaseModel):
+    enabled: bool = Field(True, description="是否为该会话之后的每轮对话记录 trace")
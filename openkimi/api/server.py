@@ -27,10 +27,14 @@ sys.path.insert(0, project_root)
 
 from openkimi import KimiEngine
 from openkimi.utils.llm_interface import get_llm_interface
+from openkimi.utils.prompt_loader import load_prompt
+from openkimi.core.prompt_artifacts import PromptRegistry
+from openkimi.utils.usage import UsageMeter, metering, metering_stream
 from openkimi.api.models import (
     ChatCompletionRequest, ChatCompletionResponse, ChatMessage, ChatCompletionChoice, 
     CompletionUsage, UserCreate, UserUpdate, UserResponse, APIKeyCreate, APIKeyResponse,
-    UsageStatistics, DateRangeRequest, ErrorResponse, SessionResponse
+    UsageStatistics, DateRangeRequest, ErrorResponse, SessionResponse, TracingRequest,
+    CompressRequest, CompressResponse, RetrieveRequest, RetrieveResponse, BatchRetrieveRequest, BatchRetrieveResponse
 )
 from openkimi.api.database import get_db, create_tables, create_api_key, get_all_api_keys, revoke_api_key, record_api_usage, get_user_usage, User, APIKey, UsageRecord
 from openkimi.api.auth import get_api_key, get_admin_user, create_user, authenticate_user, create_default_admin, user_to_response, apikey_to_response, hash_password
@@ -59,6 +63,9 @@ engine_model_name: str = "openkimi-engine"
 # 会话状态管理器
 session_manager: Optional[SessionManager] = None
 
+# 启动时预计算的固定系统提示词（如CoT提示词），请求中直接挂载，不再重复摄入
+prompt_registry = PromptRegistry()
+
 # 文件上传存储目录
 UPLOAD_DIR = os.path.join(project_root, "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -121,12 +128,60 @@ def initialize_engine(args):
         engine = engine_factory()
         engine_model_name = "openkimi-engine"
         logger.info("KimiEngine初始化成功")
+        _register_static_prompts(getattr(args, "static_prompt", None) or [])
     except Exception as e:
         logger.error(f"初始化KimiEngine时出错: {e}")
         import traceback
         traceback.print_exc()
         engine = None
 
+def _register_static_prompts(specs: List[str]) -> None:
+    """ Precomputes the built-in CoT prompt and any `NAME=PATH` static prompts given on the command line. """
+    prompts = [("cot", load_prompt("cot_system"))]
+    for spec in specs:
+        name, sep, path = spec.partition("=")
+        if not sep or not name or not path:
+            logger.error(f"Invalid --static-prompt '{spec}', expected NAME=PATH")
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                prompts.append((name, f.read()))
+        except OSError as e:
+            logger.error(f"Failed to read static prompt '{name}' from {path}: {e}")
+    for name, text in prompts:
+        try:
+            prompt_registry.register(engine.precompute_prompt(text, name=name))
+        except Exception as e:
+            logger.error(f"Failed to precompute static prompt '{name}': {e}")
+
+def _apply_messages(target_engine: KimiEngine, messages: List[ChatMessage]) -> Optional[str]:
+    """
+    Ingest system messages, reconcile prior user/assistant turns with the session history
+    (only turns the session hasn't seen are appended) and return the last user message to answer.
+    """
+    last_user_index = None
+    for i, message in enumerate(messages):
+        if message.role == "system":
+            artifact = prompt_registry.lookup(message.content)
+            if artifact is not None:
+                # Registered static prompt: attach the precomputed chunks instead of re-ingesting
+                target_engine.attach_prompt(artifact)
+                continue
+            # Ingest system messages (potentially long documents); repeats are skipped by the engine
+            print(f"Ingesting system message (length {len(message.content)})...")
+            target_engine.ingest(message.content)
+        elif message.role == "user":
+            # Keep track of the last user message to run chat
+            last_user_index = i
+    if last_user_index is None:
+        return None
+    prior_turns = [
+        {"role": message.role, "content": message.content}
+        for message in messages[:last_user_index] if message.role in ("user", "assistant")
+    ]
+    target_engine.reconcile_history(prior_turns)
+    return messages[last_user_index].content
+
 @app.post("/v1/chat/completions", 
           response_model=ChatCompletionResponse, 
           summary="OpenAI Compatible Chat Completion",
@@ -176,20 +231,13 @@ def create_chat_completion(
         logger.error("KimiEngine has no LLM interface. This might be due to a reset operation.")
         raise HTTPException(status_code=503, detail="KimiEngine not fully initialized. Try again in a moment.")
     
+    # 本次请求的LLM用量单独计量（包括摄入、压缩、框架和MPR等所有调用），同时累加到会话用量；
+    # 同一会话的后台摘要、摄入队列和并发请求不会计入
+    request_meter = UsageMeter(parent=engine.session_usage)
+    
     # 处理消息
-    last_user_message = None
-    for message in request.messages:
-        if message.role == "system":
-            # Ingest system messages (potentially long documents)
-            print(f"Ingesting system message (length {len(message.content)})...")
-            engine.ingest(message.content)
-        elif message.role == "user":
-            # Keep track of the last user message to run chat
-            last_user_message = message.content
-        elif message.role == "assistant":
-            # Add assistant messages to history *after* potential ingest
-            # This assumes assistant messages don't trigger ingest
-            engine.conversation_history.append(message.dict())
+    with metering(request_meter):
+        last_user_message = _apply_messages(engine, request.messages)
 
     if not last_user_message:
         raise HTTPException(status_code=400, detail="No user message found in the request.")
@@ -197,11 +245,11 @@ def create_chat_completion(
     # --- Generate completion using the last user message --- 
     try:
         print(f"Running chat for user message: {last_user_message[:50]}...")
-        completion_text = engine.chat(last_user_message)
+        with metering(request_meter):
+            completion_text = engine.chat(last_user_message)
         
         # 记录API使用情况
-        prompt_tokens = engine.token_counter.count_tokens(last_user_message)
-        completion_tokens = engine.token_counter.count_tokens(completion_text)
+        prompt_tokens, completion_tokens = request_meter.prompt_tokens, request_meter.completion_tokens
         try:
             record_api_usage(
                 db=db, 
@@ -225,11 +273,10 @@ def create_chat_completion(
     response_message = ChatMessage(role="assistant", content=completion_text)
     choice = ChatCompletionChoice(index=0, message=response_message, finish_reason="stop")
     
-    # Placeholder for usage calculation
     usage = CompletionUsage(
-        prompt_tokens=engine.token_counter.count_tokens(last_user_message), # Simplified
-        completion_tokens=engine.token_counter.count_tokens(completion_text), # Simplified
-        total_tokens=engine.token_counter.count_tokens(last_user_message) + engine.token_counter.count_tokens(completion_text) # Simplified
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens
     )
 
     return ChatCompletionResponse(
@@ -238,7 +285,8 @@ def create_chat_completion(
         model=engine_model_name, 
         choices=[choice],
         usage=usage,
-        session_id=session_id
+        session_id=session_id,
+        spans=engine.last_turn_spans if request.include_spans else None
     )
 
 async def stream_chat_completion(
@@ -276,20 +324,12 @@ async def stream_chat_completion(
         yield f"data: {json.dumps({'error': {'message': 'KimiEngine not fully initialized. Try again in a moment.', 'code': 'engine_error'}})}\n\n"
         return
     
+    # 本次请求的LLM用量单独计量（见 create_chat_completion）
+    request_meter = UsageMeter(parent=engine.session_usage)
+    
     # 处理消息
-    last_user_message = None
-    for message in request.messages:
-        if message.role == "system":
-            # Ingest system messages (potentially long documents)
-            print(f"Ingesting system message (length {len(message.content)})...")
-            engine.ingest(message.content)
-        elif message.role == "user":
-            # Keep track of the last user message to run chat
-            last_user_message = message.content
-        elif message.role == "assistant":
-            # Add assistant messages to history *after* potential ingest
-            # This assumes assistant messages don't trigger ingest
-            engine.conversation_history.append(message.dict())
+    with metering(request_meter):
+        last_user_message = _apply_messages(engine, request.messages)
 
     if not last_user_message:
         yield f"data: {json.dumps({'error': {'message': 'No user message found in the request.', 'code': 'invalid_request'}})}\n\n"
@@ -302,30 +342,31 @@ async def stream_chat_completion(
     try:
         # 检查引擎是否支持流式生成
         if not hasattr(engine, 'stream_chat') or not callable(engine.stream_chat):
-            # 如果不支持流式生成，则使用普通chat并模拟流式输出
-            completion_text = engine.chat(last_user_message)
-            # 模拟流式输出，每10个字符发送一次
-            for i in range(0, len(completion_text), 10):
-                chunk = completion_text[i:i+10]
-                yield f"data: {json.dumps({'id': request_id, 'object': 'chat.completion.chunk', 'created': created_time, 'model': engine_model_name, 'choices': [{'index': 0, 'delta': {'content': chunk}, 'finish_reason': None}]})}\n\n"
-                await asyncio.sleep(0.05)  # 添加小延迟以模拟流式输出
+            # 如果不支持流式生成，则使用普通chat并一次性返回完整结果
+            with metering(request_meter):
+                completion_text = await engine.achat(last_user_message)
+            yield f"data: {json.dumps({'id': request_id, 'object': 'chat.completion.chunk', 'created': created_time, 'model': engine_model_name, 'choices': [{'index': 0, 'delta': {'content': completion_text}, 'finish_reason': None}]})}\n\n"
         else:
             # 使用引擎的流式生成功能
-            async for chunk in engine.stream_chat(last_user_message):
+            async for chunk in metering_stream(engine.stream_chat(last_user_message), request_meter):
                 yield f"data: {json.dumps({'id': request_id, 'object': 'chat.completion.chunk', 'created': created_time, 'model': engine_model_name, 'choices': [{'index': 0, 'delta': {'content': chunk}, 'finish_reason': None}]})}\n\n"
         
-        # 发送完成标记
-        yield f"data: {json.dumps({'id': request_id, 'object': 'chat.completion.chunk', 'created': created_time, 'model': engine_model_name, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})}\n\n"
+        # 发送完成标记（请求 include_spans 时附带本轮计时区间）
+        final_chunk = {'id': request_id, 'object': 'chat.completion.chunk', 'created': created_time, 'model': engine_model_name, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+        if request.include_spans:
+            final_chunk['spans'] = engine.last_turn_spans
+        yield f"data: {json.dumps(final_chunk)}\n\n"
         
-        # 记录API使用情况（简化版，实际使用中可能需要更精确的计算）
+        # 记录API使用情况
         try:
+            prompt_tokens, completion_tokens = request_meter.prompt_tokens, request_meter.completion_tokens
             record_api_usage(
                 db=db, 
                 user_id=api_key.user_id, 
                 api_key_id=api_key.id, 
                 endpoint="/v1/chat/completions", 
-                prompt_tokens=engine.token_counter.count_tokens(last_user_message), 
-                completion_tokens=engine.token_counter.count_tokens(engine.conversation_history[-1]["content"]) if engine.conversation_history else 0
+                prompt_tokens=prompt_tokens, 
+                completion_tokens=completion_tokens
             )
         except Exception as usage_error:
             logger.error(f"记录API使用情况失败: {usage_error}")
@@ -439,6 +480,138 @@ def get_session_info(
         expires_at=int(session_manager.session_timeouts[session_id])
     )
 
+@app.get("/v1/sessions/{session_id}/ingest", 
+         summary="获取会话的后台摄入进度",
+         tags=["Sessions"])
+async def get_session_ingest_progress(
+    session_id: str,
+    api_key: Any = Depends(get_api_key)
+):
+    """
+    获取会话后台摄入队列的进度
+    
+    Args:
+        session_id: 会话ID
+        api_key: API密钥
+        
+    Returns:
+        未结束的任务数、已完成/总块数、预计剩余时间（秒）及各任务详情
+    """
+    engine = session_manager.get_session(session_id) if session_manager else None
+    if engine is None:
+        raise HTTPException(status_code=404, detail=f"会话不存在: {session_id}")
+    return {"session_id": session_id, **engine.get_ingest_progress()}
+    
+@app.get("/v1/sessions/{session_id}/usage", 
+         summary="获取会话的LLM token用量",
+         tags=["Sessions"])
+async def get_session_usage(
+    session_id: str,
+    api_key: Any = Depends(get_api_key)
+):
+    """
+    获取会话累计的LLM token用量（按流水线阶段分类）以及最近一轮对话的用量
+    
+    Args:
+        session_id: 会话ID
+        api_key: API密钥
+    """
+    engine = session_manager.get_session(session_id) if session_manager else None
+    if engine is None:
+        raise HTTPException(status_code=404, detail=f"会话不存在: {session_id}")
+    return {"session_id": session_id, "session": engine.get_usage_stats(), "last_turn": engine.last_turn_usage}
+    
+@app.post("/v1/sessions/{session_id}/retrieve", 
+          response_model=RetrieveResponse,
+          summary="直接检索会话内容（不调用LLM）",
+          tags=["Sessions"])
+async def retrieve_from_session(
+    session_id: str,
+    request: RetrieveRequest,
+    api_key: Any = Depends(get_api_key)
+):
+    """
+    在会话的RAG摘要、文档块和已移出窗口的对话中检索，返回带相似度和来源的命中结果
+    
+    不调用LLM，可用于展示来源或由客户端自行编排。
+    
+    Args:
+        session_id: 会话ID
+        request: 查询和返回条数
+        api_key: API密钥
+    """
+    engine = session_manager.get_session(session_id) if session_manager else None
+    if engine is None:
+        raise HTTPException(status_code=404, detail=f"会话不存在: {session_id}")
+    start = time.perf_counter()
+    hits = (await asyncio.to_thread(engine.retrieve, [request.query], request.top_k))[0]
+    return RetrieveResponse(session_id=session_id, query=request.query, hits=hits,
+                            elapsed_ms=(time.perf_counter() - start) * 1000)
+    
+@app.post("/v1/sessions/{session_id}/retrieve/batch", 
+          response_model=BatchRetrieveResponse,
+          summary="批量直接检索会话内容（不调用LLM）",
+          tags=["Sessions"])
+async def batch_retrieve_from_session(
+    session_id: str,
+    request: BatchRetrieveRequest,
+    api_key: Any = Depends(get_api_key)
+):
+    """
+    批量检索：所有查询一次编码、每个存储一次矩阵检索
+    
+    Args:
+        session_id: 会话ID
+        request: 查询列表和每个查询的返回条数
+        api_key: API密钥
+    """
+    engine = session_manager.get_session(session_id) if session_manager else None
+    if engine is None:
+        raise HTTPException(status_code=404, detail=f"会话不存在: {session_id}")
+    start = time.perf_counter()
+    results = await asyncio.to_thread(engine.retrieve, request.queries, request.top_k)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return BatchRetrieveResponse(
+        session_id=session_id,
+        results=[RetrieveResponse(session_id=session_id, query=query, hits=hits, elapsed_ms=elapsed_ms)
+                 for query, hits in zip(request.queries, results)],
+        elapsed_ms=elapsed_ms
+    )
+    
+@app.put("/admin/sessions/{session_id}/tracing", 
+         summary="开启或关闭会话的追踪模式",
+         tags=["Management"])
+async def set_session_tracing(
+    session_id: str,
+    tracing: TracingRequest,
+    admin: Any = Depends(get_admin_user)
+):
+    """开启或关闭会话的追踪模式（需要管理员权限）；trace 输出目录沿用服务端配置"""
+    engine = session_manager.get_session(session_id) if session_manager else None
+    if engine is None:
+        raise HTTPException(status_code=404, detail=f"会话不存在: {session_id}")
+    output_dir = engine.config.get("tracing", {}).get("output_dir")
+    engine.enable_tracing(tracing.enabled, output_dir=output_dir)
+    return {"session_id": session_id, "enabled": tracing.enabled}
+
+@app.get("/admin/sessions/{session_id}/trace", 
+         summary="获取会话最近一轮对话的 Chrome trace",
+         tags=["Management"])
+async def get_session_trace(
+    session_id: str,
+    admin: Any = Depends(get_admin_user)
+):
+    """
+    返回会话最近一轮对话的 Chrome trace JSON（需要管理员权限），可直接在 Perfetto 中打开
+    """
+    engine = session_manager.get_session(session_id) if session_manager else None
+    if engine is None:
+        raise HTTPException(status_code=404, detail=f"会话不存在: {session_id}")
+    trace_json = engine.get_last_trace()
+    if trace_json is None:
+        raise HTTPException(status_code=404, detail="该会话尚无trace，请先开启追踪模式")
+    return trace_json
+
 @app.get("/api/suggestions", 
          summary="Get dynamic suggestion prompts", 
          tags=["Suggestions"])
@@ -492,6 +665,70 @@ async def get_suggestions():
         print(f"An unexpected error occurred while fetching suggestions: {e}. Using defaults.")
         return JSONResponse(content=default_suggestions)
 
+def _record_compress_usage(db: Session, api_key: Any, usage: Dict[str, Any]) -> None:
+    """ Records the LLM tokens a compression request consumed (nothing for extractive or cached results). """
+    if not usage.get("total_tokens"):
+        return
+    try:
+        record_api_usage(
+            db=db, 
+            user_id=api_key.user_id, 
+            api_key_id=api_key.id, 
+            endpoint="/v1/compress", 
+            prompt_tokens=usage["prompt_tokens"], 
+            completion_tokens=usage["completion_tokens"]
+        )
+    except Exception as usage_error:
+        logger.error(f"记录API使用情况失败: {usage_error}")
+
+async def _stream_compress(request: CompressRequest, api_key: Any, db: Session):
+    """ Streams one SSE event per compressed segment, then a summary event. """
+    try:
+        async for event in engine.compress_stream(request.text, request.target_tokens, mode=request.mode, query=request.query):
+            if event.get("done"):
+                _record_compress_usage(db, api_key, event["usage"])
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+    except ValueError as e:
+        yield f"data: {json.dumps({'error': {'message': str(e), 'code': 'invalid_request'}})}\n\n"
+    except Exception as e:
+        logger.error(f"Error during streaming compression: {e}")
+        yield f"data: {json.dumps({'error': {'message': f'Error compressing text: {e}', 'code': 'compression_error'}})}\n\n"
+    yield "data: [DONE]\n\n"
+
+@app.post("/v1/compress", 
+          response_model=CompressResponse, 
+          summary="Compress text to a token budget",
+          tags=["Tools"])
+async def compress_text(
+    request: CompressRequest,
+    api_key: Any = Depends(get_api_key),
+    db: Session = Depends(get_db)
+):
+    """
+    只使用OpenKimi的长文本压缩：把文本压缩到 target_tokens 以内，返回压缩结果、压缩比和耗时
+    
+    使用全局引擎已加载的模型和压缩结果缓存，不创建会话。stream=true 时按段落分段压缩，
+    每段完成后立即以SSE返回，适合超长文本。
+    """
+    if engine is None or engine.llm_interface is None:
+        raise HTTPException(status_code=503, detail="KimiEngine not initialized. Check server logs.")
+    if request.stream:
+        return StreamingResponse(_stream_compress(request, api_key, db), media_type="text/event-stream")
+    try:
+        result = await asyncio.to_thread(engine.compress, request.text, request.target_tokens, request.mode, request.query)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error during compression: {e}")
+        raise HTTPException(status_code=500, detail=f"Error compressing text: {e}")
+    _record_compress_usage(db, api_key, result["usage"])
+    usage = result["usage"]
+    return CompressResponse(**{**result, "usage": CompletionUsage(
+        prompt_tokens=usage["prompt_tokens"],
+        completion_tokens=usage["completion_tokens"],
+        total_tokens=usage["total_tokens"]
+    )})
+
 @app.get("/health", summary="Health Check", tags=["Management"])
 def health_check():
     """Basic health check endpoint."""
@@ -553,6 +790,14 @@ async def ingest_file(file_data: dict, background_tasks: BackgroundTasks):
     file_id = file_data.get("file_id")
     if not file_id or file_id not in uploaded_files:
         raise HTTPException(status_code=404, detail=f"文件ID不存在: {file_id}")
+        
+    # 指定会话时摄入到该会话的引擎，否则摄入到全局引擎
+    session_id = file_data.get("session_id")
+    target_engine = engine
+    if session_id:
+        target_engine = session_manager.get_session(session_id) if session_manager else None
+        if target_engine is None:
+            raise HTTPException(status_code=404, detail=f"会话不存在: {session_id}")
     
     file_info = uploaded_files[file_id]
     file_path = file_info["path"]
@@ -564,20 +809,21 @@ async def ingest_file(file_data: dict, background_tasks: BackgroundTasks):
     try:
         # 更新文件状态
         uploaded_files[file_id]["status"] = "processing"
+        uploaded_files[file_id]["session_id"] = session_id
         
         # 处理不同类型的文件
         file_extension = filename.split(".")[-1].lower()
         
         if file_extension == "pdf":
-            background_tasks.add_task(process_pdf, file_id, file_path)
+            background_tasks.add_task(process_pdf, file_id, file_path, target_engine)
             return {"status": "processing", "file_id": file_id, "message": "PDF文件正在处理中"}
         
         elif file_extension in ["docx", "doc"]:
-            background_tasks.add_task(process_docx, file_id, file_path)
+            background_tasks.add_task(process_docx, file_id, file_path, target_engine)
             return {"status": "processing", "file_id": file_id, "message": "Word文档正在处理中"}
         
         elif file_extension == "txt":
-            background_tasks.add_task(process_txt, file_id, file_path)
+            background_tasks.add_task(process_txt, file_id, file_path, target_engine)
             return {"status": "processing", "file_id": file_id, "message": "文本文件正在处理中"}
         
         else:
@@ -595,11 +841,48 @@ async def get_file_status(file_id: str):
     if file_id not in uploaded_files:
         raise HTTPException(status_code=404, detail=f"文件ID不存在: {file_id}")
     
-    return uploaded_files[file_id]
+    file_info = uploaded_files[file_id]
+    job_id = file_info.get("job_id")
+    if not job_id:
+        return file_info
+    target_engine = _ingest_engine_for(file_info)
+    if target_engine is None:
+        # 会话已删除或过期，其后台摄入随之取消
+        if file_info.get("status") == "ingesting":
+            file_info["status"] = "cancelled"
+            file_info["error"] = "会话已结束"
+        return file_info
+    progress = target_engine.get_ingest_progress(job_id)
+    if progress is not None:
+        if progress["status"] == "done":
+            file_info["status"] = "ingested"
+        elif progress["status"] in ("error", "cancelled"):
+            file_info["status"] = progress["status"]
+            file_info["error"] = progress["error"]
+        return {**file_info, "progress": progress}
+    return file_info
+
+def _ingest_engine_for(file_info: Dict[str, Any]) -> Optional[KimiEngine]:
+    """ Looks up the engine ingesting a file without holding a reference to it (None once its session is gone). """
+    session_id = file_info.get("session_id")
+    if not session_id:
+        return engine
+    if session_manager is None:
+        return None
+    # 直接读取会话表，查询进度不刷新会话的过期时间
+    session = session_manager.sessions.get(session_id)
+    return session["engine"] if session else None
+
+def _queue_ingest(file_id: str, text_content: str, target_engine: Optional[KimiEngine]) -> None:
+    """ Hands extracted file text to the engine's background ingestion queue (chunks become searchable as they are indexed). """
+    target_engine = target_engine or engine
+    job_id = target_engine.ingest_in_background(text_content, name=uploaded_files[file_id]["filename"])
+    uploaded_files[file_id]["job_id"] = job_id
+    uploaded_files[file_id]["status"] = "ingesting"
 
 # 处理PDF文件
-async def process_pdf(file_id: str, file_path: str):
-    """处理PDF文件并摄入到KimiEngine"""
+async def process_pdf(file_id: str, file_path: str, target_engine: Optional[KimiEngine] = None):
+    """处理PDF文件并提交到KimiEngine的后台摄入队列"""
     try:
         # 尝试导入PyPDF2
         try:
@@ -609,20 +892,17 @@ async def process_pdf(file_id: str, file_path: str):
             uploaded_files[file_id]["status"] = "error"
             return
         
-        with open(file_path, "rb") as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text_content = ""
-            
-            # 提取每一页的文本
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text_content += page.extract_text() + "\n\n"
-        
-        # 摄入文本到KimiEngine
+        def extract_text() -> str:
+            with open(file_path, "rb") as file:
+                pdf_reader = PyPDF2.PdfReader(file)
+                # 提取每一页的文本
+                return "".join(page.extract_text() + "\n\n" for page in pdf_reader.pages)
+                
+        # 文本提取和摄入都不在事件循环中执行
+        text_content = await asyncio.to_thread(extract_text)
         if text_content:
-            engine.ingest(text_content)
-            uploaded_files[file_id]["status"] = "ingested"
-            logger.info(f"PDF文件已成功摄入: {file_id}")
+            _queue_ingest(file_id, text_content, target_engine)
+            logger.info(f"PDF文件已提交摄入: {file_id}")
         else:
             logger.warning(f"PDF文件内容为空: {file_id}")
             uploaded_files[file_id]["status"] = "empty"
@@ -633,8 +913,8 @@ async def process_pdf(file_id: str, file_path: str):
         uploaded_files[file_id]["error"] = str(e)
 
 # 处理Word文档
-async def process_docx(file_id: str, file_path: str):
-    """处理Word文档并摄入到KimiEngine"""
+async def process_docx(file_id: str, file_path: str, target_engine: Optional[KimiEngine] = None):
+    """处理Word文档并提交到KimiEngine的后台摄入队列"""
     try:
         # 尝试导入docx库
         try:
@@ -644,18 +924,15 @@ async def process_docx(file_id: str, file_path: str):
             uploaded_files[file_id]["status"] = "error"
             return
         
-        doc = docx.Document(file_path)
-        text_content = ""
-        
-        # 提取文档中的段落文本
-        for para in doc.paragraphs:
-            text_content += para.text + "\n"
-        
-        # 摄入文本到KimiEngine
+        def extract_text() -> str:
+            doc = docx.Document(file_path)
+            # 提取文档中的段落文本
+            return "".join(para.text + "\n" for para in doc.paragraphs)
+            
+        text_content = await asyncio.to_thread(extract_text)
         if text_content:
-            engine.ingest(text_content)
-            uploaded_files[file_id]["status"] = "ingested"
-            logger.info(f"Word文档已成功摄入: {file_id}")
+            _queue_ingest(file_id, text_content, target_engine)
+            logger.info(f"Word文档已提交摄入: {file_id}")
         else:
             logger.warning(f"Word文档内容为空: {file_id}")
             uploaded_files[file_id]["status"] = "empty"
@@ -666,17 +943,15 @@ async def process_docx(file_id: str, file_path: str):
         uploaded_files[file_id]["error"] = str(e)
 
 # 处理纯文本文件
-async def process_txt(file_id: str, file_path: str):
-    """处理纯文本文件并摄入到KimiEngine"""
+async def process_txt(file_id: str, file_path: str, target_engine: Optional[KimiEngine] = None):
+    """处理纯文本文件并提交到KimiEngine的后台摄入队列"""
     try:
         with open(file_path, "r", encoding="utf-8") as file:
             text_content = file.read()
         
-        # 摄入文本到KimiEngine
         if text_content:
-            engine.ingest(text_content)
-            uploaded_files[file_id]["status"] = "ingested"
-            logger.info(f"文本文件已成功摄入: {file_id}")
+            _queue_ingest(file_id, text_content, target_engine)
+            logger.info(f"文本文件已提交摄入: {file_id}")
         else:
             logger.warning(f"文本文件内容为空: {file_id}")
             uploaded_files[file_id]["status"] = "empty"
@@ -897,63 +1172,19 @@ async def create_cot_chat_completion(request: ChatCompletionRequest):
     created_time = int(time.time())
     
     # 处理与常规聊天相同，但添加CoT提示词
-    try:
-        logger.info("重置引擎状态用于CoT处理...")
-        engine.reset()
-        logger.info("引擎重置成功")
-    except Exception as e:
-        logger.error(f"重置引擎时出错: {e}")
-        import traceback
-        traceback.print_exc()
-        # 检查重置后的引擎状态
-        logger.info(f"重置后引擎状态: engine={engine is not None}, llm_interface={engine.llm_interface is not None if engine else 'N/A'}")
-        if engine is None or engine.llm_interface is None:
-            raise HTTPException(status_code=503, detail=f"Failed to reset KimiEngine: {e}. Try again later.")
-    
-    # CoT系统提示词
-    cot_system_prompt = """
-# Multiple-CoT
-
-## Role
-
-You are an expert AI assistant capable of gradually explaining the reasoning process.
-
-## First Think step
-
-
-For each step, provide a title that describes what you did in that step, along with the corresponding content.
-Decide whether another step is needed or if you are ready to give the final answer.
-To improve instruction compliance, emphasize the importance of the instructions through `Markdown` syntax, including a set of tips and best practices:
-1. Use as many **reasoning steps** as possible. At least 3 steps.
-2. Be aware of your limitations as an AI and what you can and cannot do.
-3. Include exploration of alternative answers. Consider that you might be wrong and where the error might be if your reasoning is incorrect.
-4. When you say you are rechecking, actually recheck and use another method. Don't just say you are rechecking.
-5. Use at least 3 methods to arrive at the answer.
-6. Use best practices.
-
-## Second Think step
-
-
-For each step mentioned in the previous text, initiate a small sub-step within each step to verify its correctness. After completing each step, start a `reviewer CoT` to review the current step from different perspectives.
-1. Use as many **reasoning steps** as possible. At least three steps.
-2. Be aware of your limitations as an AI and what you can and cannot do.
-3. Include exploring alternative answers. Consider that you might be wrong and where the error might be if your reasoning is incorrect.
-    """
+    # 每个请求使用全局引擎的一个空白分叉：共享已加载的模型，不修改全局引擎的状态
+    cot_engine = engine.fork()
+    cot_engine.reset()
     
-    # 添加CoT系统提示词
-    engine.ingest(cot_system_prompt)
+    # 挂载启动时预计算的CoT系统提示词（未注册时退回为正常摄入）
+    cot_artifact = prompt_registry.get("cot")
+    if cot_artifact is not None:
+        cot_engine.attach_prompt(cot_artifact)
+    else:
+        cot_engine.ingest(load_prompt("cot_system"))
     
-    last_user_message = None
-    for message in request.messages:
-        if message.role == "system":
-            # 已经添加了COT提示词，可以再添加用户的系统提示词
-            engine.ingest(message.content)
-        elif message.role == "user":
-            # 保存最后的用户消息
-            last_user_message = message.content
-        elif message.role == "assistant":
-            # 添加助手消息到历史
-            engine.conversation_history.append(message.dict())
+    # 已经添加了COT提示词，再添加用户的系统提示词和之前的对话
+    last_user_message = _apply_messages(cot_engine, request.messages)
 
     if not last_user_message:
         raise HTTPException(status_code=400, detail="No user message found in the request.")
@@ -961,9 +1192,9 @@ For each step mentioned in the previous text, initiate a small sub-step within e
     # 生成回复
     try:
         print(f"Running CoT chat for user message: {last_user_message[:50]}...")
-        completion_text = engine.chat(last_user_message)
+        completion_text = await cot_engine.achat(last_user_message)
     except Exception as e:
-        print(f"Error during CoT engine.chat: {e}")
+        print(f"Error during CoT engine.achat: {e}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error generating CoT completion: {e}")
@@ -972,10 +1203,12 @@ For each step mentioned in the previous text, initiate a small sub-step within e
     response_message = ChatMessage(role="assistant", content=completion_text)
     choice = ChatCompletionChoice(index=0, message=response_message, finish_reason="stop")
     
+    # 分叉的会话从零开始计量，其累计用量即本次请求的用量
+    cot_usage = cot_engine.get_usage_stats()
     usage = CompletionUsage(
-        prompt_tokens=engine.token_counter.count_tokens(last_user_message), 
-        completion_tokens=engine.token_counter.count_tokens(completion_text), 
-        total_tokens=engine.token_counter.count_tokens(last_user_message) + engine.token_counter.count_tokens(completion_text)
+        prompt_tokens=cot_usage["prompt_tokens"], 
+        completion_tokens=cot_usage["completion_tokens"], 
+        total_tokens=cot_usage["total_tokens"]
     )
 
     return ChatCompletionResponse(
@@ -995,6 +1228,8 @@ def cli():
     # parser.add_argument("--model", "-m", type=str, default=None, help="Override model path/name in config.")
     parser.add_argument("--mcp-candidates", type=int, default=1, help="Number of MCP candidates (1 to disable MCP).")
     parser.add_argument("--reload", action="store_true", help="Enable auto-reloading for development.")
+    parser.add_argument("--static-prompt", action="append", default=[], metavar="NAME=PATH",
+                        help="Precompute a fixed system prompt at startup (repeatable); identical system messages are attached instead of re-ingested.")
 
     args = parser.parse_args()
     
@@ -98,13 +98,60 @@ class SessionManager:
             bool: 是否成功删除
         """
         if session_id in self.sessions:
-            del self.sessions[session_id]
+            session = self.sessions.pop(session_id)
+            # 停止会话的后台摄入和滚动摘要，工作线程不再持有引擎
+            session["engine"].close()
             if session_id in self.session_timeouts:
                 del self.session_timeouts[session_id]
             logger.info(f"删除会话: {session_id}")
             return True
         return False
     
+    def snapshot_session(self, session_id: str) -> Optional[bytes]:
+        """
+        导出会话快照，用于在worker之间迁移、部署后恢复或换出内存
+        
+        Args:
+            session_id: 会话ID
+            
+        Returns:
+            Optional[bytes]: 快照字节串，如果会话不存在则返回None
+        """
+        engine = self.get_session(session_id)
+        if engine is None:
+            return None
+        return engine.snapshot()
+    
+    def restore_session(self, data: bytes, session_id: Optional[str] = None, timeout: Optional[int] = None) -> str:
+        """
+        从快照恢复会话
+        
+        Args:
+            data: KimiEngine.snapshot() 生成的快照
+            session_id: 可选的会话ID，不提供则使用快照中的会话ID
+            timeout: 可选的会话超时时间（秒）
+            
+        Returns:
+            str: 会话ID
+        """
+        try:
+            engine = self.engine_factory()
+            engine.restore(data)
+        except Exception as e:
+            logger.error(f"恢复会话失败: {e}")
+            raise RuntimeError(f"恢复会话失败: {e}")
+            
+        new_session_id = session_id or engine.get_session_id()
+        engine.set_session_id(new_session_id)
+        self.sessions[new_session_id] = {
+            "engine": engine,
+            "created_at": time.time(),
+            "last_accessed": time.time()
+        }
+        self.session_timeouts[new_session_id] = time.time() + (timeout or self.default_timeout)
+        logger.info(f"从快照恢复会话: {new_session_id}")
+        return new_session_id
+    
     def _cleanup_expired_sessions(self) -> None:
         """清理过期会话"""
         current_time = time.time()
@@ -0,0 +1,295 @@
+"""
+openkimi-ingest：离线批量摄入工具
+
+遍历目录中的 txt/pdf/docx 文件，在进程池中提取文本、分块并按信息熵分类，
+在主进程中以有限的并发调用LLM摘要低熵块并编码，结果写入可持久化的会话快照（见 KimiEngine.snapshot），
+之后可用 KimiEngine.from_snapshot() / restore() 直接加载。
+
+运行过程中定期写入检查点（快照 + 进度文件），中断后以相同参数重新运行即从中断处继续；
+检查点的配置（LLM配置除外）与 -c 指定的配置不一致时拒绝恢复，需改回原配置或加 --restart 重新开始。
+
+用法：
+    python -m openkimi.bulk_ingest <目录> -o corpus.bundle [-c config.json] [--workers 4] [--llm-concurrency 4]
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from openkimi.core.processor import TextProcessor
+from openkimi.core.snapshot import unpack_bundle
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".txt", ".pdf", ".docx")
+
+# 工作进程内的文本处理器（由 _init_worker 创建，每个进程一个）
+_processor: Optional[TextProcessor] = None
+_entropy_threshold = 3.0
+
+def extract_text(path: str) -> str:
+    """
+    提取文件的文本内容
+
+    Args:
+        path: txt/pdf/docx 文件路径
+
+    Returns:
+        文本内容
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".pdf":
+        try:
+            import PyPDF2
+        except ImportError:
+            raise RuntimeError("PyPDF2库未安装，无法处理PDF文件")
+        with open(path, "rb") as file:
+            return "".join((page.extract_text() or "") + "\n\n" for page in PyPDF2.PdfReader(file).pages)
+    if extension == ".docx":
+        try:
+            import docx
+        except ImportError:
+            raise RuntimeError("docx库未安装，无法处理Word文档")
+        return "".join(para.text + "\n" for para in docx.Document(path).paragraphs)
+    with open(path, "r", encoding="utf-8", errors="replace") as file:
+        return file.read()
+
+def find_documents(root: str) -> List[str]:
+    """递归列出目录中支持的文件（按路径排序，保证每次运行的顺序一致）"""
+    documents = []
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                documents.append(os.path.join(directory, name))
+    return sorted(documents)
+
+def _document_key(path: str, root: str) -> str:
+    """检查点中文件的键：相对路径 + 大小 + 修改时间，文件被修改后会重新摄入"""
+    stat = os.stat(path)
+    return f"{os.path.relpath(path, root)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+def _init_worker(processor_config: Dict[str, Any]) -> None:
+    global _processor, _entropy_threshold
+    logging.getLogger("openkimi").setLevel(logging.WARNING)
+    _processor = TextProcessor(batch_size=processor_config.get("batch_size", 512),
+                               chunking=processor_config.get("chunking", "words"))
+    _entropy_threshold = processor_config.get("entropy_threshold", 3.0)
+
+def _prepare_document(path: str) -> Dict[str, Any]:
+    """
+    在工作进程中提取文本、分块并按信息熵分类（与 KimiEngine._plan_ingest 的分类方式相同）
+
+    Returns:
+        {"path", "digest", "length", "chunks": [(文本块, 去向)]}
+    """
+    text = extract_text(path)
+    chunks = []
+    if text.strip():
+        batches = _processor.split_into_batches(text)
+        _, less_useful = _processor.classify_by_entropy(batches, threshold=_entropy_threshold)
+        less_useful_set = set(less_useful)
+        chunks = [(batch, "rag" if batch in less_useful_set else "context") for batch in batches]
+    return {
+        "path": path,
+        "digest": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        "length": len(text),
+        "chunks": chunks
+    }
+
+def _config_differences(snapshot_config: Dict[str, Any], config: Dict[str, Any]) -> List[str]:
+    """快照配置与当前配置中取值不同的顶层配置项（LLM配置不随快照保存，不比较）"""
+    # 按JSON归一化（快照中的配置经过JSON序列化）
+    snapshot_config = json.loads(json.dumps(snapshot_config))
+    config = json.loads(json.dumps(config))
+    return sorted(key for key in set(snapshot_config) | set(config)
+                  if key != "llm" and snapshot_config.get(key) != config.get(key))
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+class BulkIngestor:
+    """
+    批量摄入：进程池负责提取和分块，主进程负责摘要、编码和存储，定期写入检查点
+    """
+
+    def __init__(self, engine: Any, root: str, output: str, workers: int = 4,
+                 llm_concurrency: int = 4, checkpoint_every: int = 20):
+        """
+        初始化批量摄入
+
+        Args:
+            engine: 存储摄入结果的 KimiEngine
+            root: 文档目录
+            output: 快照输出路径，进度文件为 <output>.progress.json
+            workers: 提取和分块的进程数
+            llm_concurrency: 同时进行的LLM摘要调用数
+            checkpoint_every: 每摄入多少个文件写一次检查点
+        """
+        self.engine = engine
+        self.root = root
+        self.output = output
+        self.progress_path = f"{output}.progress.json"
+        self.workers = max(1, workers)
+        self.llm_concurrency = max(1, llm_concurrency)
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.completed: Dict[str, str] = {}
+        self.stats: Dict[str, int] = {}
+
+    def resume(self) -> bool:
+        """
+        从已有的检查点恢复（快照和进度文件都存在时）
+
+        Returns:
+            是否恢复
+
+        Raises:
+            ValueError: 检查点的配置与引擎当前的配置不一致（LLM配置除外）
+        """
+        if not (os.path.exists(self.output) and os.path.exists(self.progress_path)):
+            return False
+        with open(self.output, "rb") as f:
+            data = f.read()
+        # restore() 会以快照中的配置为准；配置改动（如分块方式、embedding模型）后继续摄入会混用两套设置
+        differing = _config_differences(unpack_bundle(data)[0].get("config", {}), self.engine.config)
+        if differing:
+            raise ValueError(f"检查点 {self.output} 的配置与当前配置不一致（{', '.join(differing)}）；"
+                             f"请使用原配置继续，或加 --restart 重新开始")
+        self.engine.restore(data)
+        with open(self.progress_path, "r", encoding="utf-8") as f:
+            self.completed = json.load(f).get("completed", {})
+        logger.info(f"Resumed from checkpoint: {len(self.completed)} document(s) already ingested.")
+        return True
+
+    def checkpoint(self) -> None:
+        """写入快照和进度文件（先写快照，中断在两者之间时只会重新处理少量已存储的文件，重复块会被跳过）"""
+        _write_atomic(self.output, self.engine.snapshot())
+        progress = {"root": os.path.abspath(self.root), "completed": self.completed, "updated_at": time.time()}
+        _write_atomic(self.progress_path, json.dumps(progress, ensure_ascii=False).encode("utf-8"))
+
+    def run(self) -> Dict[str, Any]:
+        """
+        摄入目录中所有尚未完成的文件
+
+        Returns:
+            吞吐量统计：documents/chunks/tokens 及每秒速率、failed、skipped、elapsed_seconds
+        """
+        self.stats = {"documents": 0, "chunks": 0, "tokens": 0, "failed": 0, "skipped": 0}
+        pending = []
+        for path in find_documents(self.root):
+            key = _document_key(path, self.root)
+            if key in self.completed:
+                self.stats["skipped"] += 1
+            else:
+                pending.append((path, key))
+        print(f"Found {len(pending) + self.stats['skipped']} document(s), {len(pending)} to ingest.")
+
+        start = time.perf_counter()
+        since_checkpoint = 0
+        processor_config = self.engine.config.get("processor", {})
+        # 主进程摄入比进程池分块慢时，已分块的文档会堆在内存里：最多同时提交 2 * workers 个文档
+        remaining = iter(pending)
+        max_in_flight = 2 * self.workers
+        futures: Dict[concurrent.futures.Future, Tuple[str, str]] = {}
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                    initargs=(processor_config,)) as pool:
+            def fill() -> None:
+                while len(futures) < max_in_flight:
+                    item = next(remaining, None)
+                    if item is None:
+                        return
+                    futures[pool.submit(_prepare_document, item[0])] = item
+            try:
+                fill()
+                while futures:
+                    future = next(iter(concurrent.futures.wait(
+                        futures, return_when=concurrent.futures.FIRST_COMPLETED).done))
+                    path, key = futures.pop(future)
+                    # 先补充提交，主进程摄入期间工作进程继续分块
+                    fill()
+                    try:
+                        prepared = future.result()
+                        stored = self.engine.ingest_prepared(prepared["digest"], prepared["length"],
+                                                             prepared["chunks"], concurrency=self.llm_concurrency)
+                    except Exception as e:
+                        # ingest_prepared 失败时不记为已摄入，也不写入进度，下次运行时重试
+                        self.stats["failed"] += 1
+                        logger.error(f"Failed to ingest {path}: {e}")
+                        continue
+                    self.completed[key] = prepared["digest"]
+                    self.stats["documents"] += 1
+                    self.stats["chunks"] += stored
+                    self.stats["tokens"] += sum(self.engine.token_counter.count_tokens(chunk) for chunk, _ in prepared["chunks"])
+                    since_checkpoint += 1
+                    if since_checkpoint >= self.checkpoint_every:
+                        self.checkpoint()
+                        since_checkpoint = 0
+                        self._report(start, len(pending))
+            except KeyboardInterrupt:
+                for future in futures:
+                    future.cancel()
+                self.checkpoint()
+                print(f"Interrupted; checkpoint written ({len(self.completed)} document(s) done). Re-run to resume.")
+                raise
+        self.checkpoint()
+        return self._report(start, len(pending), final=True)
+
+    def _report(self, start: float, total: int, final: bool = False) -> Dict[str, Any]:
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        report = dict(self.stats)
+        report.update({
+            "elapsed_seconds": elapsed,
+            "docs_per_second": self.stats["documents"] / elapsed,
+            "chunks_per_second": self.stats["chunks"] / elapsed,
+            "tokens_per_second": self.stats["tokens"] / elapsed
+        })
+        prefix = "Done" if final else f"[{self.stats['documents'] + self.stats['failed']}/{total}]"
+        print(f"{prefix}: {report['documents']} docs, {report['chunks']} chunks, {report['tokens']} tokens in {elapsed:.1f}s "
+              f"({report['docs_per_second']:.2f} docs/s, {report['chunks_per_second']:.1f} chunks/s, "
+              f"{report['tokens_per_second']:.0f} tokens/s); {report['failed']} failed, {report['skipped']} skipped")
+        return report
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="openkimi-ingest", description="Bulk-ingest a directory of txt/pdf/docx files into a persistent OpenKimi RAG bundle.")
+    parser.add_argument("directory", help="Directory to walk for .txt/.pdf/.docx files.")
+    parser.add_argument("--output", "-o", required=True, help="Path of the bundle to write (loadable with KimiEngine.from_snapshot).")
+    parser.add_argument("--config", "-c", type=str, default=None, help="Path to KimiEngine JSON config file.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes used for text extraction and chunking.")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="Maximum concurrent LLM summarization calls.")
+    parser.add_argument("--checkpoint-every", type=int, default=20, help="Write a checkpoint every N ingested documents.")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start over.")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        print(f"ERROR: 目录不存在: {args.directory}")
+        return 1
+
+    from openkimi import KimiEngine
+    engine = KimiEngine(config_path=args.config)
+    ingestor = BulkIngestor(engine, args.directory, args.output, workers=args.workers,
+                            llm_concurrency=args.llm_concurrency, checkpoint_every=args.checkpoint_every)
+    try:
+        if not args.restart and ingestor.resume():
+            print(f"Resuming from {args.output} ({len(ingestor.completed)} document(s) already ingested).")
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return 1
+    try:
+        ingestor.run()
+    except KeyboardInterrupt:
+        return 130
+    usage = engine.get_usage_stats()
+    print(f"LLM usage: {usage['prompt_tokens']} prompt + {usage['completion_tokens']} completion tokens in {usage['calls']} call(s).")
+    print(f"Bundle written to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+import logging
+from typing import List
+
+class BudgetItem:
+    """可放入提示的一段候选内容"""
+
+    def __init__(self, kind: str, text: str, tokens: int, value: float, required: bool = False, order: int = 0):
+        """
+        初始化候选内容
+
+        Args:
+            kind: 内容类型，如 "history"、"rag"、"framework"、"document"
+            text: 内容文本
+            tokens: 内容的token数
+            value: 内容价值（越大越重要）
+            required: 是否必须放入（如当前查询、框架）
+            order: 组装提示时的排序键
+        """
+        self.kind = kind
+        self.text = text
+        self.tokens = tokens
+        self.value = value
+        self.required = required
+        self.order = order
+
+    @property
+    def density(self) -> float:
+        """单位token的价值"""
+        return self.value / max(self.tokens, 1)
+
+    def __repr__(self) -> str:
+        return f"BudgetItem(kind={self.kind!r}, tokens={self.tokens}, value={self.value:.3f}, required={self.required})"
+
+class TokenBudgetPlanner:
+    """
+    token预算规划器：在 max_tokens 内选出总价值最高的候选内容子集
+
+    先放入必需内容，其余按价值密度（value / tokens）贪心装入；
+    若单个最有价值且放得下的候选比贪心结果总价值更高，则改用它（经典的0-1背包贪心修正，
+    保证至少达到最优解的一半）。
+    """
+
+    def __init__(self, max_tokens: int):
+        """
+        初始化规划器
+
+        Args:
+            max_tokens: 可用的token预算
+        """
+        self.logger = logging.getLogger(__name__)
+        self.max_tokens = max_tokens
+
+    def plan(self, items: List[BudgetItem]) -> List[BudgetItem]:
+        """
+        选出放入提示的候选内容
+
+        Args:
+            items: 候选内容列表
+
+        Returns:
+            按 order 排序的已选内容
+        """
+        required = [item for item in items if item.required]
+        optional = [item for item in items if not item.required]
+
+        used = sum(item.tokens for item in required)
+        if used > self.max_tokens:
+            self.logger.warning(f"必需内容已超出预算（{used} > {self.max_tokens}），由调用方负责压缩")
+        remaining = max(self.max_tokens - used, 0)
+
+        greedy: List[BudgetItem] = []
+        greedy_tokens = 0
+        for item in sorted(optional, key=lambda x: (x.density, x.value), reverse=True):
+            if greedy_tokens + item.tokens <= remaining:
+                greedy.append(item)
+                greedy_tokens += item.tokens
+
+        fitting = [item for item in optional if item.tokens <= remaining]
+        if fitting:
+            best_single = max(fitting, key=lambda x: x.value)
+            if best_single.value > sum(item.value for item in greedy):
+                greedy = [best_single]
+                greedy_tokens = best_single.tokens
+
+        self.logger.debug(
+            f"预算规划: 候选{len(items)}项，选中{len(required) + len(greedy)}项，"
+            f"使用{used + greedy_tokens}/{self.max_tokens} tokens"
+        )
+        return sorted(required + greedy, key=lambda x: x.order)
@@ -0,0 +1,182 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+class SemanticCache:
+    """
+    语义回答缓存：以查询向量（相似度阈值）加上上下文键为键
+
+    上下文键由调用方决定（见 KimiEngine._response_cache_key：已摄入上下文的指纹，会话级缓存还包含历史哈希）。
+    命中条件为上下文键完全一致且与某条缓存查询的余弦相似度不低于阈值；
+    条目超过 ttl 秒即失效，数量超过 max_entries 时淘汰最久未使用的条目。
+    线程安全，可在多个会话之间共享（见 get_global_cache）。
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, ttl: float = 3600, max_entries: int = 1024):
+        """
+        初始化语义缓存
+
+        Args:
+            similarity_threshold: 判定为同一问题的最低余弦相似度
+            ttl: 条目存活时间（秒）
+            max_entries: 最大条目数
+        """
+        self.logger = logging.getLogger(__name__)
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> "SemanticCache":
+        """根据 config['cache'] 创建缓存"""
+        config = config or {}
+        return cls(
+            similarity_threshold=config.get("similarity_threshold", 0.95),
+            ttl=config.get("ttl", 3600),
+            max_entries=config.get("max_entries", 1024)
+        )
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _evict_expired(self, now: float) -> None:
+        expired = [key for key, entry in self._entries.items() if now - entry["created_at"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, embedding: np.ndarray, fingerprint: str) -> Optional[str]:
+        """
+        查找语义相近的已缓存回答
+
+        Args:
+            embedding: 查询向量
+            fingerprint: 上下文键
+
+        Returns:
+            缓存的回答，未命中返回None
+        """
+        query = self._normalize(embedding)
+        with self._lock:
+            self._evict_expired(time.time())
+            keys = [key for key, entry in self._entries.items() if entry["fingerprint"] == fingerprint]
+            if keys:
+                matrix = np.stack([self._entries[key]["embedding"] for key in keys])
+                similarities = matrix @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    key = keys[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.logger.debug(f"语义缓存命中，相似度 {similarities[best]:.4f}")
+                    return self._entries[key]["answer"]
+            self.misses += 1
+            return None
+
+    def store(self, embedding: np.ndarray, fingerprint: str, answer: str) -> None:
+        """
+        缓存一条回答
+
+        Args:
+            embedding: 查询向量
+            fingerprint: 上下文键
+            answer: 回答文本
+        """
+        with self._lock:
+            self._entries[self._next_id] = {
+                "embedding": self._normalize(embedding),
+                "fingerprint": fingerprint,
+                "answer": answer,
+                "created_at": time.time()
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取命中次数、未命中次数和当前条目数"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+class ResultCache:
+    """
+    按精确键缓存计算结果（如压缩结果），超过 ttl 秒失效，超过 max_entries 时淘汰最久未使用的条目
+
+    线程安全，可在多个会话之间共享。
+    """
+
+    def __init__(self, ttl: float = 3600, max_entries: int = 128):
+        """
+        初始化结果缓存
+
+        Args:
+            ttl: 条目存活时间（秒）
+            max_entries: 最大条目数
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """获取缓存的结果，未命中或已失效时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Any) -> None:
+        """缓存一条结果"""
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取命中次数、未命中次数和当前条目数"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+_global_cache: Optional[SemanticCache] = None
+_global_cache_lock = threading.Lock()
+
+def get_global_cache(config: Optional[Dict[str, Any]] = None) -> SemanticCache:
+    """
+    获取进程内所有会话共享的语义缓存（首次调用时按配置创建）
+
+    Args:
+        config: config['cache'] 配置，仅在首次创建时生效
+
+    Returns:
+        全局共享的 SemanticCache
+    """
+    global _global_cache
+    with _global_cache_lock:
+        if _global_cache is None:
+            _global_cache = SemanticCache.from_config(config)
+        return _global_cache
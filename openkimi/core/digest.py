@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+class RollingSummarizer:
+    """
+    空闲时的后台滚动摘要：在用户阅读或输入的间隙，把老化的对话轮次合并进一份滚动摘要
+
+    摘要覆盖 history[:upto]，下一轮规划上下文时用它代替这些消息，因此不必在请求路径上等待压缩。
+    每次调度都在独立的守护线程中先等待 idle_seconds，新的请求到来时调用 cancel()：
+    尚未开始的摘要直接放弃，正在进行的摘要结果会被丢弃（LLM调用本身无法中断），不阻塞新请求。
+    """
+
+    def __init__(self, summarize_fn: Callable[[str, str], str], idle_seconds: float = 2.0):
+        """
+        初始化滚动摘要器
+
+        Args:
+            summarize_fn: 摘要函数，参数为 (已有摘要, 新的对话文本)，返回合并后的摘要
+            idle_seconds: 调度后等待多久（秒）才开始摘要
+        """
+        self.logger = logging.getLogger(__name__)
+        self.summarize_fn = summarize_fn
+        self.idle_seconds = idle_seconds
+        self.text = ""
+        self.upto = 0
+        self.stats: Dict[str, Any] = {"runs": 0, "cancelled": 0, "failed": 0, "last_duration": None}
+        self._lock = threading.Lock()
+        self._cancel: Optional[threading.Event] = None
+        self._thread: Optional[threading.Thread] = None
+        # reset()/load() 后递增，使旧状态上开始的摘要不会被提交
+        self._epoch = 0
+
+    def current(self) -> Tuple[str, int]:
+        """
+        当前的摘要及其覆盖范围
+
+        Returns:
+            (摘要文本, 已覆盖的消息数)
+        """
+        with self._lock:
+            return self.text, self.upto
+
+    @property
+    def pending(self) -> bool:
+        """是否有已调度、尚未结束的摘要"""
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    def schedule(self, turns: List[str], upto: int) -> None:
+        """
+        调度一次后台摘要（会先取消尚未结束的上一次）
+
+        Args:
+            turns: 需要并入摘要的消息文本，即 history[self.upto:upto]
+            upto: 摘要完成后覆盖的消息数
+        """
+        self.cancel()
+        cancel = threading.Event()
+        with self._lock:
+            epoch = self._epoch
+            self._cancel = cancel
+        self._thread = threading.Thread(
+            target=self._run, args=(turns, upto, cancel, epoch), name="rolling-summary", daemon=True
+        )
+        self._thread.start()
+
+    def cancel(self) -> bool:
+        """
+        取消尚未结束的摘要，不等待其结束
+
+        Returns:
+            是否确实取消了一次进行中的摘要
+        """
+        with self._lock:
+            cancel, self._cancel = self._cancel, None
+        if cancel is None or cancel.is_set() or not self.pending:
+            return False
+        cancel.set()
+        return True
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """等待当前的摘要线程结束（主要用于测试和关闭）"""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def reset(self) -> None:
+        """取消进行中的摘要并清空摘要"""
+        self.load("", 0)
+
+    def load(self, text: str, upto: int) -> None:
+        """
+        替换当前摘要（例如从快照恢复）
+
+        Args:
+            text: 摘要文本
+            upto: 摘要覆盖的消息数
+        """
+        self.cancel()
+        with self._lock:
+            self._epoch += 1
+            self.text = text
+            self.upto = upto
+
+    def _run(self, turns: List[str], upto: int, cancel: threading.Event, epoch: int) -> None:
+        if cancel.wait(self.idle_seconds):
+            self.stats["cancelled"] += 1
+            return
+        with self._lock:
+            previous = self.text
+        start = time.perf_counter()
+        try:
+            digest = self.summarize_fn(previous, "\n\n".join(turns)).strip()
+        except Exception as e:
+            self.stats["failed"] += 1
+            self.logger.error(f"后台滚动摘要失败: {e}")
+            return
+        with self._lock:
+            if cancel.is_set() or epoch != self._epoch or not digest:
+                self.stats["cancelled"] += 1
+                self.logger.debug("Rolling summary discarded (cancelled or state changed).")
+                return
+            self.text = digest
+            self.upto = upto
+        self.stats["runs"] += 1
+        self.stats["last_duration"] = time.perf_counter() - start
+        self.logger.info(f"Rolling summary now covers {upto} message(s) ({self.stats['last_duration']:.2f}s).")
@@ -0,0 +1,169 @@
+import logging
+import threading
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+from openkimi.utils.tracing import traced
+
+class DocumentStore:
+    """
+    原文向量存储：保存文本块本身（不做摘要）及其归一化向量，按余弦相似度检索
+
+    与 RAGManager 共用同一个embedding模型；检索为一次矩阵乘法，
+    对单个会话的数据规模（数千个块）足够快，不需要额外的索引结构。
+    """
+
+    def __init__(self, embedding_model: Any, name: str = "documents"):
+        """
+        初始化文档存储
+
+        Args:
+            embedding_model: 提供 encode(texts) 的embedding模型
+            name: 存储名称，用于日志和trace
+        """
+        self.logger = logging.getLogger(__name__)
+        self.embedding_model = embedding_model
+        self.name = name
+        self.texts: List[str] = []
+        self._text_set = set()
+        self._matrix: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        # fork() 之后与另一个存储共享文本列表，首次添加前复制（向量矩阵每次添加都会重新分配，无需复制）
+        self._shared = False
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(1, -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+    @traced("DocumentStore.add", category="rag")
+    def add(self, texts: List[str], embeddings: Optional[np.ndarray] = None) -> int:
+        """
+        添加文本块（已存在的相同文本会被跳过），所有新文本一次性编码
+
+        Args:
+            texts: 文本块列表
+            embeddings: 已计算好的向量，可选
+
+        Returns:
+            实际新增的文本块数量
+        """
+        seen = set()
+        keep = []
+        for i, text in enumerate(texts):
+            if text.strip() and text not in self._text_set and text not in seen:
+                seen.add(text)
+                keep.append(i)
+        if not keep:
+            return 0
+        new_texts = [texts[i] for i in keep]
+        if embeddings is not None:
+            vectors = np.asarray(embeddings, dtype=np.float32)[keep]
+        else:
+            vectors = self.embedding_model.encode(new_texts)
+        normalized = self._normalize(np.asarray(vectors, dtype=np.float32).reshape(len(new_texts), -1))
+
+        with self._lock:
+            if self._shared:
+                self.texts, self._text_set = list(self.texts), set(self._text_set)
+                self._shared = False
+            self.texts.extend(new_texts)
+            self._text_set.update(new_texts)
+            self._matrix = normalized if self._matrix is None else np.vstack([self._matrix, normalized])
+        self.logger.debug(f"[{self.name}] 新增{len(new_texts)}个文本块，共{len(self.texts)}个")
+        return len(new_texts)
+
+    @traced("DocumentStore.search", category="rag")
+    def search(self, query: str, top_k: int = 3, query_embedding: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """
+        检索与查询最相关的文本块
+
+        Args:
+            query: 查询文本
+            top_k: 返回的最大结果数量
+            query_embedding: 已计算好的查询向量，可选
+
+        Returns:
+            按相似度从高到低排列的 (文本, 余弦相似度) 列表，只包含相似度大于0的结果
+        """
+        if not self.texts:
+            return []
+        if query_embedding is None:
+            query_embedding = self.embedding_model.encode(query)
+        return self.search_batch([query], top_k=top_k, query_embeddings=np.asarray(query_embedding).reshape(1, -1))[0]
+
+    def search_batch(self, queries: List[str], top_k: int = 3, query_embeddings: Optional[np.ndarray] = None) -> List[List[Tuple[str, float]]]:
+        """
+        批量检索，返回与 queries 一一对应的结果（格式同 search）
+        """
+        with self._lock:
+            texts, matrix = self.texts, self._matrix
+        if matrix is None or not queries:
+            return [[] for _ in queries]
+        if query_embeddings is None:
+            query_embeddings = self.embedding_model.encode(list(queries))
+        similarities = self._normalize(np.asarray(query_embeddings).reshape(len(queries), -1)) @ matrix.T
+        k = min(top_k, len(texts))
+        top_indices = np.argsort(-similarities, axis=1)[:, :k]
+        return [
+            [(texts[i], float(similarities[row, i])) for i in top_indices[row] if similarities[row, i] > 0]
+            for row in range(len(queries))
+        ]
+
+    def fork(self, name: Optional[str] = None) -> "DocumentStore":
+        """
+        O(1) 复制：新存储与当前存储共享文本和向量，任一方添加内容时才复制
+
+        Args:
+            name: 新存储的名称，默认沿用当前名称
+
+        Returns:
+            新的文档存储
+        """
+        forked = DocumentStore(self.embedding_model, name or self.name)
+        with self._lock:
+            forked.texts, forked._text_set, forked._matrix = self.texts, self._text_set, self._matrix
+            forked._shared = self._shared = True
+        return forked
+
+    def clear(self) -> None:
+        """清空内容（不影响 fork() 出的其他存储）"""
+        with self._lock:
+            self.texts = []
+            self._text_set = set()
+            self._matrix = None
+            self._shared = False
+
+    def export_state(self) -> Tuple[List[str], np.ndarray]:
+        """
+        导出文本及其（归一化后的）向量，用于会话快照
+
+        Returns:
+            (文本列表, 形状为 (n, dim) 的float32向量矩阵)
+        """
+        with self._lock:
+            matrix = self._matrix if self._matrix is not None else np.zeros((0, 0), dtype=np.float32)
+            return list(self.texts), matrix.copy()
+
+    def load_state(self, texts: List[str], embeddings: np.ndarray) -> None:
+        """
+        从快照恢复，替换当前内容
+
+        Args:
+            texts: 文本列表
+            embeddings: 与文本一一对应的向量矩阵
+        """
+        if len(texts) != len(embeddings):
+            raise ValueError(f"文本数量({len(texts)})与向量数量({len(embeddings)})不一致")
+        with self._lock:
+            self.texts = list(texts)
+            self._text_set = set(texts)
+            self._matrix = self._normalize(embeddings) if len(texts) else None
+            self._shared = False
@@ -1,19 +1,52 @@
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, List, Any, Optional, Tuple, AsyncGenerator
 import os
+import copy
 import json
+import hashlib
+import time
 import logging
 import asyncio
+import threading
+import functools
+import concurrent.futures
+import contextvars
 import uuid
 
 from openkimi.core.processor import TextProcessor
-from openkimi.core.rag import RAGManager
+from openkimi.core.rag import LazyEmbeddingModel, RAGManager
+from openkimi.core.docstore import DocumentStore
 from openkimi.core.framework import FrameworkGenerator
+from openkimi.core.pipeline import Stage, StagePipeline
+from openkimi.core.router import QueryRouter, FAST_PATH, FULL_PATH
+from openkimi.core.history import ConversationHistory
+from openkimi.core.budget import BudgetItem, TokenBudgetPlanner
+from openkimi.core.cache import ResultCache, SemanticCache, get_global_cache
+from openkimi.core.digest import RollingSummarizer
+from openkimi.core.ingest_queue import IngestPlan, IngestionQueue
+from openkimi.core.prompt_artifacts import PromptArtifact
+from openkimi.core.spans import SpanRecorder
+from openkimi.core.snapshot import SNAPSHOT_VERSION, pack_bundle, unpack_bundle
+import numpy as np
 from openkimi.utils.llm_interface import LLMInterface, get_llm_interface, TokenCounter
+from openkimi.utils.tracing import Tracer, activate, trace
+from openkimi.utils.prompt_loader import load_prompt
+from openkimi.utils.usage import UsageMeter, current_meter, metering, staged, usage_stage
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def _run_coroutine_sync(coro):
+    """ Runs a coroutine to completion from synchronous code, even if an event loop is already running in this thread. """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # Called from inside a running loop (e.g. an async FastAPI handler): use a helper thread with its own loop,
+    # carrying over the caller's context (active UsageMeter, tracer)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(contextvars.copy_context().run, asyncio.run, coro).result()
+
 class KimiEngine:
     """OpenKimi主引擎：整合所有模块，提供具有递归RAG和MPR的长对话能力"""
     
@@ -63,9 +96,22 @@ class KimiEngine:
         if session_id:
             logger.info(f"Session ID: {session_id}")
                 
+        # 各组件的初始化耗时（秒）；RAG存储和框架生成器在首次使用时才创建
+        self.init_timings: Dict[str, float] = {}
+        self._rag_manager: Optional[RAGManager] = None
+        self._framework_generator: Optional[FrameworkGenerator] = None
+        self._document_store: Optional[DocumentStore] = None
+        self._turn_store: Optional[DocumentStore] = None
+        # 已移出历史窗口并编入 turn_store 的消息数（history[:evicted_upto]）
+        self.evicted_upto = 0
+        self._turn_index_lock = threading.Lock()
+        # 可重入：创建文档存储时会顺带创建RAG存储（共用embedding模型）
+        self._lazy_init_lock = threading.RLock()
+        
         # 初始化LLM接口和 Tokenizer
         try:
             logger.info("开始初始化LLM接口...")
+            llm_init_start = time.perf_counter()
             from openkimi.utils.llm_interface import get_llm_interface
             self.llm_interface = get_llm_interface(self.config["llm"])
             if self.llm_interface is None:
@@ -77,6 +123,7 @@ class KimiEngine:
             self.max_context_tokens = self.llm_interface.get_max_context_length() 
             # Reserve some tokens for generation and overhead
             self.max_prompt_tokens = int(self.max_context_tokens * 0.8) 
+            self.init_timings["llm_interface"] = time.perf_counter() - llm_init_start
             logger.info(f"LLM Max Context Tokens: {self.max_context_tokens}, Max Prompt Tokens: {self.max_prompt_tokens}")
         except Exception as e:
             logger.error(f"初始化LLM接口时出错: {e}")
@@ -84,43 +131,81 @@ class KimiEngine:
             traceback.print_exc()
             raise RuntimeError(f"LLM接口初始化失败: {e}")
 
-        # 初始化各个模块
+        # 初始化各个模块（RAGManager 与 FrameworkGenerator 延迟到首次使用时创建）
         try:
             proc_cfg = self.config.get('processor', {})
-            rag_cfg = self.config.get('rag', {})
-            self.processor = TextProcessor(batch_size=proc_cfg.get('batch_size', 512))
-            
-            try:
-                logger.info(f"初始化RAGManager，配置: {rag_cfg}")
-                self.rag_manager = RAGManager(
-                    self.llm_interface, 
-                    embedding_model_name=rag_cfg.get('embedding_model', 'all-MiniLM-L6-v2'),
-                    use_faiss=rag_cfg.get('use_faiss', True)
-                )
-            except Exception as rag_error:
-                logger.error(f"初始化RAGManager时出错: {rag_error}")
-                import traceback
-                traceback.print_exc()
-                raise RuntimeError(f"RAG初始化失败: {rag_error}")
-                
-            self.framework_generator = FrameworkGenerator(self.llm_interface) # FrameworkGenerator now also needs recursive logic potentially
+            self.processor = TextProcessor(batch_size=proc_cfg.get('batch_size', 512), chunking=proc_cfg.get('chunking', 'words'))
+            # 简单查询跳过框架生成的快速路径
+            self.router = QueryRouter.from_config(self.config.get('router'))
+            # 可选的语义回答缓存（会话级或进程级）
+            self.response_cache = self._create_response_cache()
         except Exception as e:
             logger.error(f"初始化模块时出错: {e}")
             import traceback
             traceback.print_exc()
             raise RuntimeError(f"模块初始化失败: {e}")
         
-        # 会话历史
-        self.conversation_history: List[Dict[str, str]] = []
+        # 会话历史（缓存每条消息的token数）
+        self.conversation_history = ConversationHistory(self.token_counter)
+        # 老化对话轮次的滚动摘要（空闲时后台生成，新请求到来时取消）
+        self.rolling_summarizer = RollingSummarizer(
+            self._summarize_turns, idle_seconds=self.config.get("history", {}).get("summary_idle_seconds", 2.0)
+        )
+        # 会话级后台摄入队列（见 ingest_in_background）；分块与哈希表更新由 _ingest_lock 串行化
+        self._ingest_lock = threading.Lock()
+        self.ingest_queue = IngestionQueue(
+            functools.partial(self._plan_ingest, precompress=False), self._store_plan, self._finish_ingest,
+            batch_size=self.config.get("ingest", {}).get("queue_batch_size", 8)
+        )
+        # 已摄入内容的指纹，作为语义缓存键的一部分
+        self.context_fingerprint = ""
+        # 已摄入文本块的哈希表：块哈希 -> 去向（"rag" 或 "context"），重复的块不再摘要和编码
+        self.chunk_table: Dict[str, str] = {}
+        # 已摄入的完整文本摘要：sha256 -> 字符长度。客户端每次请求都会重发系统消息，
+        # 完全相同的文本直接跳过，以已摄入文本为前缀的文本只摄入新增的尾部
+        self.ingest_digests: Dict[str, int] = {}
+        # 正在摄入（已计划、尚未存好）的原文摘要和块哈希，存好后才移入上面两张表，失败时释放
+        self._reserved_digests: Dict[str, int] = {}
+        self._reserved_chunks: Dict[str, str] = {}
+        # 压缩服务的结果缓存，fork() 出的会话共享
+        compress_cfg = self.config.get("compress", {})
+        self.compression_cache = ResultCache(ttl=compress_cfg.get("cache_ttl", 3600), max_entries=compress_cfg.get("cache_entries", 128))
+        # 最近一次 stream_chat 的时延统计（首token延迟、总耗时、片段数）
+        self.last_stream_stats: Dict[str, Any] = {}
+        # 最近一轮对话各阶段的时间线（见 StagePipeline.timings）
+        self.last_stage_timings: Dict[str, Dict[str, float]] = {}
+        # 最近一轮对话的计时区间（见 SpanRecorder.to_dict）
+        self.last_turn_spans: Dict[str, Any] = {}
+        # 追踪模式下最近一轮对话的 Tracer（可导出为 Chrome trace）
+        self.last_trace: Optional[Tracer] = None
+        # LLM token用量：会话累计（含摄入、后台摘要）与最近一轮对话（见 UsageMeter.to_dict）
+        self.session_usage = UsageMeter()
+        self.last_turn_usage: Dict[str, Any] = {}
         logger.info("KimiEngine初始化完成")
         
     def _load_config(self, config_path: Optional[str] = None) -> Dict[str, Any]:
         """ Loads configuration from a JSON file, merging with defaults. """
         default_config = {
             "llm": {"type": "dummy"},
-            "processor": {"batch_size": 512, "entropy_threshold": 3.0},
-            "rag": {"embedding_model": "all-MiniLM-L6-v2", "top_k": 3, "use_faiss": True},
-            "mpr_candidates": 1 # Default to no MPR
+            "processor": {"batch_size": 512, "entropy_threshold": 3.0, "chunking": "words"},
+            # 后台摄入队列每次存储（并使之可检索）的块数
+            "ingest": {"queue_batch_size": 8, "dedupe": True},
+            # "abstractive"：对低熵块调用LLM摘要（递归RAG）；"extractive"：只保留高分句子，不调用LLM
+            "compression_mode": "abstractive",
+            # 压缩服务（compress / compress_stream）：流式压缩的分段大小与结果缓存
+            "compress": {"segment_tokens": 2048, "cache_ttl": 3600, "cache_entries": 128},
+            "rag": {"embedding_model": "all-MiniLM-L6-v2", "top_k": 3, "document_top_k": 3, "use_faiss": True},
+            "mpr_candidates": 1, # Default to no MPR
+            "pipeline": {"stage_timeouts": {"retrieve": 10.0, "history": 10.0, "framework": 120.0, "solution": None}},
+            "router": {"enabled": True, "max_query_tokens": 32, "max_entropy": 4.5, "min_hit_score": 0.5},
+            "budget": {"reserve_tokens": 256, "history_decay": 0.85, "rag_weight": 1.0},
+            # 历史窗口（token数，None表示整个提示预算）；移出窗口的对话轮次会被编码索引，按需检索回提示
+            # rolling_summary：空闲时在后台把最近 summary_keep_messages 条之前的消息合并为滚动摘要
+            "history": {"window_tokens": None, "index_evicted": True, "top_k": 2,
+                        "rolling_summary": False, "summary_idle_seconds": 2.0, "summary_keep_messages": 4,
+                        "summary_min_tokens": 256, "summary_max_tokens": 256},
+            "cache": {"enabled": False, "scope": "session", "similarity_threshold": 0.95, "ttl": 3600, "max_entries": 1024},
+            "tracing": {"enabled": False, "output_dir": None}
         }
         
         if not config_path:
@@ -157,6 +242,261 @@ class KimiEngine:
             logger.error(f"Error loading config file {config_path}: {e}. Using default config.")
             return default_config
             
+    def _create_response_cache(self) -> Optional[SemanticCache]:
+        """ Creates the semantic response cache configured in config['cache'], or None if disabled. """
+        cache_cfg = self.config.get("cache", {})
+        if not cache_cfg.get("enabled", False):
+            return None
+        if cache_cfg.get("scope", "session") == "global":
+            return get_global_cache(cache_cfg)
+        return SemanticCache.from_config(cache_cfg)
+        
+    def _response_cache_key(self, last_answer: Optional[str] = None) -> Optional[str]:
+        """
+        当前会话状态下语义缓存的键，不应查找或写入缓存时为None
+        
+        键 = 已摄入上下文的指纹 + 最近一条助手回复的哈希（空白归一化）。只看最近一轮回复而不是整个历史，
+        同一个问题在相同的上下文下可以重复命中；"再详细一点"这类追问依赖上一轮回复，回复不同则不会命中。
+        全局缓存在会话之间共享，未摄入任何内容时指纹为空，不同用户的会话之间没有共同上下文，不使用全局缓存。
+        
+        Args:
+            last_answer: 作为最近一条助手回复的文本，默认取当前历史中的最后一条
+        """
+        if self.response_cache is None:
+            return None
+        if self.config.get("cache", {}).get("scope", "session") == "global" and not self.context_fingerprint:
+            return None
+        if last_answer is None:
+            last_answer = self.conversation_history.last_content("assistant")
+        normalized = " ".join(last_answer.split())
+        window = hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16] if normalized else ""
+        return f"{self.context_fingerprint}:{window}"
+        
+    @property
+    def rag_manager(self) -> RAGManager:
+        """RAG存储（含embedding模型），首次访问时创建"""
+        if self._rag_manager is None:
+            self._rag_manager = self._lazy_init("rag_manager", self._create_rag_manager)
+        return self._rag_manager
+        
+    @rag_manager.setter
+    def rag_manager(self, value: Optional[RAGManager]) -> None:
+        self._rag_manager = value
+        
+    @property
+    def has_rag_store(self) -> bool:
+        """RAG存储是否已创建（未创建时没有任何可检索内容）"""
+        return self._rag_manager is not None
+        
+    @property
+    def document_store(self) -> DocumentStore:
+        """摄入文档中高信息熵文本块的原文存储，与RAG存储共用embedding模型，首次访问时创建"""
+        if self._document_store is None:
+            self._document_store = self._lazy_init(
+                "document_store", lambda: DocumentStore(self.embedding_model, name="documents")
+            )
+        return self._document_store
+        
+    @document_store.setter
+    def document_store(self, value: Optional[DocumentStore]) -> None:
+        self._document_store = value
+        
+    @property
+    def turn_store(self) -> DocumentStore:
+        """移出历史窗口的对话轮次的向量存储，首次访问时创建"""
+        if self._turn_store is None:
+            self._turn_store = self._lazy_init(
+                "turn_store", lambda: DocumentStore(self.embedding_model, name="turns")
+            )
+        return self._turn_store
+        
+    @turn_store.setter
+    def turn_store(self, value: Optional[DocumentStore]) -> None:
+        self._turn_store = value
+        
+    def _loaded_embedding_model(self) -> Optional[Any]:
+        """ The embedding model already loaded by one of this session's stores, or None. """
+        for store in (self._rag_manager, self._document_store, self._turn_store):
+            if store is not None:
+                return store.embedding_model
+        return None
+        
+    @property
+    def embedding_model(self) -> Any:
+        """查询和文本块编码用的embedding模型：优先复用已创建的存储中的模型，都未创建时才创建RAG存储（加载模型）"""
+        loaded = self._loaded_embedding_model()
+        return loaded if loaded is not None else self.rag_manager.embedding_model
+        
+    @property
+    def has_retrievable_content(self) -> bool:
+        """是否已有可检索的内容（RAG摘要、文档块或已移出窗口的对话轮次）"""
+        return self._rag_manager is not None or self._document_store is not None or self._turn_store is not None
+        
+    def _history_window_tokens(self) -> int:
+        """ Token size of the recent-history window (never larger than the prompt budget). """
+        budget = max(self.max_prompt_tokens - self.config.get("budget", {}).get("reserve_tokens", 256), 0)
+        window = self.config.get("history", {}).get("window_tokens")
+        return min(budget, window) if window else budget
+        
+    def _has_unindexed_evictions(self) -> bool:
+        """ Whether some turns left the history window since they were last indexed (a cheap bisect). """
+        if not self.config.get("history", {}).get("index_evicted", True):
+            return False
+        history = self.conversation_history
+        start = min(history.window_start(self._history_window_tokens()), len(history) - 1)
+        return start > self.evicted_upto
+        
+    def _index_evicted_turns(self) -> int:
+        """
+        将移出历史窗口、尚未索引的消息编码存入 turn_store
+        
+        Returns:
+            新索引的消息数
+        """
+        with self._turn_index_lock:
+            history = self.conversation_history
+            # 当前（最新）消息永远不会被移出
+            start = min(history.window_start(self._history_window_tokens()), len(history) - 1)
+            if start <= self.evicted_upto:
+                return 0
+            texts = [history.format_message(message) for message in history[self.evicted_upto:start]]
+            with trace("index_evicted_turns", category="engine", messages=len(texts)):
+                self.turn_store.add(texts)
+            logger.info(f"Indexed {len(texts)} evicted message(s) ({self.evicted_upto}..{start}) for retrieval.")
+            self.evicted_upto = start
+            return len(texts)
+        
+    def _retrieve(self, query: str, query_embedding: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """
+        同时检索RAG摘要和文档块，按相似度合并
+        
+        Returns:
+            按相似度从高到低排列的 (文本, 相似度) 列表
+        """
+        rag_cfg = self.config.get('rag', {})
+        if query_embedding is None:
+            with trace("encode_query", category="rag"):
+                query_embedding = self.embedding_model.encode(query)
+        hits = []
+        if self._rag_manager is not None:
+            hits.extend(self._rag_manager.retrieve_with_scores(query, top_k=rag_cfg.get('top_k', 3), query_embedding=query_embedding))
+        if self._document_store is not None:
+            hits.extend(self._document_store.search(query, top_k=rag_cfg.get('document_top_k', 3), query_embedding=query_embedding))
+        if self._turn_store is not None:
+            hits.extend(self._turn_store.search(query, top_k=self.config.get('history', {}).get('top_k', 2), query_embedding=query_embedding))
+        return sorted(hits, key=lambda hit: hit[1], reverse=True)
+        
+    def _retrieve_batch(self, queries: List[str], query_embeddings: np.ndarray) -> List[List[Tuple[str, float]]]:
+        """ Batched _retrieve(): one matrix search per store for all queries. """
+        merged = [[] for _ in queries]
+        for _, per_query in self._search_stores(queries, query_embeddings):
+            for hits, batch_hits in zip(merged, per_query):
+                hits.extend(batch_hits)
+        return [sorted(hits, key=lambda hit: hit[1], reverse=True) for hits in merged]
+        
+    def _search_stores(self, queries: List[str], query_embeddings: np.ndarray,
+                       top_k: Optional[int] = None) -> List[Tuple[str, List[List[Tuple[str, float]]]]]:
+        """
+        在每个已创建的存储中批量检索
+        
+        Args:
+            queries: 查询列表
+            query_embeddings: 查询向量矩阵
+            top_k: 每个存储返回的条数，不提供时按配置
+            
+        Returns:
+            [(来源, 每个查询的 (文本, 相似度) 列表)]，来源为 "rag"、"document" 或 "history"
+        """
+        rag_cfg = self.config.get('rag', {})
+        results = []
+        if self._rag_manager is not None:
+            results.append(("rag", self._rag_manager.retrieve_batch_with_scores(
+                queries, top_k=top_k or rag_cfg.get('top_k', 3), query_embeddings=query_embeddings)))
+        if self._document_store is not None:
+            results.append(("document", self._document_store.search_batch(
+                queries, top_k=top_k or rag_cfg.get('document_top_k', 3), query_embeddings=query_embeddings)))
+        if self._turn_store is not None:
+            results.append(("history", self._turn_store.search_batch(
+                queries, top_k=top_k or self.config.get('history', {}).get('top_k', 2), query_embeddings=query_embeddings)))
+        return results
+        
+    def retrieve(self, queries: List[str], top_k: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+        """
+        直接检索会话的RAG摘要、文档块和已移出窗口的对话轮次，不调用LLM
+        
+        所有查询一次编码、每个存储一次矩阵检索；会话中尚无可检索内容时不加载embedding模型。
+        
+        Args:
+            queries: 查询列表
+            top_k: 每个查询最多返回的条数，不提供时按各存储的配置
+            
+        Returns:
+            与 queries 一一对应的命中列表，每条为 {"text", "score", "source"}，按相似度从高到低排列
+        """
+        if not queries:
+            return []
+        if self._has_unindexed_evictions():
+            self._index_evicted_turns()
+        if not self.has_retrievable_content:
+            return [[] for _ in queries]
+        with trace("encode_query", category="rag", queries=len(queries)):
+            query_embeddings = np.asarray(self.embedding_model.encode(list(queries)), dtype=np.float32).reshape(len(queries), -1)
+        merged = [[] for _ in queries]
+        for source, per_query in self._search_stores(queries, query_embeddings, top_k=top_k):
+            for hits, batch_hits in zip(merged, per_query):
+                hits.extend({"text": text, "score": float(score), "source": source} for text, score in batch_hits)
+        results = []
+        for hits in merged:
+            hits.sort(key=lambda hit: hit["score"], reverse=True)
+            results.append(hits[:top_k] if top_k else hits)
+        return results
+        
+    @property
+    def framework_generator(self) -> FrameworkGenerator:
+        """框架生成器，首次访问时创建"""
+        if self._framework_generator is None:
+            self._framework_generator = self._lazy_init("framework_generator", lambda: FrameworkGenerator(self.llm_interface))
+        return self._framework_generator
+        
+    @framework_generator.setter
+    def framework_generator(self, value: Optional[FrameworkGenerator]) -> None:
+        self._framework_generator = value
+        
+    def _lazy_init(self, name: str, factory):
+        """ Builds a deferred component once (thread-safe) and records how long it took in init_timings. """
+        with self._lazy_init_lock:
+            existing = getattr(self, f"_{name}")
+            if existing is not None:
+                return existing
+            start = time.perf_counter()
+            with trace(f"init:{name}", category="engine"):
+                component = factory()
+            self.init_timings[name] = time.perf_counter() - start
+            logger.info(f"Deferred init of {name} took {self.init_timings[name]:.3f}s")
+            return component
+            
+    def _create_rag_manager(self, embedding_model: Any = None, vector_dimension: Optional[int] = None) -> RAGManager:
+        """ Creates a RAGManager from config['rag'] (reusing the given or already loaded embedding model, if any). """
+        rag_cfg = self.config.get('rag', {})
+        try:
+            logger.info(f"初始化RAGManager，配置: {rag_cfg}")
+            return RAGManager(
+                self.llm_interface, 
+                embedding_model_name=rag_cfg.get('embedding_model', 'all-MiniLM-L6-v2'),
+                use_faiss=rag_cfg.get('use_faiss', True),
+                embedding_model=embedding_model if embedding_model is not None else self._loaded_embedding_model(),
+                vector_dimension=vector_dimension
+            )
+        except Exception as rag_error:
+            logger.error(f"初始化RAGManager时出错: {rag_error}")
+            import traceback
+            traceback.print_exc()
+            raise RuntimeError(f"RAG初始化失败: {rag_error}")
+            
+    def get_init_timings(self) -> Dict[str, float]:
+        """获取各组件的初始化耗时（秒），延迟创建的组件在首次使用后才会出现"""
+        return dict(self.init_timings)
+        
     def _recursive_rag_compress(self, text: str, target_token_limit: int) -> str:
         """ Recursively compresses text using RAG until it fits the token limit. """
         current_tokens = self.token_counter.count_tokens(text)
@@ -168,22 +508,17 @@ class KimiEngine:
 
         logger.info(f"Text exceeds limit ({current_tokens} > {target_token_limit}). Compressing...")
         # Use a temporary RAG store for this compression cycle
-        rag_cfg = self.config.get('rag', {})
-        temp_rag = RAGManager(
-            self.llm_interface, 
-            embedding_model_name=rag_cfg.get('embedding_model', 'all-MiniLM-L6-v2'),
-            use_faiss=rag_cfg.get('use_faiss', True)
-        )
+        temp_rag = self._create_rag_manager()
         
         # Split, classify, and store less useful parts
         batches = self.processor.split_into_batches(text)
         useful_batches, less_useful_batches = self.processor.classify_by_entropy(
             batches, threshold=self.config['processor'].get('entropy_threshold', 3.0)
         )
-        temp_rag.batch_store(less_useful_batches)
+        summaries = temp_rag.batch_store(less_useful_batches)
         
-        # Keep useful parts + summaries of less useful parts (represented by keys)
-        compressed_text_parts = useful_batches + list(temp_rag.rag_store.keys())
+        # Keep useful parts + summaries of less useful parts
+        compressed_text_parts = useful_batches + summaries
         compressed_text = "\n".join(compressed_text_parts) # Join useful text and summaries
         new_tokens = self.token_counter.count_tokens(compressed_text)
         
@@ -203,239 +538,1299 @@ class KimiEngine:
         else:
             return compressed_text
             
-    def _prepare_llm_input(self, prompt: str) -> str:
-        """ Ensures the prompt fits within the model's limit using recursive RAG. """
+    def _extractive_compress(self, text: str, target_token_limit: int, query: Optional[str] = None) -> str:
+        """ Compresses text without any LLM call by keeping the highest-scoring sentences. """
+        compressed = self.processor.compress_extractive(
+            text, target_token_limit, self.token_counter.count_tokens, query=query
+        )
+        if not compressed:
+            # 没有能放入预算的完整句子，只能截断
+            logger.warning("Extractive compression kept no sentence. Truncating.")
+            encoded = self.tokenizer.encode(text, max_length=target_token_limit, truncation=True)
+            return self.tokenizer.decode(encoded)
+        logger.info(f"Extractive compression reduced tokens to {self.token_counter.count_tokens(compressed)}")
+        return compressed
+        
+    def _prepare_llm_input(self, prompt: str, query: Optional[str] = None) -> str:
+        """ Ensures the prompt fits within the model's limit using recursive RAG (or extractive compression, see compression_mode). """
         prompt_tokens = self.token_counter.count_tokens(prompt)
         if prompt_tokens <= self.max_prompt_tokens:
             return prompt
+        elif self.config.get("compression_mode", "abstractive") == "extractive":
+            logger.info(f"Prompt too long ({prompt_tokens} tokens > {self.max_prompt_tokens}). Applying extractive compression.")
+            return self._extractive_compress(prompt, self.max_prompt_tokens, query=query)
         else:
             logger.info(f"Prompt too long ({prompt_tokens} tokens > {self.max_prompt_tokens}). Applying RAG compression.")
-            return self._recursive_rag_compress(prompt, self.max_prompt_tokens)
+            with usage_stage("compression"):
+                return self._recursive_rag_compress(prompt, self.max_prompt_tokens)
+
+    def compress(self, text: str, target_tokens: int, mode: Optional[str] = None, query: Optional[str] = None) -> Dict[str, Any]:
+        """
+        把文本压缩到 target_tokens 以内（对外的压缩服务，不修改会话状态）
+
+        结果按 (文本哈希, 预算, 方式, 查询) 缓存在 compression_cache 中，相同的请求直接返回。
+
+        Args:
+            text: 需要压缩的文本
+            target_tokens: 目标token数
+            mode: "abstractive"（递归RAG摘要）或 "extractive"（只保留高分句子，不调用LLM），默认取 compression_mode
+            query: 抽取式压缩时优先保留与之相关的句子，可选
+
+        Returns:
+            {"compressed", "original_tokens", "compressed_tokens", "ratio", "mode", "cached", "elapsed_seconds", "usage"}
+        """
+        mode = mode or self.config.get("compression_mode", "abstractive")
+        if mode not in ("abstractive", "extractive"):
+            raise ValueError(f"未知的压缩方式: {mode}")
+        if target_tokens <= 0:
+            raise ValueError("target_tokens 必须为正数")
+        start = time.perf_counter()
+        original_tokens = self.token_counter.count_tokens(text)
+        key = hashlib.sha256(json.dumps([text, target_tokens, mode, query], ensure_ascii=False).encode("utf-8")).hexdigest()
+        meter = UsageMeter(parent=self.session_usage)
+        compressed = self.compression_cache.get(key)
+        cached = compressed is not None
+        if not cached:
+            with metering(meter), usage_stage("compression"):
+                if original_tokens <= target_tokens:
+                    compressed = text
+                elif mode == "extractive":
+                    compressed = self._extractive_compress(text, target_tokens, query=query)
+                else:
+                    # 先初始化会话的RAG存储，压缩用的临时RAG复用其embedding模型，不必每次重新加载
+                    self.rag_manager
+                    compressed = self._recursive_rag_compress(text, target_tokens)
+            self.compression_cache.put(key, compressed)
+        compressed_tokens = self.token_counter.count_tokens(compressed)
+        return {
+            "compressed": compressed,
+            "original_tokens": original_tokens,
+            "compressed_tokens": compressed_tokens,
+            "ratio": compressed_tokens / original_tokens if original_tokens else 1.0,
+            "mode": mode,
+            "cached": cached,
+            "elapsed_seconds": time.perf_counter() - start,
+            "usage": meter.to_dict()
+        }
+
+    def _compression_segments(self, text: str, segment_tokens: int) -> List[Tuple[str, int]]:
+        """ Splits text at paragraph boundaries into segments of about segment_tokens tokens, returned with their token counts. """
+        segments = []
+        current, current_tokens = [], 0
+        for paragraph in text.split("\n\n"):
+            tokens = self.token_counter.count_tokens(paragraph)
+            if current and current_tokens + tokens > segment_tokens:
+                segments.append(("\n\n".join(current), current_tokens))
+                current, current_tokens = [], 0
+            current.append(paragraph)
+            current_tokens += tokens
+        if current:
+            segments.append(("\n\n".join(current), current_tokens))
+        return segments
+
+    async def compress_stream(self, text: str, target_tokens: int, mode: Optional[str] = None,
+                              query: Optional[str] = None) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        分段流式压缩超长文本：按段落切成约 compress.segment_tokens 的片段，按片段长度比例分配预算，
+        每压缩完一段立即返回，客户端不必等待整个文本处理完
+
+        Args:
+            text: 需要压缩的文本
+            target_tokens: 整个文本的目标token数
+            mode: 压缩方式，见 compress()
+            query: 抽取式压缩的相关查询，可选
+
+        Yields:
+            每段一个 compress() 结果（附加 "index" 和 "segments"），最后是汇总
+            {"done": True, "original_tokens", "compressed_tokens", "ratio", "elapsed_seconds", "usage"}
+        """
+        start = time.perf_counter()
+        segment_tokens = self.config.get("compress", {}).get("segment_tokens", 2048)
+        segments = await asyncio.to_thread(self._compression_segments, text, segment_tokens)
+        total_tokens = sum(tokens for _, tokens in segments) or 1
+        compressed_tokens = 0
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        for index, (segment, tokens) in enumerate(segments):
+            budget = max(1, round(target_tokens * tokens / total_tokens))
+            result = await asyncio.to_thread(self.compress, segment, budget, mode, query)
+            compressed_tokens += result["compressed_tokens"]
+            for key in usage:
+                usage[key] += result["usage"][key]
+            yield {"index": index, "segments": len(segments), **result}
+        original_tokens = sum(tokens for _, tokens in segments)
+        yield {
+            "done": True,
+            "original_tokens": original_tokens,
+            "compressed_tokens": compressed_tokens,
+            "ratio": compressed_tokens / original_tokens if original_tokens else 1.0,
+            "elapsed_seconds": time.perf_counter() - start,
+            "usage": usage
+        }
 
     def ingest(self, text: str) -> None:
         """
         摄入文本，进行预处理和RAG存储 (handles potential long input)
         """
         logger.info(f"Ingesting text of length {len(text)} characters.")
-        # Check if the initial text itself needs compression before even batching for main RAG
-        ingest_text = self._prepare_llm_input(text) # Use max_prompt_tokens as a general limit for manageable chunks
+        self.rolling_summarizer.cancel()
+        plan = self._plan_ingest(text)
+        if plan is not None:
+            self._run_plan(plan)
+            
+    def ingest_in_background(self, text: str, name: Optional[str] = None) -> str:
+        """
+        把文本提交到会话的后台摄入队列，立即返回
         
-        # Text分块
-        batches = self.processor.split_into_batches(ingest_text)
+        每存好一组块就可以被检索，摄入期间可以照常对话；进度见 get_ingest_progress()。
         
-        # 基于信息熵分类
-        useful_batches, less_useful_batches = self.processor.classify_by_entropy(
-            batches, 
-            threshold=self.config["processor"].get("entropy_threshold", 3.0)
-        )
+        Args:
+            text: 需要摄入的文本
+            name: 任务名称（如文件名），可选
+            
+        Returns:
+            任务ID
+        """
+        return self.ingest_queue.submit(text, name)
+        
+    def get_ingest_progress(self, job_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        获取后台摄入进度
+        
+        Args:
+            job_id: 任务ID，不提供时返回所有任务的汇总进度
+            
+        Returns:
+            进度字典（chunks_done/chunks_total/eta_seconds 等），任务不存在时为None
+        """
+        return self.ingest_queue.get(job_id) if job_id else self.ingest_queue.progress()
         
+    def _plan_ingest(self, text: str, precompress: bool = True) -> Optional[IngestPlan]:
+        """
+        摄入的准备阶段：去掉已摄入过的文本（见 _new_ingest_text）、分块、跳过已摄入或正在摄入的块并按信息熵分类
+        
+        原文摘要和块哈希只做预留，存好后由 _store_plan / _finish_ingest 记入会话，失败时释放。
+        
+        Args:
+            text: 需要摄入的文本
+            precompress: 分块前是否先把超长文本整体压缩到提示预算内；后台队列逐组存储，
+                不需要（否则在整体压缩完成前看不到任何进度）
+        
+        Returns:
+            摄入计划，其中的块为 (文本块, 去向)，去向为 "rag"（摘要后存入RAG）或 "context"（原文存入文档存储）；
+            文本已摄入过时为None
+        """
+        with self._ingest_lock, metering(current_meter() or self.session_usage), usage_stage("ingest"):
+            new_text = self._new_ingest_text(text)
+            if not new_text:
+                return None
+            text_digest = None
+            if self.config.get("ingest", {}).get("dedupe", True):
+                text_digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            text_length = len(text)
+            text = new_text
+            if self.processor.chunking == "content" or not precompress:
+                # 内容定义分块的块大小本身有上限，直接对原文分块，编辑过的文档才能复用未变化的块
+                ingest_text = text
+            else:
+                # Check if the initial text itself needs compression before even batching for main RAG
+                ingest_text = self._prepare_llm_input(text) # Use max_prompt_tokens as a general limit for manageable chunks
+            
+            # Text分块，跳过之前已经摄入过或正在摄入的块
+            batches = []
+            batch_hashes = []
+            for batch in self.processor.split_into_batches(ingest_text):
+                chunk_hash = self.processor.chunk_hash(batch)
+                if chunk_hash in self.chunk_table or chunk_hash in self._reserved_chunks or chunk_hash in batch_hashes:
+                    continue
+                batches.append(batch)
+                batch_hashes.append(chunk_hash)
+            logger.info(f"{len(batches)} new chunk(s) to ingest, {len(self.chunk_table)} chunk(s) seen before.")
+            
+            chunks = []
+            if batches:
+                # 基于信息熵分类
+                _, less_useful_batches = self.processor.classify_by_entropy(
+                    batches, 
+                    threshold=self.config["processor"].get("entropy_threshold", 3.0)
+                )
+                less_useful_set = set(less_useful_batches)
+                for batch, chunk_hash in zip(batches, batch_hashes):
+                    destination = "rag" if batch in less_useful_set else "context"
+                    self._reserved_chunks[chunk_hash] = destination
+                    chunks.append((batch, destination))
+            if text_digest is not None:
+                self._reserved_digests[text_digest] = text_length
+            return IngestPlan(hashlib.sha256(text.encode("utf-8")).hexdigest(), chunks, batch_hashes,
+                              text_digest=text_digest, text_length=text_length)
+            
+    def _new_ingest_text(self, text: str) -> str:
+        """
+        对照 ingest_digests 去掉已摄入过的部分（只检查，不记录；记录见 _finish_ingest）
+        
+        Returns:
+            需要摄入的文本：完全重复（或相同文本正在摄入）时为空串，以已摄入文本为前缀时为新增的尾部，否则为原文
+        """
+        if not self.config.get("ingest", {}).get("dedupe", True):
+            return text
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        if digest in self.ingest_digests or digest in self._reserved_digests:
+            logger.info(f"Skipping ingest of {len(text)} characters: identical text already ingested.")
+            return ""
+        # 从最长的已摄入文本开始，找出是当前文本前缀的那一个（正在摄入的文本可能失败，不作为前缀）
+        for length in sorted({n for n in self.ingest_digests.values() if n < len(text)}, reverse=True):
+            if hashlib.sha256(text[:length].encode("utf-8")).hexdigest() in self.ingest_digests:
+                logger.info(f"Text extends a previously ingested text; ingesting only the last {len(text) - length} characters.")
+                return text[length:]
+        return text
+        
+    def ingest_prepared(self, digest: str, length: int, chunks: List[Tuple[str, str]], concurrency: int = 1) -> int:
+        """
+        存储在别处（例如批量摄入工具的工作进程中）已经分块和分类好的文本，记账方式与 ingest() 相同
+        
+        Args:
+            digest: 原文的sha256
+            length: 原文的字符数
+            chunks: (文本块, 去向) 列表，去向为 "rag" 或 "context"
+            concurrency: 同时进行的摘要（LLM调用）数
+            
+        Returns:
+            新存储的块数（已摄入过的原文或块会被跳过）
+        """
+        with self._ingest_lock:
+            if digest in self.ingest_digests or digest in self._reserved_digests:
+                return 0
+            new_chunks = []
+            chunk_hashes = []
+            for batch, destination in chunks:
+                chunk_hash = self.processor.chunk_hash(batch)
+                if chunk_hash in self.chunk_table or chunk_hash in self._reserved_chunks or chunk_hash in chunk_hashes:
+                    continue
+                self._reserved_chunks[chunk_hash] = destination
+                new_chunks.append((batch, destination))
+                chunk_hashes.append(chunk_hash)
+            self._reserved_digests[digest] = length
+        # 与 ingest() 相同：存好后才记为已摄入，失败（含中断）时释放预留
+        self._run_plan(IngestPlan(digest, new_chunks, chunk_hashes, text_digest=digest, text_length=length),
+                       concurrency=concurrency)
+        return len(new_chunks)
+        
+    def _store_chunks(self, chunks: List[Tuple[str, str]], concurrency: int = 1) -> None:
+        """ Stores planned chunks: low-entropy ones are summarized into RAG (`concurrency` summaries at a time), the rest indexed verbatim in the document store. """
         # 将低信息熵文本存入主 RAG
-        stored_summaries = self.rag_manager.batch_store(less_useful_batches)
+        less_useful_batches = [batch for batch, destination in chunks if destination == "rag"]
+        with metering(current_meter() or self.session_usage), usage_stage("ingest"):
+            stored_summaries = self.rag_manager.batch_store(less_useful_batches, concurrency=concurrency) if less_useful_batches else []
         logger.info(f"Stored {len(stored_summaries)} items in RAG.")
         
-        # 将有用文本添加到会话历史 (or potentially a separate document store)
-        useful_content = "\n".join(useful_batches)
-        self.conversation_history.append({
-            "role": "system", # Or maybe 'document'?
-            "content": useful_content
-        })
-        logger.info(f"Added {len(useful_batches)} useful batches to context.")
+        # 将有用文本存入文档存储，对话时只检索与查询相关的块放入提示
+        useful_batches = [batch for batch, destination in chunks if destination == "context"]
+        added = self.document_store.add(useful_batches) if useful_batches else 0
+        logger.info(f"Indexed {added} useful batches in the document store.")
+
+    def _store_plan(self, plan: IngestPlan, start: int, end: int, concurrency: int = 1) -> None:
+        """ Stores plan.chunks[start:end] and records their hashes in the chunk table once they are stored. """
+        self._store_chunks(plan.chunks[start:end], concurrency=concurrency)
+        with self._ingest_lock:
+            for chunk_hash, (_, destination) in zip(plan.chunk_hashes[plan.stored:end], plan.chunks[plan.stored:end]):
+                self._reserved_chunks.pop(chunk_hash, None)
+                self.chunk_table[chunk_hash] = destination
+            plan.stored = max(plan.stored, end)
+            
+    def _finish_ingest(self, plan: IngestPlan, ok: bool) -> None:
+        """
+        结束摄入计划：全部存好时记入原文摘要并更新上下文指纹，否则释放未存储部分的预留
         
+        Args:
+            plan: 摄入计划
+            ok: 是否全部存好
+        """
+        with self._ingest_lock:
+            for chunk_hash in plan.chunk_hashes[plan.stored:]:
+                self._reserved_chunks.pop(chunk_hash, None)
+            if plan.text_digest is not None:
+                self._reserved_digests.pop(plan.text_digest, None)
+            if not ok:
+                logger.warning(f"Ingest aborted after {plan.stored}/{len(plan.chunks)} chunk(s); the rest will be retried on the next ingest.")
+                return
+            if plan.text_digest is not None:
+                self.ingest_digests[plan.text_digest] = plan.text_length
+            self.context_fingerprint = hashlib.sha256((self.context_fingerprint + plan.content_digest).encode("utf-8")).hexdigest()
+            
+    def _run_plan(self, plan: IngestPlan, concurrency: int = 1) -> None:
+        """ Stores a whole plan and commits it; on any failure (including KeyboardInterrupt) the reservations are released. """
+        ok = False
+        try:
+            if plan.chunks:
+                self._store_plan(plan, 0, len(plan.chunks), concurrency=concurrency)
+            ok = True
+        finally:
+            self._finish_ingest(plan, ok)
+
+    def precompute_prompt(self, text: str, name: Optional[str] = None) -> PromptArtifact:
+        """
+        预先完成一段固定提示词的摄入（分块、信息熵分类、摘要、编码），结果可挂载到任意会话
+
+        在本会话的一个空白分叉中摄入，不修改本会话的状态。
+
+        Args:
+            text: 提示词原文
+            name: 名称，可选，不提供时取原文哈希的前12位
+
+        Returns:
+            PromptArtifact，用 attach_prompt() 挂载
+        """
+        start = time.perf_counter()
+        scratch = self.fork()
+        scratch.reset()
+        scratch.ingest(text)
+        if scratch._rag_manager is not None:
+            rag_texts, rag_embeddings = scratch._rag_manager.export_state()
+        else:
+            rag_texts, rag_embeddings = [], np.zeros((0, 0), dtype=np.float32)
+        if scratch._document_store is not None:
+            doc_texts, doc_embeddings = scratch._document_store.export_state()
+        else:
+            doc_texts, doc_embeddings = [], np.zeros((0, 0), dtype=np.float32)
+        artifact = PromptArtifact(
+            name or hashlib.sha256(text.encode("utf-8")).hexdigest()[:12], text,
+            token_count=self.token_counter.count_tokens(text),
+            embedding_model=self.config.get("rag", {}).get("embedding_model"),
+            chunk_table=scratch.chunk_table,
+            rag_texts=rag_texts, rag_embeddings=rag_embeddings,
+            doc_texts=doc_texts, doc_embeddings=doc_embeddings
+        )
+        logger.info(f"Precomputed prompt '{artifact.name}' in {time.perf_counter() - start:.2f}s: "
+                    f"{len(rag_texts)} RAG item(s), {len(doc_texts)} document chunk(s).")
+        return artifact
+
+    def attach_prompt(self, artifact: PromptArtifact) -> bool:
+        """
+        把预计算的提示词挂载到本会话，效果等同于 ingest() 原文，但不调用LLM或embedding模型
+        （存储尚未创建时，embedding模型推迟到第一次检索才加载）
+
+        Args:
+            artifact: precompute_prompt() 的结果
+
+        Returns:
+            是否挂载（本会话已摄入过相同原文时为False）
+        """
+        current_model = self.config.get("rag", {}).get("embedding_model")
+        if (artifact.rag_texts or artifact.doc_texts) and artifact.embedding_model != current_model:
+            raise ValueError(f"预计算使用的embedding模型({artifact.embedding_model})与当前引擎({current_model})不一致")
+        self.rolling_summarizer.cancel()
+        with self._ingest_lock:
+            if artifact.digest in self.ingest_digests or artifact.digest in self._reserved_digests:
+                logger.info(f"Static prompt '{artifact.name}' already attached; skipping.")
+                return False
+            self._reserved_digests[artifact.digest] = artifact.text_length
+        # 先写入存储，成功后才记账（与 ingest() 相同），失败时释放预留
+        try:
+            self._create_stores_for(artifact)
+            if artifact.rag_texts:
+                self._rag_manager.add_embedded(artifact.rag_texts, artifact.rag_embeddings)
+            if artifact.doc_texts:
+                self._document_store.add(artifact.doc_texts, embeddings=artifact.doc_embeddings)
+        except BaseException:
+            with self._ingest_lock:
+                self._reserved_digests.pop(artifact.digest, None)
+            raise
+        with self._ingest_lock:
+            self._reserved_digests.pop(artifact.digest, None)
+            self.ingest_digests[artifact.digest] = artifact.text_length
+            # 与 ingest() 相同的上下文指纹更新，语义缓存对两种方式一视同仁
+            self.context_fingerprint = hashlib.sha256((self.context_fingerprint + artifact.digest).encode("utf-8")).hexdigest()
+            for chunk_hash, destination in artifact.chunk_table.items():
+                self.chunk_table.setdefault(chunk_hash, destination)
+        logger.info(f"Attached static prompt '{artifact.name}' ({artifact.token_count} tokens) without re-ingesting.")
+        return True
+
+    def _create_stores_for(self, artifact: PromptArtifact) -> None:
+        """ Creates the stores an artifact needs from its vectors; if no model is loaded yet, the stores share a LazyEmbeddingModel that loads on first encode. """
+        with self._lazy_init_lock:
+            model = self._loaded_embedding_model()
+            if model is None:
+                model = LazyEmbeddingModel(self.config.get('rag', {}).get('embedding_model', 'all-MiniLM-L6-v2'))
+            if artifact.rag_texts and self._rag_manager is None:
+                self._rag_manager = self._lazy_init("rag_manager", lambda: self._create_rag_manager(
+                    embedding_model=model, vector_dimension=artifact.rag_embeddings.shape[1]))
+            if artifact.doc_texts and self._document_store is None:
+                self._document_store = self._lazy_init("document_store", lambda: DocumentStore(model, name="documents"))
+
     def chat(self, query: str) -> str:
         """
         处理用户查询并生成回复 (with recursive RAG and optional MPR)
         """
+        return _run_coroutine_sync(self.achat(query))
+        
+    async def achat(self, query: str) -> str:
+        """
+        chat() 的异步版本，可在事件循环中直接等待
+        
+        本轮用量记入新的轮次计量器，其父级为调用方激活的计量器（例如每个API请求一个），未激活时为会话计量器。
+        """
+        tracer = self._new_tracer()
+        with metering(UsageMeter(parent=current_meter() or self.session_usage)):
+            if tracer is None:
+                return await self._achat(query)
+            with activate(tracer), trace("chat", category="engine", query_chars=len(query)):
+                solution = await self._achat(query)
+        self._publish_trace(tracer)
+        return solution
+        
+    def enable_tracing(self, enabled: bool = True, output_dir: Optional[str] = None) -> None:
+        """
+        开启或关闭追踪模式
+        
+        Args:
+            enabled: 是否为之后的每轮对话记录跨模块的嵌套事件
+            output_dir: 每轮 trace 的输出目录，可选；不提供时仅保存在 last_trace 中
+        """
+        self.config["tracing"] = {"enabled": enabled, "output_dir": output_dir}
+        
+    def get_last_trace(self) -> Optional[Dict[str, Any]]:
+        """最近一轮对话的 Chrome trace JSON（未开启追踪时为None）"""
+        return self.last_trace.to_chrome_trace() if self.last_trace is not None else None
+        
+    def _new_tracer(self) -> Optional[Tracer]:
+        """ Creates a Tracer for the next turn when tracing mode is on. """
+        if not self.config.get("tracing", {}).get("enabled", False):
+            return None
+        return Tracer(name=self.session_id, metadata={"session_id": self.session_id})
+        
+    def _publish_trace(self, tracer: Tracer) -> None:
+        """ Keeps a finished turn's trace and writes it to tracing.output_dir if configured. """
+        self.last_trace = tracer
+        output_dir = self.config.get("tracing", {}).get("output_dir")
+        if output_dir:
+            try:
+                path = tracer.write(output_dir)
+                logger.info(f"Trace written to {path}")
+            except OSError as e:
+                logger.error(f"写入trace失败: {e}")
+                
+    async def _achat(self, query: str) -> str:
+        """ One chat turn; see achat(). """
         logger.info(f"Received chat query: '{query[:50]}...'")
-        # 添加用户查询到会话历史
-        self.conversation_history.append({"role": "user", "content": query})
+        start_time = time.perf_counter()
+        recorder = self._start_turn_spans(query)
+        cache_key = self._response_cache_key()
+        query_embedding, cached = await self._lookup_cached_answer(query, cache_key, recorder)
+        if cached is not None:
+            self.conversation_history.append({"role": "user", "content": query})
+            self.conversation_history.append({"role": "assistant", "content": cached})
+            self._finish_turn_spans(recorder, cached)
+            self._schedule_rolling_summary()
+            return cached
+        stages = self._build_turn_stages(query, query_embedding)
         
-        # 从主 RAG 检索相关信息
-        rag_top_k = self.config.get('rag', {}).get('top_k', 3)
-        rag_context = self.rag_manager.retrieve(query, top_k=rag_top_k)
-        logger.info(f"Retrieved {len(rag_context)} relevant context(s) from RAG.")
-        
-        # 获取最近的会话内容作为上下文 (fitting within limits)
-        context = self._get_recent_context(self.max_prompt_tokens // 2) # Allocate roughly half for history
-        logger.debug(f"Recent context length: {self.token_counter.count_tokens(context)} tokens")
-        
-        # --- Framework Generation --- 
-        # Prepare context for framework generation (might include history)
-        framework_input_context = context # Or potentially add retrieved RAG snippets here too?
-        framework_input_context_prepared = self._prepare_llm_input(framework_input_context)
-        logger.info("Generating solution framework...")
-        framework = self.framework_generator.generate_framework(query, framework_input_context_prepared)
-        logger.info(f"Generated framework: {framework[:100]}...")
-        
-        # --- Solution Generation (with MPR) --- 
-        logger.info(f"Generating solution using MPR (candidates={self.mpr_candidates})...")
-        # Useful context for solution might be different, maybe more focused history + RAG
-        solution_useful_context = context # For now, reuse the context from framework gen
-        
-        # Note: The framework generator methods themselves need internal _prepare_llm_input calls
-        # This is currently missing in the framework.py implementation and needs adding there.
-        # For now, we assume the framework generator handles its own prompt limits internally.
-        
-        solution = self.framework_generator.generate_solution_mpr(
-            query, 
-            framework, 
-            useful_context=solution_useful_context, 
-            rag_context=rag_context, # Pass retrieved snippets
-            num_candidates=self.mpr_candidates
-        )
+        # --- Solution Generation (with MPR, or a single call on the fast path) --- 
+        async def solution_stage(deps):
+            context, rag_context = deps["plan"]
+            if deps["route"] == FAST_PATH:
+                logger.info("Fast path: answering directly without framework.")
+                return await self.framework_generator.generate_direct_answer(query, context, rag_context)
+            logger.info(f"Generating solution using MPR (candidates={self.mpr_candidates})...")
+            return await self.framework_generator.generate_solution_mpr(
+                query, 
+                deps["framework"], 
+                useful_context=context, 
+                rag_context=rag_context, # Pass retrieved snippets
+                num_candidates=self.mpr_candidates
+            )
+        stages.append(Stage("solution", solution_stage, deps=("route", "framework", "plan"),
+                            timeout=self._stage_timeout("solution")))
+        
+        results = await self._run_pipeline(stages, recorder)
+        solution = results["solution"]
         logger.info(f"Generated final solution: {solution[:100]}...")
         
         # 添加回复到会话历史
         self.conversation_history.append({"role": "assistant", "content": solution})
+        self._store_cached_answer(query_embedding, cache_key, solution)
         
+        self.router.record(results["route"], time.perf_counter() - start_time)
+        recorder.attrs["route"] = results["route"]
+        self._finish_turn_spans(recorder, solution)
+        self._schedule_rolling_summary()
         return solution
+        
+    def chat_batch(self, queries: List[str], concurrency: int = 4) -> List[Dict[str, Any]]:
+        """
+        批量处理相互独立的查询（如离线评测），见 achat_batch()
+        """
+        return _run_coroutine_sync(self.achat_batch(queries, concurrency=concurrency))
+        
+    async def achat_batch(self, queries: List[str], concurrency: int = 4) -> List[Dict[str, Any]]:
+        """
+        批量处理相互独立的查询
+        
+        每个查询都基于当前的会话历史和RAG存储回答，但不会写入会话历史。
+        可共享的工作只做一次：全部查询一次性编码和检索，框架生成所用的历史上下文只准备一次，
+        完全相同的查询只生成一次框架和答案；各查询的LLM调用最多 concurrency 个并发执行。
+        
+        Args:
+            queries: 查询列表
+            concurrency: 同时处理的查询数上限
+            
+        Returns:
+            与 queries 一一对应的结果字典：
+            {"query", "answer", "route", "cache_hit", "error", "spans", "usage"}，
+            spans 为该查询的计时区间（见 SpanRecorder.to_dict），共享阶段的耗时记录在每个结果中；
+            usage 为该查询的LLM token用量，共享阶段的用量只计入会话累计
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency 必须大于0")
+        unique_queries = list(dict.fromkeys(queries))
+        logger.info(f"Batch chat: {len(queries)} queries ({len(unique_queries)} unique), concurrency={concurrency}")
+        
+        # --- 共享阶段：批量编码与检索，框架上下文准备 ---
+        shared = SpanRecorder()
+        embeddings = None
+        # 批量查询不写入历史，所有查询共用同一个缓存键
+        cache_key = self._response_cache_key()
+        if self.has_retrievable_content or cache_key is not None:
+            with shared.span("encode", queries=len(unique_queries)):
+                embeddings = await asyncio.to_thread(self.embedding_model.encode, unique_queries)
+        if self.has_retrievable_content:
+            with shared.span("retrieve") as span:
+                all_hits = await asyncio.to_thread(self._retrieve_batch, unique_queries, embeddings)
+                span.attrs["hits"] = sum(len(hits) for hits in all_hits)
+        else:
+            all_hits = [[] for _ in unique_queries]
+        with shared.span("history"), metering(self.session_usage):
+            history_context, _ = self._plan_context([])
+            framework_input = await asyncio.to_thread(self._prepare_llm_input, history_context, "\n".join(unique_queries))
+            
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def run_one(index: int, query: str) -> Dict[str, Any]:
+            recorder = SpanRecorder()
+            recorder.origin = shared.origin
+            recorder.spans.extend(shared.spans)
+            recorder.attrs["tokens_in"] = self.token_counter.count_tokens(query)
+            recorder.attrs["cache_hit"] = False
+            result = {"query": query, "answer": None, "route": None, "cache_hit": False, "error": None}
+            query_embedding = embeddings[index] if embeddings is not None else None
+            meter = UsageMeter(parent=self.session_usage)
+            try:
+                if cache_key is not None:
+                    cached = self.response_cache.lookup(query_embedding, cache_key)
+                    if cached is not None:
+                        result.update(answer=cached, cache_hit=True)
+                        recorder.attrs["cache_hit"] = True
+                        return result
+                        
+                with recorder.span("queued"):
+                    await semaphore.acquire()
+                try:
+                    with metering(meter):
+                        hits = all_hits[index]
+                        with recorder.span("route") as span:
+                            route = self.router.classify(self.tokenizer.encode(query), [score for _, score in hits])
+                            span.attrs["route"] = route
+                        result["route"] = recorder.attrs["route"] = route
+                    
+                        if route == FAST_PATH:
+                            context, rag_context = self._plan_context(hits)
+                            with recorder.span("solution") as span, usage_stage("solution"):
+                                answer = await self.framework_generator.generate_direct_answer(query, context, rag_context)
+                        else:
+                            with recorder.span("framework") as span, usage_stage("framework"):
+                                framework = await self.framework_generator.generate_framework(query, framework_input)
+                                span.attrs["tokens_out"] = self.token_counter.count_tokens(framework)
+                            context, rag_context = self._plan_context(hits, framework)
+                            with recorder.span("solution") as span, usage_stage("solution"):
+                                answer = await self.framework_generator.generate_solution_mpr(
+                                    query, 
+                                    framework, 
+                                    useful_context=context, 
+                                    rag_context=rag_context,
+                                    num_candidates=self.mpr_candidates
+                                )
+                        span.attrs["tokens_out"] = self.token_counter.count_tokens(answer)
+                finally:
+                    semaphore.release()
+                    
+                result["answer"] = answer
+                self._store_cached_answer(query_embedding, cache_key, answer)
+                self.router.record(route, recorder.spans[-1].end - recorder.origin)
+            except Exception as e:
+                logger.error(f"Batch query {index} failed: {e}")
+                result["error"] = str(e)
+            finally:
+                if result["answer"] is not None:
+                    recorder.attrs["tokens_out"] = self.token_counter.count_tokens(result["answer"])
+                recorder.attrs["usage"] = result["usage"] = meter.to_dict()
+                result["spans"] = recorder.to_dict()
+            return result
+            
+        unique_results = await asyncio.gather(*(run_one(i, q) for i, q in enumerate(unique_queries)))
+        by_query = dict(zip(unique_queries, unique_results))
+        results = []
+        for query in queries:
+            results.append(dict(by_query[query]))
+        logger.info(f"Batch chat finished in {time.perf_counter() - shared.origin:.3f}s")
+        return results
+        
+    def _start_turn_spans(self, query: str) -> SpanRecorder:
+        """ Creates the span recorder for one turn (a new turn also cancels any pending rolling summary). """
+        self.rolling_summarizer.cancel()
+        recorder = SpanRecorder()
+        recorder.attrs["tokens_in"] = self.token_counter.count_tokens(query)
+        recorder.attrs["cache_hit"] = False
+        return recorder
+        
+    def _finish_turn_spans(self, recorder: SpanRecorder, answer: str) -> None:
+        """ Closes a turn's spans and publishes them as last_turn_spans. """
+        recorder.attrs["tokens_out"] = self.token_counter.count_tokens(answer)
+        meter = current_meter()
+        if meter is not None:
+            # 本轮所有LLM调用（框架、MPR候选、压缩等）实际消耗的token
+            self.last_turn_usage = recorder.attrs["usage"] = meter.to_dict()
+        self.last_turn_spans = recorder.to_dict()
+        logger.debug(f"Turn spans: {self.last_turn_spans}")
+        
+    async def _lookup_cached_answer(self, query: str, cache_key: Optional[str],
+                                    recorder: Optional[SpanRecorder] = None) -> Tuple[Optional[np.ndarray], Optional[str]]:
+        """
+        查询语义缓存
+        
+        Args:
+            query: 用户查询
+            cache_key: 本轮开始时的缓存键（见 _response_cache_key），None 表示不使用缓存
+            recorder: 本轮的计时记录器，可选
+            
+        Returns:
+            (查询向量, 缓存的回答)；不使用缓存时均为None，未命中时回答为None
+        """
+        if cache_key is None:
+            return None, None
+        recorder = recorder or SpanRecorder()
+        with recorder.span("cache_lookup") as span:
+            query_embedding = await asyncio.to_thread(self.embedding_model.encode, query)
+            cached = self.response_cache.lookup(query_embedding, cache_key)
+            span.attrs["cache_hit"] = cached is not None
+        if cached is not None:
+            logger.info("Semantic cache hit, skipping framework and MPR.")
+            recorder.attrs["cache_hit"] = True
+        return query_embedding, cached
+        
+    def _store_cached_answer(self, query_embedding: Optional[np.ndarray], cache_key: Optional[str], answer: str) -> None:
+        """ Stores a freshly generated answer under the key the turn started with (see _response_cache_key), if caching applies. """
+        if cache_key is not None and query_embedding is not None:
+            self.response_cache.store(query_embedding, cache_key, answer)
+            # 紧接着重复提问时，最近的回复就是这个回答：在下一轮的键下也存一份
+            next_key = self._response_cache_key(answer)
+            if next_key is not None and next_key != cache_key:
+                self.response_cache.store(query_embedding, next_key, answer)
+            
+    def get_cache_stats(self) -> Optional[Dict[str, Any]]:
+        """获取语义缓存的命中统计，未启用缓存时返回None"""
+        return self.response_cache.get_stats() if self.response_cache is not None else None
+        
+    def get_usage_stats(self) -> Dict[str, Any]:
+        """获取本会话累计的LLM token用量（按阶段分类，见 UsageMeter.to_dict）"""
+        return self.session_usage.to_dict()
+        
+    def get_route_stats(self) -> Dict[str, Dict[str, float]]:
+        """获取快速路径/完整路径的调用次数和耗时统计"""
+        return self.router.get_stats()
+        
+    def _summarize_turns(self, digest: str, turns: str) -> str:
+        """ Merges conversation turns into the rolling digest with one LLM call (runs on the summarizer thread). """
+        prompt = load_prompt("summarize_history").format(digest=digest or "（无）", turns=turns)
+        if self.token_counter.count_tokens(prompt) > self.max_prompt_tokens:
+            # 后台任务不再递归调用LLM压缩，只做抽取式压缩
+            prompt = self._extractive_compress(prompt, self.max_prompt_tokens)
+        max_tokens = self.config.get("history", {}).get("summary_max_tokens", 256)
+        with metering(self.session_usage), usage_stage("rolling_summary"):
+            return self.llm_interface.generate(prompt, max_new_tokens=max_tokens, temperature=0.3)
+        
+    def _schedule_rolling_summary(self) -> bool:
+        """
+        对话轮次结束后，若有足够多的老化消息尚未并入摘要，则调度一次后台滚动摘要
+        
+        Returns:
+            是否调度了摘要
+        """
+        history_cfg = self.config.get("history", {})
+        if not history_cfg.get("rolling_summary", False):
+            return False
+        history = self.conversation_history
+        end = len(history) - history_cfg.get("summary_keep_messages", 4)
+        _, upto = self.rolling_summarizer.current()
+        if end <= upto or history.tokens_between(upto, end) < history_cfg.get("summary_min_tokens", 256):
+            return False
+        self.rolling_summarizer.idle_seconds = history_cfg.get("summary_idle_seconds", 2.0)
+        self.rolling_summarizer.schedule([history.format_message(message) for message in history[upto:end]], end)
+        return True
+        
+    def _stage_timeout(self, name: str) -> Optional[float]:
+        """ Per-stage timeout in seconds from config['pipeline']['stage_timeouts'] (None = unlimited). """
+        return self.config.get("pipeline", {}).get("stage_timeouts", {}).get(name)
+        
+    def _build_turn_stages(self, query: str, query_embedding: Optional[np.ndarray] = None) -> List[Stage]:
+        """
+        构建一轮对话的阶段依赖图（检索与历史组装互不依赖，可并发执行；
+        查询本身已排除快速路径时，框架生成与检索并发地推测执行，否则等路由结果，快速路径下跳过）
+        
+        Args:
+            query: 用户查询
+            query_embedding: 已计算好的查询向量（例如语义缓存查找时），可选
+        """
+        # 添加用户查询到会话历史
+        self.conversation_history.append({"role": "user", "content": query})
+        
+        # 从RAG摘要和文档存储检索相关信息（带相似度，供路由判断命中强度）
+        async def retrieve_stage(deps):
+            if self._has_unindexed_evictions():
+                await asyncio.to_thread(self._index_evicted_turns)
+            if not self.has_retrievable_content:
+                # 尚未摄入任何内容，无需加载embedding模型
+                return []
+            hits = await asyncio.to_thread(self._retrieve, query, query_embedding)
+            logger.info(f"Retrieved {len(hits)} relevant context(s) from RAG and documents.")
+            return hits
+            
+        # 框架生成使用的历史上下文：仅在历史消息内做预算规划
+        async def history_stage(deps):
+            context, _ = self._plan_context([])
+            return context
+            
+        # 路由结果，框架阶段据此决定是否生成框架
+        route_decision: Dict[str, str] = {}
+        route_decided = asyncio.Event()
+        
+        # 根据查询长度、熵和检索命中强度选择路径
+        async def route_stage(deps):
+            tokens = self.tokenizer.encode(query)
+            route = self.router.classify(tokens, [score for _, score in deps["retrieve"]])
+            logger.info(f"Routing query to {route} path.")
+            route_decision["route"] = route
+            route_decided.set()
+            return route
+            
+        async def generate_framework(history_context):
+            framework_input_context_prepared = await asyncio.to_thread(self._prepare_llm_input, history_context, query)
+            logger.info("Generating solution framework...")
+            framework = await self.framework_generator.generate_framework(query, framework_input_context_prepared)
+            logger.info(f"Generated framework: {framework[:100]}...")
+            return framework
+            
+        # --- Framework Generation (speculative only when the query alone rules out the fast path) --- 
+        async def framework_stage(deps):
+            # 框架生成在线程中调用LLM，开始后无法取消：只有查询本身（长度、熵）已决定走完整路径时
+            # 才与检索并发推测执行，否则先等路由结果，快速路径下不调用LLM
+            if self.router.precheck(self.tokenizer.encode(query)) != FULL_PATH:
+                await route_decided.wait()
+                if route_decision["route"] == FAST_PATH:
+                    return ""
+            return await generate_framework(deps["history"])
+            
+        async def plan_stage(deps):
+            return self._plan_context(deps["retrieve"], deps["framework"])
+            
+        return [
+            # 检索失败或超时时降级为无检索结果，框架超时时降级为无框架直接生成
+            Stage("retrieve", retrieve_stage, timeout=self._stage_timeout("retrieve"), fallback=[]),
+            Stage("history", history_stage, timeout=self._stage_timeout("history")),
+            Stage("route", route_stage, deps=("retrieve",)),
+            Stage("framework", framework_stage, deps=("history",), timeout=self._stage_timeout("framework"), fallback=""),
+            # 解决方案阶段的上下文：历史、检索结果与框架共同竞争同一份token预算
+            Stage("plan", plan_stage, deps=("retrieve", "framework")),
+        ]
+        
+    async def _run_pipeline(self, stages: List[Stage], recorder: Optional[SpanRecorder] = None) -> Dict[str, Any]:
+        """ Executes the stage graph and keeps its per-stage timings in last_stage_timings (and as spans in recorder). """
+        pipeline = StagePipeline(stages)
+        results = None
+        try:
+            results = await pipeline.run()
+            return results
+        finally:
+            self.last_stage_timings = pipeline.timings
+            if recorder is not None and pipeline.run_start is not None:
+                for name, timing in pipeline.timings.items():
+                    recorder.add(name, pipeline.run_start + timing["start"], pipeline.run_start + timing["end"],
+                                 **self._stage_span_attrs(name, results))
+                    
+    def _stage_span_attrs(self, name: str, results: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """ Token counts / hit counts worth attaching to a stage span. """
+        if not results or name not in results:
+            return {}
+        value = results[name]
+        if name == "retrieve":
+            return {"hits": len(value)}
+        if name == "framework":
+            return {"tokens_out": self.token_counter.count_tokens(value) if value else 0}
+        if name == "plan":
+            context, rag_context = value
+            return {"tokens_out": self.token_counter.count_tokens(context) + sum(self.token_counter.count_tokens(t) for t in rag_context)}
+        if name == "solution":
+            return {"tokens_out": self.token_counter.count_tokens(value)}
+        if name == "route":
+            return {"route": value}
+        return {}
     
     async def stream_chat(self, query: str) -> AsyncGenerator[str, None]:
         """
         流式处理用户查询并生成回复 (支持异步生成和流式输出)
         
+        最终解决方案阶段直接转发后端产生的token；启用MPR时需先合成多个候选，
+        因此合成结果一次性返回。首个token的延迟记录在 last_stream_stats 中。
+        
         Args:
             query: 用户查询
             
         Yields:
             生成的回复片段
         """
+        tracer = self._new_tracer()
+        # 与 achat() 相同，轮次计量器的父级为调用方激活的计量器或会话计量器
+        meter = UsageMeter(parent=current_meter() or self.session_usage)
+        # 生成器在每次 yield 后可能由不同的上下文恢复，因此只在每次取下一个片段时激活 tracer 和用量计量
+        stream = self._stream_chat(query)
+        start = time.perf_counter()
+        try:
+            while True:
+                with activate(tracer), metering(meter):
+                    try:
+                        chunk = await stream.__anext__()
+                    except StopAsyncIteration:
+                        break
+                yield chunk
+        finally:
+            await stream.aclose()
+            if tracer is not None:
+                tracer.add_event("stream_chat", "engine", start, time.perf_counter(), {"query_chars": len(query)})
+                self._publish_trace(tracer)
+            
+    async def _stream_chat(self, query: str) -> AsyncGenerator[str, None]:
+        """ One streamed chat turn; see stream_chat(). """
         logger.info(f"Received stream chat query: '{query[:50]}...'")
+        start_time = time.perf_counter()
+        first_token_time = None
+        chunk_count = 0
         
-        # 添加用户查询到会话历史
-        self.conversation_history.append({"role": "user", "content": query})
+        recorder = self._start_turn_spans(query)
+        cache_key = self._response_cache_key()
+        query_embedding, cached = await self._lookup_cached_answer(query, cache_key, recorder)
+        if cached is not None:
+            self.conversation_history.append({"role": "user", "content": query})
+            self.conversation_history.append({"role": "assistant", "content": cached})
+            self.last_stream_stats = {
+                "time_to_first_token": time.perf_counter() - start_time,
+                "total_time": time.perf_counter() - start_time,
+                "chunks": 1
+            }
+            self._finish_turn_spans(recorder, cached)
+            self._schedule_rolling_summary()
+            yield cached
+            return
+            
+        results = await self._run_pipeline(self._build_turn_stages(query, query_embedding), recorder)
+        context, rag_context = results["plan"]
+        framework = results["framework"]
         
-        # 从主 RAG 检索相关信息
-        rag_top_k = self.config.get('rag', {}).get('top_k', 3)
-        rag_context = self.rag_manager.retrieve(query, top_k=rag_top_k)
-        logger.info(f"Retrieved {len(rag_context)} relevant context(s) from RAG.")
-        
-        # 获取最近的会话内容作为上下文 (fitting within limits)
-        context = self._get_recent_context(self.max_prompt_tokens // 2) # Allocate roughly half for history
-        logger.debug(f"Recent context length: {self.token_counter.count_tokens(context)} tokens")
-        
-        # 生成解决方案框架
-        framework_input_context = context
-        framework_input_context_prepared = self._prepare_llm_input(framework_input_context)
-        logger.info("Generating solution framework...")
-        framework = self.framework_generator.generate_framework(query, framework_input_context_prepared)
-        logger.info(f"Generated framework: {framework[:100]}...")
-        
-        # 准备生成解决方案的上下文
-        solution_useful_context = context
-        
-        # 检查LLM接口是否支持流式生成
-        if hasattr(self.llm_interface, 'stream_generate') and callable(self.llm_interface.stream_generate):
-            # 使用LLM接口的流式生成功能
-            full_response = ""
-            async for chunk in self.llm_interface.stream_generate(
-                query, 
-                context=solution_useful_context,
-                framework=framework,
-                rag_context=rag_context
-            ):
-                full_response += chunk
+        full_response = []
+        with recorder.span("solution") as solution_span, trace("solution", category="engine"):
+            async for chunk in staged(self._stream_solution(query, results["route"], framework, context, rag_context), "solution"):
+                if first_token_time is None:
+                    first_token_time = time.perf_counter()
+                    solution_span.attrs["time_to_first_token"] = first_token_time - solution_span.start
+                chunk_count += 1
+                full_response.append(chunk)
                 yield chunk
                 
-            # 添加完整回复到会话历史
-            self.conversation_history.append({"role": "assistant", "content": full_response})
-        else:
-            # 如果不支持流式生成，则使用普通chat并模拟流式输出
-            solution = self.framework_generator.generate_solution_mpr(
+        # 添加完整回复到会话历史
+        solution = "".join(full_response)
+        solution_span.attrs["tokens_out"] = self.token_counter.count_tokens(solution)
+        self.conversation_history.append({"role": "assistant", "content": solution})
+        self._store_cached_answer(query_embedding, cache_key, solution)
+        
+        end_time = time.perf_counter()
+        self.last_stream_stats = {
+            "time_to_first_token": (first_token_time - start_time) if first_token_time else None,
+            "total_time": end_time - start_time,
+            "chunks": chunk_count
+        }
+        logger.info(f"Stream finished: {self.last_stream_stats}")
+        self.router.record(results["route"], end_time - start_time)
+        recorder.attrs["route"] = results["route"]
+        self._finish_turn_spans(recorder, solution)
+        self._schedule_rolling_summary()
+        
+    async def _stream_solution(self, query: str, route: str, framework: str, context: str, rag_context: List[str]) -> AsyncGenerator[str, None]:
+        """ Streams the final solution; with MPR the synthesized answer is only available as a whole. """
+        if route == FAST_PATH:
+            async for chunk in self.framework_generator.stream_direct_answer(query, context, rag_context):
+                yield chunk
+            return
+            
+        if self.mpr_candidates > 1:
+            yield await self.framework_generator.generate_solution_mpr(
                 query, 
                 framework, 
-                useful_context=solution_useful_context, 
+                useful_context=context, 
                 rag_context=rag_context,
                 num_candidates=self.mpr_candidates
             )
+            return
             
-            # 模拟流式输出，每10个字符发送一次
-            for i in range(0, len(solution), 10):
-                chunk = solution[i:i+10]
-                yield chunk
-                await asyncio.sleep(0.05)  # 添加小延迟以模拟流式输出
-                
-            # 添加完整回复到会话历史
-            self.conversation_history.append({"role": "assistant", "content": solution})
+        async for chunk in self.framework_generator.stream_solution(
+            query, 
+            framework, 
+            useful_context=context, 
+            rag_context=rag_context
+        ):
+            yield chunk
+        
+    def _plan_context(self, rag_hits: List[Tuple[str, float]], framework: str = "") -> Tuple[str, List[str]]:
+        """
+        在 max_prompt_tokens 预算内挑选历史消息与检索结果
+        
+        当前查询和框架为必需内容；历史消息按新旧程度衰减赋值，检索结果以相似度赋值，
+        由 TokenBudgetPlanner 按价值密度贪心装入。历史消息的token数直接取自缓存。
+        
+        Args:
+            rag_hits: (文本, 相似度) 形式的检索结果
+            framework: 解决方案框架，为空表示不占用预算
+            
+        Returns:
+            (按时间顺序拼接的历史上下文, 按相似度排序的检索文本列表)
+        """
+        budget_cfg = self.config.get("budget", {})
+        budget = max(self.max_prompt_tokens - budget_cfg.get("reserve_tokens", 256), 0)
+        decay = budget_cfg.get("history_decay", 0.85)
+        rag_weight = budget_cfg.get("rag_weight", 1.0)
+        
+        history = self.conversation_history
+        start = history.window_start(self._history_window_tokens())
+        if history and start == len(history):
+            if history.token_count(len(history) - 1) > budget:
+                # 最新的消息本身已超出预算，只能截断它
+                return self._get_recent_context(budget), []
+            start = len(history) - 1
+            
+        n = len(history)
+        items = []
+        # 滚动摘要代替它覆盖的 history[:digest_upto]，价值按其中最新一条消息的新旧程度衰减
+        digest, digest_upto = self.rolling_summarizer.current()
+        if digest and 0 < digest_upto <= n:
+            start = max(start, min(digest_upto, n - 1))
+            digest_text = f"summary: {digest}"
+            items.append(BudgetItem("history", digest_text, self.token_counter.count_tokens(digest_text),
+                                    value=decay ** (n - digest_upto), order=-1))
+        for i in range(start, n):
+            age = n - 1 - i
+            items.append(BudgetItem("history", history.format_message(history[i]), history.token_count(i),
+                                    value=decay ** age, required=(age == 0), order=i))
+        for rank, (text, score) in enumerate(rag_hits):
+            items.append(BudgetItem("rag", text, self.token_counter.count_tokens(text),
+                                    value=score * rag_weight, order=n + rank))
+        if framework:
+            items.append(BudgetItem("framework", framework, self.token_counter.count_tokens(framework),
+                                    value=0.0, required=True, order=n + len(rag_hits)))
+            
+        selected = TokenBudgetPlanner(budget).plan(items)
+        context = "\n\n".join(item.text for item in selected if item.kind == "history")
+        rag_context = [item.text for item in selected if item.kind == "rag"]
+        logger.debug(f"Planned context: {sum(item.tokens for item in selected)}/{budget} tokens, "
+                     f"{len(rag_context)}/{len(rag_hits)} RAG hits kept.")
+        return context, rag_context
         
     def _get_recent_context(self, max_tokens: int) -> str:
-        """ Gets recent conversation history, ensuring it fits max_tokens. """
-        recent_messages_text = []
-        current_tokens = 0
-        
-        # Iterate in reverse (most recent first)
-        for message in reversed(self.conversation_history):
-            msg_text = f"{message['role']}: {message['content']}"
-            msg_tokens = self.token_counter.count_tokens(msg_text)
-            
-            # Check if adding this message exceeds the limit
-            if current_tokens + msg_tokens > max_tokens:
-                # If even the first message is too long, truncate it
-                if not recent_messages_text:
-                     logger.warning(f"Single message exceeds max_tokens ({msg_tokens} > {max_tokens}). Truncating message.")
-                     encoded = self.tokenizer.encode(msg_text, max_length=max_tokens, truncation=True)
-                     recent_messages_text.append(self.tokenizer.decode(encoded))
-                     current_tokens = max_tokens # Set to max as we truncated
-                break # Stop adding messages
-                
-            recent_messages_text.append(msg_text)
-            current_tokens += msg_tokens
+        """ Gets recent conversation history, ensuring it fits max_tokens (binary search over cached token prefix sums). """
+        history = self.conversation_history
+        if not history:
+            return ""
+            
+        start = history.window_start(max_tokens)
+        if start == len(history):
+            # If even the most recent message is too long, truncate it
+            msg_text = history.format_message(history[-1])
+            logger.warning(f"Single message exceeds max_tokens ({history.token_count(-1)} > {max_tokens}). Truncating message.")
+            encoded = self.tokenizer.encode(msg_text, max_length=max_tokens, truncation=True)
+            return self.tokenizer.decode(encoded)
             
         # Return in chronological order
-        final_context = "\n\n".join(reversed(recent_messages_text))
-        logger.debug(f"_get_recent_context: Final tokens: {self.token_counter.count_tokens(final_context)}")
+        final_context = "\n\n".join(history.format_message(message) for message in history[start:])
+        logger.debug(f"_get_recent_context: {len(history) - start} messages, {history.tokens_between(start)} tokens")
         return final_context
     
+    def reconcile_history(self, messages: List[Dict[str, str]]) -> int:
+        """
+        用客户端每次请求重发的对话消息更新会话历史，只追加新的轮次
+        
+        按位置和内容哈希与已有历史对齐（见 ConversationHistory.diff），重复的消息不会再次追加或计算token数。
+        客户端改写了较早的消息时，从改写处截断历史，并使依赖被截断部分的已索引轮次和滚动摘要失效。
+        
+        Args:
+            messages: 客户端提供的 user/assistant 消息（不含本轮的查询）
+            
+        Returns:
+            追加的消息数
+        """
+        history = self.conversation_history
+        keep, new_messages = history.diff(messages)
+        if keep < len(history):
+            logger.info(f"Client history diverges at message {keep}; dropping {len(history) - keep} stored message(s).")
+            history.truncate(keep)
+            if keep < self.evicted_upto:
+                # 已索引的轮次中有被截断的消息，下次检索前按新历史重新索引
+                if self._turn_store is not None:
+                    self._turn_store.clear()
+                self.evicted_upto = 0
+            if keep < self.rolling_summarizer.current()[1]:
+                self.rolling_summarizer.reset()
+            else:
+                self.rolling_summarizer.cancel()
+        for message in new_messages:
+            history.append(message)
+        if new_messages:
+            logger.info(f"Reconciled client history: appended {len(new_messages)} new message(s).")
+        return len(new_messages)
+        
+    def close(self) -> None:
+        """
+        关闭会话的后台任务：取消未结束的摄入并停止摄入队列，取消滚动摘要
+
+        不等待正在存储的一组块结束；关闭后不能再提交后台摄入。
+        """
+        cancelled = self.ingest_queue.shutdown()
+        self.rolling_summarizer.cancel()
+        logger.info(f"Closed KimiEngine session {self.session_id} ({cancelled} ingestion job(s) cancelled).")
+
     def reset(self) -> None:
-        """重置会话历史和 RAG 存储"""
+        """
+        重置会话历史和 RAG 存储
+        
+        只清空状态，已加载的LLM与embedding模型保持不变；与 fork() 出的会话共享的存储不受影响。
+        """
         logger.info(f"Resetting KimiEngine state. Session ID: {self.session_id}")
-        self.conversation_history = []
-        # Reset RAG manager as well (clears stored summaries and vectors)
-        rag_cfg = self.config.get('rag', {})
+        # 先取消并等待后台摄入和滚动摘要结束，否则它们会在清空之后写回存储和哈希表
+        self.ingest_queue.cancel_all()
+        self.rolling_summarizer.cancel()
+        self.ingest_queue.wait()
+        self.rolling_summarizer.wait()
+        self.conversation_history.clear()
+        with self._ingest_lock:
+            self.context_fingerprint = ""
+            self.chunk_table = {}
+            self.ingest_digests = {}
+            self._reserved_digests = {}
+            self._reserved_chunks = {}
+        # Clear the RAG and document stores in place (keeps the loaded embedding model)
+        for store in (self._rag_manager, self._document_store, self._turn_store):
+            if store is not None:
+                store.clear()
+        self.evicted_upto = 0
+        self.rolling_summarizer.reset()
         # 确保llm_interface不会为None
-        if self.llm_interface is not None:
-            try:
-                logger.info(f"重新初始化RAGManager，配置: {rag_cfg}")
-                self.rag_manager = RAGManager(
-                    self.llm_interface, 
-                    embedding_model_name=rag_cfg.get('embedding_model', 'all-MiniLM-L6-v2'),
-                    use_faiss=rag_cfg.get('use_faiss', True)
-                )
-                logger.info("RAGManager重置成功")
-            except Exception as e:
-                logger.error(f"重置RAGManager时出错: {e}")
-                import traceback
-                traceback.print_exc()
-                raise RuntimeError(f"RAG重置失败: {e}")
-        else:
-            logger.error("Cannot reset RAG manager: llm_interface is None")
+        if self.llm_interface is None:
+            logger.error("llm_interface is None during reset")
             # 重新创建llm_interface
             try:
                 from openkimi.utils.llm_interface import get_llm_interface
                 logger.info(f"尝试重新初始化LLM接口，配置: {self.config['llm']}")
                 self.llm_interface = get_llm_interface(self.config["llm"])
-                if self.llm_interface is not None:
-                    logger.info("LLM接口重新初始化成功")
-                    try:
-                        self.rag_manager = RAGManager(
-                            self.llm_interface, 
-                            embedding_model_name=rag_cfg.get('embedding_model', 'all-MiniLM-L6-v2'),
-                            use_faiss=rag_cfg.get('use_faiss', True)
-                        )
-                        logger.info("RAGManager重置成功")
-                    except Exception as e:
-                        logger.error(f"重置RAGManager时出错: {e}")
-                        import traceback
-                        traceback.print_exc()
-                        raise RuntimeError(f"RAG重置失败: {e}")
-                else:
+                if self.llm_interface is None:
                     logger.critical("Failed to recreate llm_interface during reset")
                     raise RuntimeError("LLM接口重新初始化失败")
+                logger.info("LLM接口重新初始化成功")
+                self.framework_generator = None
             except Exception as e:
                 logger.critical(f"重新初始化LLM接口时出错: {e}")
                 import traceback
                 traceback.print_exc()
                 raise RuntimeError(f"LLM接口重新初始化失败: {e}")
                 
+    def fork(self, session_id: Optional[str] = None) -> "KimiEngine":
+        """
+        分叉当前会话（用于重新生成、假设分支等）
+        
+        新会话与当前会话共享模型，历史和各存储按引用共享、写时复制，
+        因此分叉不需要重新摄入或编码任何内容；此后两个会话互不影响。
+        
+        Args:
+            session_id: 新会话的ID，可选，不提供则自动生成
+            
+        Returns:
+            新的KimiEngine
+        """
+        forked = copy.copy(self)
+        forked.session_id = session_id or str(uuid.uuid4())
+        forked.config = copy.deepcopy(self.config)
+        forked.init_timings = dict(self.init_timings)
+        forked._lazy_init_lock = threading.RLock()
+        forked._turn_index_lock = threading.Lock()
+        forked._ingest_lock = threading.Lock()
+        forked.conversation_history = self.conversation_history.fork()
+        forked._rag_manager = self._rag_manager.fork() if self._rag_manager is not None else None
+        forked._document_store = self._document_store.fork() if self._document_store is not None else None
+        forked._turn_store = self._turn_store.fork() if self._turn_store is not None else None
+        forked.chunk_table = dict(self.chunk_table)
+        forked.ingest_digests = dict(self.ingest_digests)
+        forked._reserved_digests = {}
+        forked._reserved_chunks = {}
+        # 绑定到本引擎方法或带统计的组件按新会话重建
+        forked.rolling_summarizer = RollingSummarizer(forked._summarize_turns, idle_seconds=self.rolling_summarizer.idle_seconds)
+        forked.rolling_summarizer.load(*self.rolling_summarizer.current())
+        forked.ingest_queue = IngestionQueue(
+            functools.partial(forked._plan_ingest, precompress=False), forked._store_plan, forked._finish_ingest,
+            batch_size=self.ingest_queue.batch_size, idle_timeout=self.ingest_queue.idle_timeout,
+            job_ttl=self.ingest_queue.job_ttl
+        )
+        forked.router = QueryRouter.from_config(forked.config.get('router'))
+        forked.response_cache = forked._create_response_cache()
+        forked.last_stream_stats = {}
+        forked.last_stage_timings = {}
+        forked.last_turn_spans = {}
+        forked.last_trace = None
+        forked.session_usage = UsageMeter()
+        forked.last_turn_usage = {}
+        logger.info(f"Forked session {self.session_id} into {forked.session_id} ({len(self.conversation_history)} messages shared).")
+        return forked
+        
+    def snapshot(self) -> bytes:
+        """
+        将会话状态（历史、RAG存储与向量、配置）序列化为紧凑的二进制快照
+        
+        快照不包含模型本身，也不包含LLM配置中的api_key。
+        
+        Returns:
+            快照字节串，可通过 restore() / from_snapshot() 恢复
+        """
+        config = copy.deepcopy(self.config)
+        config.get("llm", {}).pop("api_key", None)
+        if self.has_rag_store:
+            rag_texts, rag_embeddings = self.rag_manager.export_state()
+        else:
+            rag_texts, rag_embeddings = [], np.zeros((0, 0), dtype=np.float32)
+        if self._document_store is not None:
+            doc_texts, doc_embeddings = self._document_store.export_state()
+        else:
+            doc_texts, doc_embeddings = [], np.zeros((0, 0), dtype=np.float32)
+        if self._turn_store is not None:
+            turn_texts, turn_embeddings = self._turn_store.export_state()
+        else:
+            turn_texts, turn_embeddings = [], np.zeros((0, 0), dtype=np.float32)
+        meta = {
+            "version": SNAPSHOT_VERSION,
+            "session_id": self.session_id,
+            "mpr_candidates": self.mpr_candidates,
+            "config": config,
+            "history": self.conversation_history.to_list(),
+            "rag_texts": rag_texts,
+            "doc_texts": doc_texts,
+            "turn_texts": turn_texts,
+            "evicted_upto": self.evicted_upto,
+            "history_digest": self.rolling_summarizer.current(),
+            "context_fingerprint": self.context_fingerprint,
+            "chunk_table": self.chunk_table,
+            "ingest_digests": self.ingest_digests
+        }
+        arrays = {
+            "history_tokens": np.asarray([self.conversation_history.token_count(i) for i in range(len(self.conversation_history))], dtype=np.int64),
+            "rag_embeddings": rag_embeddings,
+            "doc_embeddings": doc_embeddings,
+            "turn_embeddings": turn_embeddings
+        }
+        return pack_bundle(meta, arrays)
+        
+    def restore(self, data: bytes) -> None:
+        """
+        用快照替换当前会话状态，复用本引擎已加载的LLM与embedding模型
+        
+        历史消息的token数和RAG向量直接从快照读取，不重新编码。
+        
+        Args:
+            data: snapshot() 生成的快照
+        """
+        meta, arrays = unpack_bundle(data)
+        if meta.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"不支持的快照版本: {meta.get('version')}")
+            
+        snapshot_model = meta["config"].get("rag", {}).get("embedding_model")
+        current_model = self.config.get("rag", {}).get("embedding_model")
+        doc_texts = meta.get("doc_texts", [])
+        turn_texts = meta.get("turn_texts", [])
+        if (len(meta["rag_texts"]) or len(doc_texts) or len(turn_texts)) and snapshot_model != current_model:
+            raise ValueError(f"快照使用的embedding模型({snapshot_model})与当前引擎({current_model})不一致")
+            
+        # 与 reset() 相同：先取消并等待后台摄入和滚动摘要，避免它们把旧会话的内容写进恢复后的状态
+        self.ingest_queue.cancel_all()
+        self.rolling_summarizer.cancel()
+        self.ingest_queue.wait()
+        self.rolling_summarizer.wait()
+        
+        # 已创建的存储原地替换内容（保留已加载的embedding模型）；需要新建的存储复用该模型，
+        # 本会话还没有加载模型时用首次编码才加载的 LazyEmbeddingModel，恢复本身不加载模型
+        with self._lazy_init_lock:
+            model = self._loaded_embedding_model()
+            if model is None:
+                model = LazyEmbeddingModel(current_model or 'all-MiniLM-L6-v2')
+            rag_embeddings = np.asarray(arrays["rag_embeddings"], dtype=np.float32)
+            if self._rag_manager is None and meta["rag_texts"]:
+                self._rag_manager = self._lazy_init("rag_manager", lambda: self._create_rag_manager(
+                    embedding_model=model, vector_dimension=rag_embeddings.shape[1]))
+            if self._rag_manager is not None:
+                self._rag_manager.load_state(meta["rag_texts"], rag_embeddings)
+            if self._document_store is None and doc_texts:
+                self._document_store = DocumentStore(model, name="documents")
+            if self._document_store is not None:
+                self._document_store.load_state(doc_texts, arrays["doc_embeddings"])
+            if self._turn_store is None and turn_texts:
+                self._turn_store = DocumentStore(model, name="turns")
+            if self._turn_store is not None:
+                self._turn_store.load_state(turn_texts, arrays["turn_embeddings"])
+        self.evicted_upto = meta.get("evicted_upto", 0)
+        
+        history = ConversationHistory(self.token_counter)
+        for message, tokens in zip(meta["history"], arrays["history_tokens"].tolist()):
+            history.append(message, tokens=tokens)
+        self.conversation_history = history
+        self.rolling_summarizer.load(*meta.get("history_digest", ("", 0)))
+        
+        # LLM配置保持本引擎的设置（快照中不含密钥），其余配置以快照为准
+        config = meta["config"]
+        config["llm"] = self.config["llm"]
+        self.config = config
+        self.router = QueryRouter.from_config(self.config.get('router'))
+        self.response_cache = self._create_response_cache()
+        with self._ingest_lock:
+            self.context_fingerprint = meta.get("context_fingerprint", "")
+            self.chunk_table = meta.get("chunk_table", {})
+            self.ingest_digests = meta.get("ingest_digests", {})
+            self._reserved_digests = {}
+            self._reserved_chunks = {}
+        self.mpr_candidates = meta["mpr_candidates"]
+        self.session_id = meta["session_id"]
+        # 用量和最近一轮的统计属于被替换的会话，不带入恢复后的会话（与 fork() 相同）
+        self.last_stream_stats = {}
+        self.last_stage_timings = {}
+        self.last_turn_spans = {}
+        self.last_trace = None
+        self.session_usage = UsageMeter()
+        self.last_turn_usage = {}
+        logger.info(f"Restored session {self.session_id}: {len(history)} messages, {len(meta['rag_texts'])} RAG items, {len(doc_texts)} document chunks.")
+        
+    @classmethod
+    def from_snapshot(cls, data: bytes, **kwargs) -> "KimiEngine":
+        """
+        创建新引擎并从快照恢复状态
+        
+        Args:
+            data: snapshot() 生成的快照
+            **kwargs: 传给 KimiEngine 构造函数的参数（如 config_path、llm_config）
+            
+        Returns:
+            恢复后的引擎
+        """
+        engine = cls(**kwargs)
+        engine.restore(data)
+        return engine
+                
     def get_session_id(self) -> Optional[str]:
         """获取会话ID"""
         return self.session_id
@@ -5,6 +5,8 @@ import math
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 
+from openkimi.utils.tracing import traced
+
 class EntropyEvaluator:
     """信息熵评估器，支持多种粒度的信息熵计算方法"""
     
@@ -77,6 +79,7 @@ class EntropyEvaluator:
             
         return entropy
         
+    @traced("EntropyEvaluator.calculate_semantic_entropy", category="entropy")
     def calculate_semantic_entropy(self, texts: List[str]) -> float:
         """计算语义级别的信息熵（基于TF-IDF和余弦相似度）
         
@@ -152,6 +155,7 @@ class EntropyEvaluator:
         # 返回结构熵（句子长度熵和标点符号熵的加权平均）
         return 0.7 * length_entropy + 0.3 * punct_entropy
         
+    @traced("EntropyEvaluator.evaluate_text", category="entropy")
     def evaluate_text(
         self,
         text: str,
@@ -1,7 +1,10 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncGenerator
 from openkimi.utils.llm_interface import LLMInterface
 from openkimi.utils.prompt_loader import load_prompt
+from openkimi.utils.tracing import traced
 from .models.base import BaseModel
+import asyncio
+import logging
 import random
 import numpy as np
 
@@ -22,7 +25,19 @@ class FrameworkGenerator:
             "hierarchical": self._hierarchical_synthesis,
             "consensus": self._consensus_building
         }
+        try:
+            self.direct_answer_template = load_prompt('direct_answer')
+        except Exception as e:
+            logging.getLogger(__name__).error(f"加载直接回答提示模板时出错: {e}")
+            self.direct_answer_template = """请根据以下上下文信息直接回答用户的问题:
+
+用户问题: {query}
+
+{optional_context_section}
+
+回答:"""
         
+    @traced("FrameworkGenerator.generate_framework", category="framework")
     async def generate_framework(self, query: str, context: str) -> str:
         """生成解决方案框架"""
         prompt = f"""基于以下上下文，为问题"{query}"生成一个解决方案框架：
@@ -37,8 +52,33 @@ class FrameworkGenerator:
 4. 潜在挑战
 5. 评估标准
 """
-        return await self.model.generate(prompt)
+        return await self._generate(prompt)
+        
+    async def _generate(self, prompt: str) -> str:
+        """调用底层模型生成文本，兼容同步(LLMInterface)和异步(BaseModel)实现"""
+        if asyncio.iscoroutinefunction(self.model.generate):
+            return await self.model.generate(prompt)
+        # 同步接口在线程中执行，避免阻塞事件循环
+        return await asyncio.to_thread(self.model.generate, prompt)
+        
+    def _build_solution_prompt(self, query: str, framework: str, context: str) -> str:
+        """构建单个候选解决方案的提示"""
+        return f"""基于以下框架和上下文，为问题"{query}"生成一个详细的解决方案：
+
+框架：
+{framework}
+
+上下文：
+{context}
+
+请生成一个完整的解决方案，确保：
+1. 严格遵循框架结构
+2. 充分利用上下文信息
+3. 提供具体的实施建议
+4. 考虑潜在的限制和解决方案
+"""
         
+    @traced("FrameworkGenerator.generate_solution_mpr", category="framework")
     async def generate_solution_mpr(
         self,
         query: str,
@@ -68,23 +108,14 @@ class FrameworkGenerator:
         # 2. 为每个采样的上下文生成候选解决方案
         candidates = []
         for ctx in sampled_contexts:
-            prompt = f"""基于以下框架和上下文，为问题"{query}"生成一个详细的解决方案：
-
-框架：
-{framework}
-
-上下文：
-{ctx}
-
-请生成一个完整的解决方案，确保：
-1. 严格遵循框架结构
-2. 充分利用上下文信息
-3. 提供具体的实施建议
-4. 考虑潜在的限制和解决方案
-"""
-            solution = await self.model.generate(prompt)
+            prompt = self._build_solution_prompt(query, framework, ctx)
+            solution = await self._generate(prompt)
             candidates.append(solution)
             
+        # 单个候选无需合成，直接返回（与stream_solution的输出保持一致）
+        if len(candidates) == 1:
+            return candidates[0]
+            
         # 3. 使用选定的策略合成最终解决方案
         final_solution = self.solution_synthesis_strategies[synthesis_strategy](
             query, framework, candidates
@@ -92,6 +123,69 @@ class FrameworkGenerator:
         
         return final_solution
         
+    async def stream_solution(
+        self,
+        query: str,
+        framework: str,
+        useful_context: str,
+        rag_context: List[str],
+        context_strategy: str = "diversity"
+    ) -> AsyncGenerator[str, None]:
+        """流式生成单候选解决方案，后端产生token后立即返回
+        
+        Args:
+            query: 用户查询
+            framework: 解决方案框架
+            useful_context: 有用的上下文信息
+            rag_context: RAG检索的上下文列表
+            context_strategy: 上下文采样策略
+            
+        Yields:
+            生成的文本片段
+        """
+        ctx = self.context_sampling_strategies[context_strategy](useful_context, rag_context, 1)[0]
+        async for chunk in self._stream(self._build_solution_prompt(query, framework, ctx)):
+            yield chunk
+            
+    def _build_direct_prompt(self, query: str, useful_context: str, rag_context: List[str]) -> str:
+        """构建不经过框架的直接回答提示"""
+        context = "\n\n".join(part for part in [useful_context] + list(rag_context) if part)
+        context_section = f"上下文：\n{context}" if context else ""
+        return self.direct_answer_template.format(query=query, optional_context_section=context_section)
+            
+    @traced("FrameworkGenerator.generate_direct_answer", category="framework")
+    async def generate_direct_answer(self, query: str, useful_context: str, rag_context: List[str]) -> str:
+        """快速路径：跳过框架生成，单次调用直接回答"""
+        return await self._generate(self._build_direct_prompt(query, useful_context, rag_context))
+        
+    async def stream_direct_answer(self, query: str, useful_context: str, rag_context: List[str]) -> AsyncGenerator[str, None]:
+        """快速路径的流式版本"""
+        async for chunk in self._stream(self._build_direct_prompt(query, useful_context, rag_context)):
+            yield chunk
+            
+    async def _stream(self, prompt: str) -> AsyncGenerator[str, None]:
+        """流式调用底层模型，兼容同步迭代器、异步迭代器和不支持流式的模型"""
+        stream_generate = getattr(self.model, "stream_generate", None)
+        if stream_generate is None or not getattr(self.model, "supports_streaming", True):
+            # 后端不支持流式时一次性生成，不必为逐个取片段占用线程
+            yield await self._generate(prompt)
+            return
+            
+        stream = stream_generate(prompt)
+        if hasattr(stream, "__aiter__"):
+            async for chunk in stream:
+                yield chunk
+            return
+            
+        # 同步迭代器：逐个在线程中取下一个片段，不阻塞事件循环
+        sentinel = object()
+        iterator = iter(stream)
+        while True:
+            chunk = await asyncio.to_thread(next, iterator, sentinel)
+            if chunk is sentinel:
+                break
+            yield chunk
+        
     def _random_sampling(self, useful_context: str, rag_context: List[str], num_samples: int) -> List[str]:
         """随机采样上下文"""
         all_contexts = [useful_context] + rag_context
@@ -235,7 +329,7 @@ class FrameworkGenerator:
             
         # 合成详细说明（使用加权平均）
         if levels["details"]:
-            final_solution.extend(self._weighted_average(query, framework, levels["details"]))
+            final_solution.append(self._weighted_average(query, framework, levels["details"]))
             
         # 合成建议（使用多数投票）
         if levels["recommendations"]:
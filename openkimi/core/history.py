@@ -0,0 +1,181 @@
+import bisect
+import hashlib
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from openkimi.utils.llm_interface import TokenCounter
+
+class ConversationHistory:
+    """
+    会话历史：每条消息的token数只在追加时计算一次，并维护前缀和数组
+
+    最近上下文窗口可通过二分查找前缀和得到，不需要重新编码任何消息。
+    对外表现为消息字典（{"role": ..., "content": ...}）的列表，
+    兼容原先直接 append/索引 conversation_history 的代码。
+    """
+
+    def __init__(self, token_counter: TokenCounter, messages: Optional[List[Dict[str, str]]] = None):
+        """
+        初始化会话历史
+
+        Args:
+            token_counter: 用于计算消息token数的计数器
+            messages: 初始消息列表，可选
+        """
+        self.token_counter = token_counter
+        self._messages: List[Dict[str, str]] = []
+        self._tokens: List[int] = []
+        # _prefix[i] 为前 i 条消息的token总数，长度始终为 len(self) + 1
+        self._prefix: List[int] = [0]
+        # 每条消息（角色+内容）的哈希，用于与客户端重发的消息列表对齐
+        self._hashes: List[str] = []
+        # fork() 之后与另一份历史共享底层列表，首次修改前复制（写时复制）
+        self._shared = False
+        for message in messages or []:
+            self.append(message)
+
+    @staticmethod
+    def format_message(message: Dict[str, str]) -> str:
+        """消息在上下文中的文本形式"""
+        return f"{message['role']}: {message['content']}"
+
+    @staticmethod
+    def message_hash(message: Dict[str, str]) -> str:
+        """消息的内容哈希（只取角色和内容）"""
+        return hashlib.sha1(f"{message['role']}\x00{message['content']}".encode("utf-8")).hexdigest()
+
+    def append(self, message: Dict[str, str], tokens: Optional[int] = None) -> None:
+        """
+        追加一条消息
+
+        Args:
+            message: 消息字典，包含 role 和 content
+            tokens: 已知的token数（例如从快照恢复时），不提供则计算一次
+        """
+        if tokens is None:
+            tokens = self.token_counter.count_tokens(self.format_message(message))
+        if self._shared:
+            self._messages, self._tokens, self._prefix = list(self._messages), list(self._tokens), list(self._prefix)
+            self._hashes = list(self._hashes)
+            self._shared = False
+        self._messages.append(message)
+        self._tokens.append(tokens)
+        self._prefix.append(self._prefix[-1] + tokens)
+        self._hashes.append(self.message_hash(message))
+
+    def clear(self) -> None:
+        """清空历史"""
+        self._messages = []
+        self._tokens = []
+        self._prefix = [0]
+        self._hashes = []
+        self._shared = False
+
+    def truncate(self, length: int) -> None:
+        """只保留前 length 条消息"""
+        self._messages = self._messages[:length]
+        self._tokens = self._tokens[:length]
+        self._prefix = self._prefix[:length + 1]
+        self._hashes = self._hashes[:length]
+        self._shared = False
+
+    def diff(self, messages: List[Dict[str, str]]) -> Tuple[int, List[Dict[str, str]]]:
+        """
+        将客户端提供的消息列表与已有历史按位置和内容哈希对齐
+
+        - 客户端列表为空：没有新消息
+        - 客户端列表是历史的真前缀（如重新生成之后的回答）：截断到客户端列表的长度
+        - 历史是客户端列表的前缀：追加其余部分
+        - 客户端只发送了最近的一段（其开头出现在历史中）：从该处对齐，追加重合之后的部分
+        - 其余情况视为客户端改写了历史（如重新生成）：从第一个不同的位置截断后追加
+
+        Args:
+            messages: 客户端提供的消息列表（按时间顺序）
+
+        Returns:
+            (应保留的已有消息数, 需要追加的消息列表)
+        """
+        incoming = [self.message_hash(message) for message in messages]
+        common = 0
+        limit = min(len(incoming), len(self._hashes))
+        while common < limit and incoming[common] == self._hashes[common]:
+            common += 1
+        if not incoming:
+            return len(self._hashes), []
+        if common == len(incoming):
+            return common, []
+        if common == len(self._hashes):
+            return common, list(messages[common:])
+        # 客户端只发送了最近的一段：在历史中找到窗口开头的位置（取最早的，即最长的重合）
+        if common == 0:
+            for start in range(1, len(self._hashes)):
+                if self._hashes[start] != incoming[0]:
+                    continue
+                matched = 1
+                while (matched < len(incoming) and start + matched < len(self._hashes)
+                       and self._hashes[start + matched] == incoming[matched]):
+                    matched += 1
+                return start + matched, list(messages[matched:])
+        return common, list(messages[common:])
+
+    def last_content(self, role: str) -> str:
+        """最近一条指定角色的消息内容，没有时为空串"""
+        for message in reversed(self._messages):
+            if message.get("role") == role:
+                return message.get("content", "")
+        return ""
+
+    def fork(self) -> "ConversationHistory":
+        """
+        O(1) 复制：新历史与当前历史共享消息和token数，任一方追加消息时才复制底层列表
+
+        Returns:
+            新的会话历史
+        """
+        forked = ConversationHistory(self.token_counter)
+        forked._messages, forked._tokens, forked._prefix = self._messages, self._tokens, self._prefix
+        forked._hashes = self._hashes
+        forked._shared = self._shared = True
+        return forked
+
+    def token_count(self, index: int) -> int:
+        """第 index 条消息的token数"""
+        return self._tokens[index]
+
+    @property
+    def total_tokens(self) -> int:
+        """全部消息的token总数"""
+        return self._prefix[-1]
+
+    def tokens_between(self, start: int, end: Optional[int] = None) -> int:
+        """消息区间 [start, end) 的token总数，O(1)"""
+        end = len(self._messages) if end is None else end
+        return self._prefix[end] - self._prefix[start]
+
+    def window_start(self, max_tokens: int) -> int:
+        """
+        找出能放入 max_tokens 的最长后缀窗口的起始下标
+
+        Returns:
+            窗口起始下标；等于 len(self) 表示连最后一条消息都放不下
+        """
+        # 最小的 i 使得 total - prefix[i] <= max_tokens
+        return bisect.bisect_left(self._prefix, self._prefix[-1] - max_tokens)
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __bool__(self) -> bool:
+        return bool(self._messages)
+
+    def __iter__(self) -> Iterator[Dict[str, str]]:
+        return iter(self._messages)
+
+    def __reversed__(self) -> Iterator[Dict[str, str]]:
+        return reversed(self._messages)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Dict[str, str], List[Dict[str, str]]]:
+        return self._messages[index]
+
+    def to_list(self) -> List[Dict[str, str]]:
+        """以普通列表形式返回全部消息"""
+        return list(self._messages)
@@ -0,0 +1,276 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+class IngestPlan:
+    """
+    一次摄入的计划：待存储的块及其哈希，以及全部存好后要记入会话的原文摘要
+
+    计划阶段只预留块哈希和原文摘要（防止并发摄入重复处理），块存好后才记入已摄入记录，
+    失败或取消时释放未存储部分的预留，之后重新摄入会重试这些块。
+    """
+
+    def __init__(self, content_digest: str, chunks: List[Tuple[str, str]], chunk_hashes: List[str],
+                 text_digest: Optional[str] = None, text_length: int = 0):
+        """
+        初始化摄入计划
+
+        Args:
+            content_digest: 本次实际摄入文本的sha256，用于更新上下文指纹
+            chunks: 待存储的 (文本块, 去向) 列表
+            chunk_hashes: 与 chunks 一一对应的块哈希
+            text_digest: 完整原文的sha256（记入已摄入文本），不去重时为None
+            text_length: 完整原文的字符数
+        """
+        self.content_digest = content_digest
+        self.chunks = chunks
+        self.chunk_hashes = chunk_hashes
+        self.text_digest = text_digest
+        self.text_length = text_length
+        # 已存储并记入块哈希表的块数（按顺序存储）
+        self.stored = 0
+
+class IngestionJob:
+    """一次后台摄入任务的进度"""
+
+    def __init__(self, text: str, name: Optional[str] = None):
+        self.job_id = f"ingest-{uuid.uuid4()}"
+        self.name = name or self.job_id
+        self.text = text
+        self.status = "queued"
+        self.total: Optional[int] = None
+        self.done = 0
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancelled = False
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "error", "cancelled")
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        """按已完成块的平均耗时估算剩余时间，尚无法估算时为None"""
+        if self.status != "running" or not self.total or not self.done:
+            return None
+        elapsed = time.time() - self.started_at
+        return elapsed / self.done * (self.total - self.done)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """可JSON序列化的进度信息"""
+        return {
+            "job_id": self.job_id,
+            "name": self.name,
+            "status": self.status,
+            "chunks_done": self.done,
+            "chunks_total": self.total,
+            "eta_seconds": self.eta_seconds,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error
+        }
+
+class IngestionQueue:
+    """
+    会话级后台摄入队列
+
+    单个守护线程按提交顺序处理任务（保证块哈希表和上下文指纹的更新顺序）。
+    每个任务先由 plan_fn 分块、去重、分类，再由 store_fn 每次存储 batch_size 个块，
+    存好的块立即可以被检索，摄入期间对话照常进行；最后由 finish_fn 提交（全部存好时）或释放（出错或取消时）计划。
+    工作线程空闲 idle_timeout 秒后退出（下次提交时重新启动），因此不会一直持有引擎；
+    已结束的任务保留 job_ttl 秒供查询进度，之后被清除。
+    """
+
+    def __init__(self, plan_fn: Callable[[str], Optional[IngestPlan]],
+                 store_fn: Callable[[IngestPlan, int, int], None],
+                 finish_fn: Callable[[IngestPlan, bool], None], batch_size: int = 8,
+                 idle_timeout: float = 30.0, job_ttl: float = 3600.0):
+        """
+        初始化摄入队列
+
+        Args:
+            plan_fn: 把文本变为摄入计划，没有需要摄入的内容时返回None
+            store_fn: 存储计划中 [start, end) 范围的块
+            finish_fn: 结束计划，第二个参数为是否全部存好
+            batch_size: 每次存储的块数，决定进度更新和可见性的粒度
+            idle_timeout: 工作线程空闲多少秒后退出
+            job_ttl: 已结束的任务保留多少秒
+        """
+        self.logger = logging.getLogger(__name__)
+        self.plan_fn = plan_fn
+        self.store_fn = store_fn
+        self.finish_fn = finish_fn
+        self.batch_size = max(1, batch_size)
+        self.idle_timeout = idle_timeout
+        self.job_ttl = job_ttl
+        self.jobs: Dict[str, IngestionJob] = {}
+        self._queue: "queue.Queue[Optional[IngestionJob]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def submit(self, text: str, name: Optional[str] = None) -> str:
+        """
+        提交一段文本，立即返回
+
+        Args:
+            text: 需要摄入的文本
+            name: 任务名称（如文件名），可选
+
+        Returns:
+            任务ID
+
+        Raises:
+            RuntimeError: 队列已关闭
+        """
+        job = IngestionJob(text, name)
+        self._prune_jobs()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("摄入队列已关闭")
+            self.jobs[job.job_id] = job
+            # 入队与工作线程的空闲退出判断都在锁内，任务不会落在刚退出的线程上
+            self._queue.put(job)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="ingest-queue", daemon=True)
+                self._worker.start()
+        self.logger.info(f"Queued ingestion job {job.job_id} ({len(text)} characters).")
+        return job.job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """单个任务的进度，任务不存在（或已被清除）时为None"""
+        self._prune_jobs()
+        job = self.jobs.get(job_id)
+        return job.to_dict() if job is not None else None
+
+    def progress(self) -> Dict[str, Any]:
+        """
+        全部任务的汇总进度
+
+        Returns:
+            {"pending": 未结束的任务数, "chunks_done", "chunks_total", "eta_seconds", "jobs": [...]}；
+            chunks_total 只统计已完成分块的任务
+        """
+        self._prune_jobs()
+        jobs = list(self.jobs.values())
+        active = [job for job in jobs if not job.finished]
+        etas = [job.eta_seconds for job in active if job.eta_seconds is not None]
+        return {
+            "pending": len(active),
+            "chunks_done": sum(job.done for job in active),
+            "chunks_total": sum(job.total or 0 for job in active),
+            "eta_seconds": max(etas) if etas else None,
+            "jobs": [job.to_dict() for job in jobs]
+        }
+
+    def cancel_all(self) -> int:
+        """
+        取消所有未结束的任务（正在存储的一组块会先完成）
+
+        Returns:
+            取消的任务数
+        """
+        cancelled = 0
+        for job in list(self.jobs.values()):
+            if not job.finished:
+                job.cancelled = True
+                cancelled += 1
+        return cancelled
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待所有已提交的任务结束
+
+        Returns:
+            是否全部结束（超时返回False）
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while any(not job.finished for job in list(self.jobs.values())):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def shutdown(self) -> int:
+        """
+        关闭队列：取消所有未结束的任务并让工作线程退出，之后不再接受提交
+
+        Returns:
+            取消的任务数
+        """
+        with self._lock:
+            self._closed = True
+            cancelled = self.cancel_all()
+            if self._worker is not None and self._worker.is_alive():
+                # 唤醒等待中的工作线程；排在它前面的任务已被标记取消，会直接结束
+                self._queue.put(None)
+        return cancelled
+
+    def _prune_jobs(self) -> None:
+        """清除结束超过 job_ttl 秒的任务"""
+        cutoff = time.time() - self.job_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self.jobs.items()
+                       if job.finished_at is not None and job.finished_at < cutoff]
+            for job_id in expired:
+                del self.jobs[job_id]
+
+    def _run(self) -> None:
+        while True:
+            try:
+                job = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        self._worker = None
+                        return
+                continue
+            if job is None:
+                self._queue.task_done()
+                with self._lock:
+                    self._worker = None
+                return
+            try:
+                self._process(job)
+            finally:
+                job.text = ""
+                job.finished_at = time.time()
+                self._queue.task_done()
+
+    def _process(self, job: IngestionJob) -> None:
+        if job.cancelled:
+            job.status = "cancelled"
+            return
+        job.status = "running"
+        job.started_at = time.time()
+        plan = None
+        status = "done"
+        try:
+            plan = self.plan_fn(job.text)
+            chunks = plan.chunks if plan is not None else []
+            job.total = len(chunks)
+            for start in range(0, len(chunks), self.batch_size):
+                if job.cancelled:
+                    status = "cancelled"
+                    break
+                end = min(start + self.batch_size, len(chunks))
+                self.store_fn(plan, start, end)
+                job.done = end
+        except Exception as e:
+            status = "error"
+            job.error = str(e)
+            self.logger.error(f"后台摄入任务 {job.job_id} 失败: {e}")
+        if plan is not None:
+            # 只有全部存好才记为已摄入；出错或取消时释放预留，重新提交会重试未存储的块
+            self.finish_fn(plan, status == "done")
+        job.status = status
+        if status == "cancelled":
+            self.logger.info(f"Ingestion job {job.job_id} cancelled after {job.done}/{job.total} chunk(s).")
+        elif status == "done":
+            self.logger.info(f"Ingestion job {job.job_id} finished: {job.done} chunk(s) in {time.time() - job.started_at:.2f}s.")
@@ -1,4 +1,3 @@
-import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -65,13 +64,8 @@ class LLMInterface:
                 async for chunk in self.model.stream_generate(prompt, **kwargs):
                     yield chunk
             else:
-                # 如果不支持流式生成，则使用普通生成并模拟流式输出
-                response = await self._call_model(prompt, **kwargs)
-                # 每10个字符发送一次
-                for i in range(0, len(response), 10):
-                    chunk = response[i:i+10]
-                    yield chunk
-                    await asyncio.sleep(0.05)  # 添加小延迟以模拟流式输出
+                # 如果不支持流式生成，则一次性返回完整结果
+                yield await self._call_model(prompt, **kwargs)
                     
         except Exception as e:
             logger.error(f"Error in stream generation: {str(e)}")
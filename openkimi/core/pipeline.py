@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from openkimi.utils.tracing import trace
+from openkimi.utils.usage import usage_stage
+
+logger = logging.getLogger(__name__)
+
+_NO_FALLBACK = object()
+
+class StageTimeoutError(RuntimeError):
+    """阶段执行超时且没有可用的降级结果"""
+    pass
+
+class Stage:
+    """流水线中的一个阶段：一个异步函数及其依赖的阶段"""
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[Dict[str, Any]], Awaitable[Any]],
+        deps: Iterable[str] = (),
+        timeout: Optional[float] = None,
+        fallback: Any = _NO_FALLBACK
+    ):
+        """
+        初始化阶段
+
+        Args:
+            name: 阶段名称，在同一流水线内唯一
+            func: 异步函数，参数为已完成依赖阶段的结果字典 {阶段名: 结果}
+            deps: 依赖的阶段名称
+            timeout: 超时时间（秒），None 表示不限时
+            fallback: 超时或出错时使用的降级结果；不提供则错误向上传播
+        """
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.fallback = fallback
+
+    @property
+    def has_fallback(self) -> bool:
+        return self.fallback is not _NO_FALLBACK
+
+class StagePipeline:
+    """
+    按依赖关系并发执行各阶段的小型DAG执行器
+
+    每个阶段在其依赖全部完成后立即启动，互不依赖的阶段并发运行，
+    因此总耗时约等于关键路径的耗时，而不是各阶段耗时之和。
+    """
+
+    def __init__(self, stages: List[Stage]):
+        """
+        初始化流水线
+
+        Args:
+            stages: 阶段列表，每个阶段的依赖必须出现在它之前（保证无环）
+        """
+        self.stages: Dict[str, Stage] = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"重复的阶段名称: {stage.name}")
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"阶段 {stage.name} 依赖未定义（或定义在其后）的阶段: {dep}")
+            self.stages[stage.name] = stage
+        # 最近一次运行中每个阶段的 (开始, 结束) 时间，相对于 run() 开始的秒数
+        self.timings: Dict[str, Dict[str, float]] = {}
+        # 最近一次 run() 开始时的 perf_counter 值，用于把 timings 换算为绝对时间
+        self.run_start: Optional[float] = None
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        执行流水线
+
+        Returns:
+            各阶段结果字典 {阶段名: 结果}
+        """
+        self.timings = {}
+        run_start = self.run_start = time.perf_counter()
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_stage(stage: Stage) -> Any:
+            dep_results = {}
+            for dep in stage.deps:
+                dep_results[dep] = await tasks[dep]
+
+            start = time.perf_counter()
+            try:
+                with trace(f"stage:{stage.name}", category="pipeline"), usage_stage(stage.name):
+                    return await asyncio.wait_for(stage.func(dep_results), timeout=stage.timeout)
+            except asyncio.TimeoutError:
+                if stage.has_fallback:
+                    logger.warning(f"阶段 {stage.name} 超时（{stage.timeout}s），使用降级结果")
+                    return stage.fallback
+                raise StageTimeoutError(f"阶段 {stage.name} 超时（{stage.timeout}s）")
+            except Exception as e:
+                if stage.has_fallback:
+                    logger.error(f"阶段 {stage.name} 出错，使用降级结果: {e}")
+                    return stage.fallback
+                raise
+            finally:
+                end = time.perf_counter()
+                self.timings[stage.name] = {
+                    "start": start - run_start,
+                    "end": end - run_start,
+                    "duration": end - start
+                }
+
+        for stage in self.stages.values():
+            tasks[stage.name] = asyncio.create_task(run_stage(stage), name=f"stage:{stage.name}")
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            # 等待被取消的任务结束，避免 "Task exception was never retrieved"
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+        logger.debug(f"流水线完成，耗时 {time.perf_counter() - run_start:.3f}s，各阶段: {self.timings}")
+        return {name: task.result() for name, task in tasks.items()}
@@ -1,10 +1,19 @@
 import logging
 import re
 import math
+import hashlib
+import zlib
 import numpy as np
 from collections import Counter
-from typing import List, Dict, Tuple, Any, Optional
+from typing import Callable, List, Dict, Tuple, Any, Optional
 from .entropy import EntropyEvaluator
+from openkimi.utils.tracing import traced
+
+# 句子切分：保留句末标点和其后的空白，拼接选中的句子时保持原文格式
+_SENTENCE_PATTERN = re.compile(r"[^.!?。！？\n]+(?:[.!?。！？]+|\n|$)\s*|\n+")
+# 打分用的词元：英文/数字按词，中日韩文字按单字
+_SCORE_TOKEN_PATTERN = re.compile(r"[a-z0-9_]+|[\u4e00-\u9fff]")
+_HASH_DIM = 1024
 
 class TextProcessor:
     """文本处理器：负责文本分割、信息熵计算和文本块评估"""
@@ -14,7 +23,8 @@ class TextProcessor:
         batch_size: int = 512,
         entropy_threshold: float = 2.5,
         overlap_size: int = 50,
-        entropy_method: str = "weighted"
+        entropy_method: str = "weighted",
+        chunking: str = "words"
     ):
         """
         初始化文本处理器
@@ -25,21 +35,27 @@ class TextProcessor:
             overlap_size: 文本块重叠大小（以词为单位）
             entropy_method: 信息熵计算方法，可选值有"word"（词熵）、"ngram"（n-gram熵）、
                            "semantic"（语义熵）、"structural"（结构熵）、"weighted"（加权熵）
+            chunking: 分块方式，"words"（按词数分块）或 "content"（基于滚动哈希的内容定义分块）
         """
         self.logger = logging.getLogger(__name__)
         self.batch_size = batch_size
         self.entropy_threshold = entropy_threshold
         self.overlap_size = overlap_size
         self.entropy_method = entropy_method
+        if chunking not in ("words", "content"):
+            raise ValueError(f"不支持的分块方式: {chunking}")
+        self.chunking = chunking
         self.entropy_evaluator = EntropyEvaluator()
     
-    def split_into_batches(self, text: str, by_sentence: bool = True) -> List[str]:
+    @traced("TextProcessor.split_into_batches", category="processor")
+    def split_into_batches(self, text: str, by_sentence: bool = True, chunking: Optional[str] = None) -> List[str]:
         """
         将文本分割成固定大小的批次
         
         Args:
             text: 要分割的文本
-            by_sentence: 是否尝试在句子边界分割
+            by_sentence: 是否尝试在句子边界分割（仅按词数分块时有效）
+            chunking: 分块方式，默认使用初始化时的设置
             
         Returns:
             分割后的文本块列表
@@ -47,6 +63,9 @@ class TextProcessor:
         # 分词
         words = text.split()
         
+        if (chunking or self.chunking) == "content":
+            return self._split_content_defined(words)
+        
         # 如果by_sentence=True，尝试在句子边界分割
         if by_sentence:
             # 获取句子边界位置
@@ -74,8 +93,11 @@ class TextProcessor:
                 # 如果找不到句子结束点，就按固定大小切分
                 batches.append(' '.join(words[start_idx:end_idx]))
                 
-                # 更新起始位置，考虑overlap
-                start_idx = max(0, end_idx - self.overlap_size)
+                # 更新起始位置，考虑overlap（保证向前推进，最后一块之后结束）
+                if end_idx >= len(words):
+                    break
+                next_start = end_idx - self.overlap_size
+                start_idx = next_start if next_start > start_idx else end_idx
         else:
             # 简单按固定大小切分，考虑overlap
             batches = []
@@ -84,6 +106,55 @@ class TextProcessor:
         
         return batches
     
+    def _split_content_defined(self, words: List[str]) -> List[str]:
+        """
+        内容定义分块：用按词滚动的 gear 哈希决定块边界
+        
+        边界只取决于附近约32个词的内容，因此在文档中插入或删除内容只会改变附近的块，
+        其余块与修改前完全相同（哈希一致）。块长度介于 batch_size/4 与 batch_size 个词之间，
+        平均约 batch_size/2；块之间不重叠。
+        
+        Args:
+            words: 分词结果
+            
+        Returns:
+            分割后的文本块列表
+        """
+        min_words = max(self.batch_size // 4, 1)
+        max_words = max(self.batch_size, min_words)
+        # 期望在 min_words 之后再经过约 (batch_size/2 - min_words) 个词出现边界
+        target = max(self.batch_size // 2 - min_words, 1)
+        mask = (1 << max(target.bit_length() - 1, 0)) - 1
+        
+        batches = []
+        start = 0
+        rolling = 0
+        for i, word in enumerate(words):
+            # zlib.crc32 在不同进程间稳定（内置 hash() 对字符串加了随机盐）
+            rolling = ((rolling << 1) + zlib.crc32(word.encode("utf-8"))) & 0xFFFFFFFF
+            length = i + 1 - start
+            if length >= max_words or (length >= min_words and (rolling & mask) == 0):
+                batches.append(' '.join(words[start:i + 1]))
+                start = i + 1
+                rolling = 0
+        if start < len(words):
+            batches.append(' '.join(words[start:]))
+        return batches
+        
+    @staticmethod
+    def chunk_hash(chunk: str) -> str:
+        """
+        文本块的内容哈希（忽略空白差异），相同内容的块在任意文档中哈希相同
+        
+        Args:
+            chunk: 文本块
+            
+        Returns:
+            十六进制哈希字符串
+        """
+        normalized = ' '.join(chunk.split())
+        return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        
     def calculate_entropy(self, text: str, context_texts: Optional[List[str]] = None) -> Dict[str, float]:
         """
         计算文本的信息熵
@@ -99,6 +170,7 @@ class TextProcessor:
         result = self.entropy_evaluator.evaluate_text(text, context_texts)
         return result
     
+    @traced("TextProcessor.classify_by_entropy", category="processor")
     def classify_by_entropy(
         self, 
         batches: List[str], 
@@ -154,6 +226,7 @@ class TextProcessor:
         
         return useful_batches, less_useful_batches
         
+    @traced("TextProcessor.get_batch_entropy_ranking", category="processor")
     def get_batch_entropy_ranking(
         self, 
         batches: List[str], 
@@ -212,4 +285,77 @@ class TextProcessor:
         ranked_batches = self.get_batch_entropy_ranking(batches)
         
         # 返回top_k个信息熵最高的片段
-        return [batch for batch, _ in ranked_batches[:top_k]] 
\ No newline at end of file
+        return [batch for batch, _ in ranked_batches[:top_k]]
+        
+    @staticmethod
+    def _hashed_bow(tokens: List[str]) -> np.ndarray:
+        """词袋向量（哈希到固定维度），用于计算与查询的相关度"""
+        vector = np.zeros(_HASH_DIM, dtype=np.float32)
+        if tokens:
+            indices = np.fromiter((zlib.crc32(t.encode("utf-8")) % _HASH_DIM for t in tokens), dtype=np.int64, count=len(tokens))
+            np.add.at(vector, indices, 1.0)
+        return vector
+        
+    @traced("TextProcessor.compress_extractive", category="processor")
+    def compress_extractive(
+        self,
+        text: str,
+        max_tokens: int,
+        count_tokens: Callable[[str], int],
+        query: Optional[str] = None,
+        relevance_weight: float = 0.5
+    ) -> str:
+        """
+        抽取式压缩：不调用LLM，只保留得分最高的句子直到用满token预算
+        
+        句子得分 = (1 - relevance_weight) * 归一化信息熵 + relevance_weight * 与查询的词袋余弦相似度，
+        没有查询时只按信息熵排序。选中的句子按原文顺序拼接。
+        
+        Args:
+            text: 要压缩的文本
+            max_tokens: token预算
+            count_tokens: 计算token数的函数
+            query: 当前查询，可选
+            relevance_weight: 查询相关度的权重
+            
+        Returns:
+            压缩后的文本（单个句子超出预算时可能为空）
+        """
+        sentences = [m.group(0) for m in _SENTENCE_PATTERN.finditer(text) if m.group(0).strip()]
+        if not sentences:
+            return ""
+            
+        token_lists = [_SCORE_TOKEN_PATTERN.findall(sentence.lower()) for sentence in sentences]
+        entropies = np.zeros(len(sentences), dtype=np.float32)
+        for i, tokens in enumerate(token_lists):
+            if tokens:
+                _, counts = np.unique(tokens, return_counts=True)
+                p = counts / counts.sum()
+                entropies[i] = float(-(p * np.log2(p)).sum())
+        scores = entropies / entropies.max() if entropies.max() > 0 else entropies
+        
+        query_tokens = _SCORE_TOKEN_PATTERN.findall(query.lower()) if query else []
+        if query_tokens:
+            matrix = np.stack([self._hashed_bow(tokens) for tokens in token_lists])
+            query_vector = self._hashed_bow(query_tokens)
+            norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vector)
+            relevance = np.divide(matrix @ query_vector, norms, out=np.zeros(len(sentences), dtype=np.float32), where=norms > 0)
+            scores = (1 - relevance_weight) * scores + relevance_weight * relevance
+            
+        sentence_tokens = [count_tokens(sentence) for sentence in sentences]
+        selected = []
+        used = 0
+        for i in np.argsort(-scores, kind="stable"):
+            if used + sentence_tokens[i] <= max_tokens:
+                selected.append(int(i))
+                used += sentence_tokens[i]
+                
+        selected.sort()
+        compressed = "".join(sentences[i] for i in selected).strip()
+        # 分别计数与整体计数可能略有出入，超出时去掉得分最低的句子
+        while selected and count_tokens(compressed) > max_tokens:
+            selected.remove(min(selected, key=lambda i: scores[i]))
+            compressed = "".join(sentences[i] for i in selected).strip()
+            
+        self.logger.debug(f"抽取式压缩: 保留{len(selected)}/{len(sentences)}个句子，约{used}/{max_tokens} tokens")
+        return compressed
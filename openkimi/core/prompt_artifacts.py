@@ -0,0 +1,91 @@
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+class PromptArtifact:
+    """
+    固定系统提示词的预计算摄入结果（分块去向、RAG摘要与向量、文档块与向量、token数）
+
+    由 KimiEngine.precompute_prompt() 生成，KimiEngine.attach_prompt() 直接写入会话存储，
+    不再重复分块、信息熵分类、摘要或编码。创建后不应修改，可被任意多个会话共享。
+    """
+
+    def __init__(self, name: str, text: str, token_count: int, embedding_model: Optional[str],
+                 chunk_table: Dict[str, str], rag_texts: List[str], rag_embeddings: np.ndarray,
+                 doc_texts: List[str], doc_embeddings: np.ndarray):
+        """
+        初始化预计算结果
+
+        Args:
+            name: 名称（如 "cot"）
+            text: 提示词原文（只保存其哈希和长度）
+            token_count: 原文的token数
+            embedding_model: 生成向量所用的embedding模型名称
+            chunk_table: 块哈希 -> 去向（"rag" 或 "context"）
+            rag_texts: 存入RAG的摘要
+            rag_embeddings: 摘要的向量矩阵
+            doc_texts: 存入文档存储的原文块
+            doc_embeddings: 原文块的向量矩阵
+        """
+        self.name = name
+        self.digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        self.text_length = len(text)
+        self.token_count = token_count
+        self.embedding_model = embedding_model
+        self.chunk_table = dict(chunk_table)
+        self.rag_texts = list(rag_texts)
+        self.rag_embeddings = np.asarray(rag_embeddings, dtype=np.float32)
+        self.doc_texts = list(doc_texts)
+        self.doc_embeddings = np.asarray(doc_embeddings, dtype=np.float32)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """可JSON序列化的概要信息"""
+        return {
+            "name": self.name,
+            "digest": self.digest,
+            "characters": self.text_length,
+            "tokens": self.token_count,
+            "embedding_model": self.embedding_model,
+            "chunks": len(self.chunk_table),
+            "rag_items": len(self.rag_texts),
+            "document_chunks": len(self.doc_texts)
+        }
+
+class PromptRegistry:
+    """
+    已注册的固定提示词，按名称或原文哈希查找
+
+    服务启动时注册；请求中出现与已注册提示词完全相同的系统消息时，直接挂载预计算结果。
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._by_name: Dict[str, PromptArtifact] = {}
+        self._by_digest: Dict[str, PromptArtifact] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_name)
+
+    def register(self, artifact: PromptArtifact) -> None:
+        """
+        注册（同名的旧结果会被替换）
+
+        Args:
+            artifact: 预计算结果
+        """
+        previous = self._by_name.get(artifact.name)
+        if previous is not None:
+            self._by_digest.pop(previous.digest, None)
+        self._by_name[artifact.name] = artifact
+        self._by_digest[artifact.digest] = artifact
+        self.logger.info(f"Registered static prompt '{artifact.name}': {artifact.to_dict()}")
+
+    def get(self, name: str) -> Optional[PromptArtifact]:
+        """按名称查找，不存在时为None"""
+        return self._by_name.get(name)
+
+    def lookup(self, text: str) -> Optional[PromptArtifact]:
+        """按原文查找（原文必须完全一致），不存在时为None"""
+        return self._by_digest.get(hashlib.sha256(text.encode("utf-8")).hexdigest())
@@ -2,7 +2,11 @@ from typing import Dict, List, Tuple, Any, Optional
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
+import concurrent.futures
+import contextvars
+import copy
 import logging
+import threading
 import traceback
 import faiss
 from .models.base import BaseModel
@@ -17,6 +21,32 @@ except ImportError:
 
 from openkimi.utils.llm_interface import LLMInterface
 from openkimi.utils.prompt_loader import load_prompt
+from openkimi.utils.tracing import trace, traced
+
+class LazyEmbeddingModel:
+    """
+    首次编码时才加载的SentenceTransformer
+
+    挂载预计算的提示词（见 KimiEngine.attach_prompt）只需要已有的向量，用它创建存储可以把模型加载推迟到第一次检索。
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        """模型是否已加载"""
+        return self._model is not None
+
+    def encode(self, *args, **kwargs):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    logging.getLogger(__name__).info(f"正在加载embedding模型: {self.model_name}")
+                    self._model = SentenceTransformer(self.model_name)
+        return self._model.encode(*args, **kwargs)
 
 class RAGManager:
     """增强版RAG管理器，支持递归RAG和上下文长度检查"""
@@ -28,7 +58,9 @@ class RAGManager:
         use_faiss: bool = True,
         max_chunk_size: int = 512,
         overlap_size: int = 50,
-        similarity_threshold: float = 0.7
+        similarity_threshold: float = 0.7,
+        embedding_model: Any = None,
+        vector_dimension: Optional[int] = None
     ):
         """初始化RAG管理器
         
@@ -39,6 +71,8 @@ class RAGManager:
             max_chunk_size: 文本分块的最大大小
             overlap_size: 文本块之间的重叠大小
             similarity_threshold: 相似度阈值
+            embedding_model: 已加载的embedding模型，可选；提供时不再重新加载
+            vector_dimension: 向量维度，可选；与 embedding_model 一起提供时不再试编码（不触发 LazyEmbeddingModel 加载）
         """
         self.logger = logging.getLogger(__name__)
         
@@ -47,7 +81,6 @@ class RAGManager:
             raise ValueError("模型不能为None")
             
         self.model = model
-        self.embedding_model = SentenceTransformer(embedding_model_name)
         self.use_faiss = use_faiss
         self.max_chunk_size = max_chunk_size
         self.overlap_size = overlap_size
@@ -56,18 +89,27 @@ class RAGManager:
         # 初始化向量存储
         self.embeddings = []
         self.texts = []
-        if use_faiss:
-            self.index = faiss.IndexFlatL2(self.embedding_model.get_sentence_embedding_dimension())
+        self.index = None
+        # fork() 之后与另一个RAGManager共享文本、向量和索引，首次写入前复制
+        self._shared = False
+        # 文本、向量和索引必须一起更新：后台摄入写入时，检索线程只能看到写入前或写入后的完整状态
+        self._lock = threading.RLock()
         
         # 尝试加载embedding模型
         try:
-            self.logger.info(f"正在加载embedding模型: {embedding_model_name}")
-            self.embedding_model = SentenceTransformer(embedding_model_name)
-            self.logger.info("Embedding模型加载成功")
+            if embedding_model is not None:
+                self.embedding_model = embedding_model
+            else:
+                self.logger.info(f"正在加载embedding模型: {embedding_model_name}")
+                self.embedding_model = SentenceTransformer(embedding_model_name)
+                self.logger.info("Embedding模型加载成功")
             
             # 确定向量维度
-            test_vector = self.embedding_model.encode("测试文本")
-            self.vector_dimension = len(test_vector)
+            if embedding_model is not None and vector_dimension:
+                self.vector_dimension = vector_dimension
+            else:
+                test_vector = self.embedding_model.encode("测试文本")
+                self.vector_dimension = len(test_vector)
             self.logger.info(f"向量维度: {self.vector_dimension}")
             
             # 初始化FAISS索引
@@ -149,11 +191,13 @@ class RAGManager:
             embedding = self.embedding_model.encode([summary])[0]
             
             # 存储文本和embeddings
-            self.texts.append(chunk)
-            self.embeddings.append(embedding)
-            
-            if self.use_faiss:
-                self.index.add(np.array([embedding], dtype=np.float32))
+            with self._lock:
+                self._own_storage()
+                self.texts.append(chunk)
+                self.embeddings.append(embedding)
+                
+                if self.use_faiss:
+                    self.index.add(np.array([embedding], dtype=np.float32))
                 
     async def search(self, query: str, top_k: int = 3) -> List[str]:
         """搜索相关文本
@@ -168,6 +212,11 @@ class RAGManager:
         # 生成查询的embedding
         query_embedding = self.embedding_model.encode([query])[0]
         
+        with self._lock:
+            return self._search_locked(query_embedding, top_k)
+    
+    def _search_locked(self, query_embedding: np.ndarray, top_k: int) -> List[str]:
+        """search 的检索部分，调用方持有 _lock"""
         if self.use_faiss:
             # 使用FAISS进行搜索
             distances, indices = self.index.search(
@@ -241,6 +290,7 @@ class RAGManager:
             
         return compressed_text
     
+    @traced("RAGManager.summarize_text", category="rag")
     def summarize_text(self, text: str) -> str:
         """
         对文本进行摘要
@@ -256,6 +306,7 @@ class RAGManager:
         summary = self.model.generate(prompt)
         return summary.strip()
     
+    @traced("RAGManager.store_text", category="rag")
     def store_text(self, text: str) -> str:
         """
         将文本存储到RAG中
@@ -267,81 +318,184 @@ class RAGManager:
             文本摘要（作为RAG的key）
         """
         summary = self.summarize_text(text)
-        if summary in self.texts: # Avoid duplicates, maybe update?
-            return summary 
-            
-        self.texts.append(summary)
+        with self._lock:
+            if summary in self.texts: # Avoid duplicates, maybe update?
+                return summary 
         
-        # 生成摘要的向量表示
+        # 生成摘要的向量表示（在锁外编码，不阻塞检索）
         summary_embedding = self.embedding_model.encode(summary)
-        self.embeddings.append(summary_embedding)
-        
-        # 将向量添加到FAISS索引
-        if self.use_faiss and self.index is not None:
-            try:
-                # 添加到摘要列表
-                self.texts.append(summary)
-                
-                # 准备向量数据，需要reshape为2D数组
-                vector_np = np.array([summary_embedding], dtype=np.float32)
-                
-                # 添加到FAISS索引
-                self.index.add(vector_np)
-            except Exception as e:
-                self.logger.error(f"将向量添加到FAISS索引时出错: {e}")
-                
+        self._publish([summary], [summary_embedding])
         return summary
     
-    def batch_store(self, texts: List[str]) -> List[str]:
+    @traced("RAGManager.batch_store", category="rag")
+    def batch_store(self, texts: List[str], concurrency: int = 1) -> List[str]:
         """
         批量存储多个文本到RAG
         
         Args:
             texts: 需要存储的文本列表
+            concurrency: 同时进行的摘要（LLM调用）数，默认逐个摘要
             
         Returns:
             摘要列表
         """
         if not texts:
             return []
-            
-        summaries = []
-        new_vectors = []
+        
+        if concurrency > 1 and len(texts) > 1:
+            # 每个任务复制一份上下文，摘要调用仍计入当前的trace和用量计量
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(concurrency, len(texts))) as pool:
+                futures = [pool.submit(contextvars.copy_context().run, self.summarize_text, text) for text in texts]
+                generated = [future.result() for future in futures]
+        else:
+            generated = [self.summarize_text(text) for text in texts]
+        
+        # 跳过已存储和批内重复的摘要，只为新摘要生成向量
+        with self._lock:
+            existing = set(self.texts)
         new_summaries = []
+        for summary in generated:
+            if summary not in existing:
+                existing.add(summary)
+                new_summaries.append(summary)
+        new_vectors = [self.embedding_model.encode(summary) for summary in new_summaries]
+        
+        # 整批一次性写入文本、向量和索引
+        added = self._publish(new_summaries, new_vectors)
+        if added and self.use_faiss and self.index is not None:
+            self.logger.info(f"已将{added}个向量批量添加到FAISS索引")
+        
+        return generated
+
+    def _publish(self, texts: List[str], embeddings: List[np.ndarray]) -> int:
+        """
+        在一次加锁中追加文本、向量和FAISS索引，跳过加锁前已被其他线程写入的文本
+
+        Args:
+            texts: 摘要文本列表
+            embeddings: 与文本一一对应的向量
+
+        Returns:
+            实际新增的条数
+        """
+        with self._lock:
+            existing = set(self.texts)
+            keep = [i for i, text in enumerate(texts) if text not in existing]
+            if not keep:
+                return 0
+            self._own_storage()
+            for i in keep:
+                self.texts.append(texts[i])
+                self.embeddings.append(embeddings[i])
+            if self.use_faiss and self.index is not None:
+                try:
+                    self.index.add(np.array([embeddings[i] for i in keep], dtype=np.float32))
+                except Exception as e:
+                    self.logger.error(f"添加向量到FAISS索引时出错: {e}")
+            return len(keep)
+
+    def add_embedded(self, texts: List[str], embeddings: np.ndarray) -> int:
+        """
+        添加已经摘要和编码好的文本（例如预计算的提示词），不调用LLM或embedding模型
+
+        Args:
+            texts: 摘要文本列表
+            embeddings: 与文本一一对应的向量矩阵
+
+        Returns:
+            实际新增的条数（已存在的文本会被跳过）
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(texts) != len(embeddings):
+            raise ValueError(f"文本数量({len(texts)})与向量数量({len(embeddings)})不一致")
+        if len(embeddings) and embeddings.shape[1] != self.vector_dimension:
+            raise ValueError(f"向量维度不匹配: 输入为{embeddings.shape[1]}, 当前模型为{self.vector_dimension}")
+        with self._lock:
+            existing = set(self.texts)
+            keep = [i for i, text in enumerate(texts) if text not in existing]
+            if not keep:
+                return 0
+            self._own_storage()
+            for i in keep:
+                self.texts.append(texts[i])
+                self.embeddings.append(embeddings[i])
+            if self.use_faiss and self.index is not None:
+                self.index.add(embeddings[keep])
+            return len(keep)
+
+    def fork(self) -> "RAGManager":
+        """
+        O(1) 复制：共享模型、文本、向量和FAISS索引，任一方写入时才复制存储（见 _own_storage）
         
-        # 先生成所有摘要和向量
-        for text in texts:
-            summary = self.summarize_text(text)
-            
-            # 跳过重复项
-            if summary in self.texts:
-                summaries.append(summary)
-                continue
-                
-            self.texts.append(summary)
-            summary_embedding = self.embedding_model.encode(summary)
-            self.embeddings.append(summary_embedding)
-            
-            summaries.append(summary)
-            new_vectors.append(summary_embedding)
-            new_summaries.append(summary)
+        Returns:
+            新的RAGManager
+        """
+        with self._lock:
+            forked = copy.copy(self)
+            forked._shared = self._shared = True
+        # 共享的列表和索引不会被原地修改（写入前先复制），副本使用自己的锁
+        forked._lock = threading.RLock()
+        return forked
+    
+    def _own_storage(self) -> None:
+        """写时复制：若存储仍与 fork() 出的副本共享，先复制文本和向量并重建索引（调用方持有 _lock）"""
+        if not self._shared:
+            return
+        self.texts = list(self.texts)
+        self.embeddings = list(self.embeddings)
+        if self.use_faiss and self.index is not None:
+            self._initialize_faiss_index()
+            if self.embeddings:
+                self.index.add(np.asarray(self.embeddings, dtype=np.float32).reshape(len(self.embeddings), -1))
+        self._shared = False
+    
+    def clear(self) -> None:
+        """清空存储的文本、向量和索引，保留已加载的模型（不影响 fork() 出的副本）"""
+        with self._lock:
+            self.texts = []
+            self.embeddings = []
+            if self.use_faiss and self.index is not None:
+                self._initialize_faiss_index()
+            self._shared = False
+    
+    def export_state(self) -> Tuple[List[str], np.ndarray]:
+        """
+        导出存储的文本及其向量，用于会话快照
         
-        # 如果使用FAISS，批量添加向量
-        if self.use_faiss and self.index is not None and new_vectors:
-            try:
-                # 更新摘要列表
-                self.texts.extend(new_summaries)
-                
-                # 准备批量向量数据
-                vectors_np = np.array(new_vectors, dtype=np.float32)
-                
-                # 批量添加到FAISS索引
-                self.index.add(vectors_np)
-                self.logger.info(f"已将{len(new_vectors)}个向量批量添加到FAISS索引")
-            except Exception as e:
-                self.logger.error(f"批量添加向量到FAISS索引时出错: {e}")
+        Returns:
+            (文本列表, 形状为 (n, dim) 的float32向量矩阵)
+        """
+        with self._lock:
+            texts, stored = list(self.texts), list(self.embeddings)
+        if stored:
+            embeddings = np.asarray(stored, dtype=np.float32).reshape(len(stored), -1)
+        else:
+            embeddings = np.zeros((0, self.vector_dimension), dtype=np.float32)
+        return texts, embeddings
+    
+    def load_state(self, texts: List[str], embeddings: np.ndarray) -> None:
+        """
+        从快照恢复存储内容，替换当前的文本、向量和索引（不重新计算摘要或向量）
         
-        return summaries
+        Args:
+            texts: 文本列表
+            embeddings: 与文本一一对应的向量矩阵
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(texts) != len(embeddings):
+            raise ValueError(f"文本数量({len(texts)})与向量数量({len(embeddings)})不一致")
+        if len(embeddings) and embeddings.shape[1] != self.vector_dimension:
+            raise ValueError(f"向量维度不匹配: 快照为{embeddings.shape[1]}, 当前模型为{self.vector_dimension}")
+            
+        with self._lock:
+            self.texts = list(texts)
+            self.embeddings = list(embeddings)
+            self._shared = False
+            if self.use_faiss:
+                self._initialize_faiss_index()
+                if self.use_faiss and len(embeddings):
+                    self.index.add(embeddings)
+        self.logger.info(f"已从快照恢复{len(self.texts)}条RAG记录")
     
     def retrieve(self, query: str, top_k: int = 3) -> List[str]:
         """
@@ -354,6 +508,21 @@ class RAGManager:
         Returns:
             检索到的文本列表
         """
+        return [text for text, _ in self.retrieve_with_scores(query, top_k=top_k)]
+    
+    @traced("RAGManager.retrieve_with_scores", category="rag")
+    def retrieve_with_scores(self, query: str, top_k: int = 3, query_embedding: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """
+        根据查询检索相关文本，并返回与查询的余弦相似度
+        
+        Args:
+            query: 查询文本
+            top_k: 返回的最大结果数量
+            query_embedding: 已计算好的查询向量，可选，避免重复编码
+            
+        Returns:
+            按相似度从高到低排列的 (文本, 相似度) 列表
+        """
         if not self.texts:
             return []
         
@@ -362,8 +531,19 @@ class RAGManager:
             return []
             
         # 生成查询向量
-        query_embedding = self.embedding_model.encode(query)
-        
+        if query_embedding is None:
+            with trace("RAGManager.encode_query", category="rag"):
+                query_embedding = self.embedding_model.encode(query)
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        
+        # 检索期间持锁，避免看到后台摄入写到一半的文本、向量和索引
+        with self._lock:
+            return self._retrieve_locked(query_embedding, top_k)
+    
+    def _retrieve_locked(self, query_embedding: np.ndarray, top_k: int) -> List[Tuple[str, float]]:
+        """retrieve_with_scores 的检索部分，调用方持有 _lock"""
+        if not self.texts or not self.embeddings:
+            return []
         # 使用FAISS进行检索
         if self.use_faiss and self.index is not None and len(self.texts) > 0:
             try:
@@ -373,17 +553,11 @@ class RAGManager:
                 # 执行搜索，返回距离和索引
                 distances, indices = self.index.search(query_vector, min(top_k, len(self.texts)))
                 
-                # 获取结果摘要，然后获取对应的原文本
+                # FAISS按L2距离排序，相似度使用余弦值以便与sklearn回退路径保持一致
                 results = []
-                for i, idx in enumerate(indices[0]):
-                    if idx < len(self.texts):
-                        summary = self.texts[idx]
-                        # 检查距离是否在合理范围内（可选）
-                        # 对于L2距离，较小的值表示更相似
-                        # if distances[0][i] > max_distance:
-                        #    continue
-                        if summary in self.texts:
-                            results.append(summary)
+                for idx in indices[0]:
+                    if 0 <= idx < len(self.texts):
+                        results.append((self.texts[idx], self._cosine(query_embedding, self.embeddings[idx])))
                 
                 self.logger.debug(f"FAISS检索成功，找到{len(results)}个结果")
                 return results
@@ -397,7 +571,6 @@ class RAGManager:
         query_embedding = query_embedding.reshape(1, -1)
         
         # 准备摘要向量
-        summaries = self.texts
         summary_embeddings = np.array(self.embeddings)
 
         if summary_embeddings.ndim == 1: # 处理只有一个存储项的情况
@@ -410,7 +583,73 @@ class RAGManager:
         top_k_indices = np.argsort(similarities)[::-1][:top_k]
         
         # 返回对应的原始文本，排除相似度小于或等于0的结果
-        results = [self.texts[i] for i in top_k_indices if similarities[i] > 0]
+        results = [(self.texts[i], float(similarities[i])) for i in top_k_indices if similarities[i] > 0]
         
         self.logger.debug(f"sklearn检索成功，找到{len(results)}个结果")
-        return results 
\ No newline at end of file
+        return results
+    
+    @traced("RAGManager.retrieve_batch_with_scores", category="rag")
+    def retrieve_batch_with_scores(
+        self,
+        queries: List[str],
+        top_k: int = 3,
+        query_embeddings: Optional[np.ndarray] = None
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        批量检索：一次编码全部查询，并用一次矩阵运算（或一次FAISS搜索）完成检索
+        
+        Args:
+            queries: 查询文本列表
+            top_k: 每个查询返回的最大结果数量
+            query_embeddings: 已计算好的查询向量矩阵，可选
+            
+        Returns:
+            与 queries 一一对应的检索结果，格式同 retrieve_with_scores
+        """
+        if not queries:
+            return []
+        if not self.texts or not self.embeddings:
+            return [[] for _ in queries]
+            
+        if query_embeddings is None:
+            with trace("RAGManager.encode_queries", category="rag", count=len(queries)):
+                query_embeddings = self.embedding_model.encode(list(queries))
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32).reshape(len(queries), -1)
+        
+        with self._lock:
+            return self._retrieve_batch_locked(query_embeddings, top_k)
+    
+    def _retrieve_batch_locked(self, query_embeddings: np.ndarray, top_k: int) -> List[List[Tuple[str, float]]]:
+        """retrieve_batch_with_scores 的检索部分，调用方持有 _lock"""
+        if not self.texts or not self.embeddings:
+            return [[] for _ in query_embeddings]
+        stored = np.asarray(self.embeddings, dtype=np.float32).reshape(len(self.embeddings), -1)
+        stored_norms = np.linalg.norm(stored, axis=1)
+        query_norms = np.linalg.norm(query_embeddings, axis=1)
+        denom = np.outer(query_norms, stored_norms)
+        similarities = np.divide(query_embeddings @ stored.T, denom, out=np.zeros_like(denom), where=denom > 0)
+        k = min(top_k, len(self.texts))
+        
+        if self.use_faiss and self.index is not None:
+            try:
+                _, indices = self.index.search(query_embeddings, k)
+                return [
+                    [(self.texts[idx], float(similarities[row, idx])) for idx in indices[row] if 0 <= idx < len(self.texts)]
+                    for row in range(len(query_embeddings))
+                ]
+            except Exception as e:
+                self.logger.error(f"使用FAISS批量检索时出错: {e}")
+                self.logger.info("回退到numpy进行向量检索")
+                
+        # 与单条检索的sklearn路径一致：按余弦相似度排序，排除相似度小于或等于0的结果
+        top_indices = np.argsort(-similarities, axis=1)[:, :k]
+        return [
+            [(self.texts[idx], float(similarities[row, idx])) for idx in top_indices[row] if similarities[row, idx] > 0]
+            for row in range(len(query_embeddings))
+        ]
+    
+    @staticmethod
+    def _cosine(a: np.ndarray, b: np.ndarray) -> float:
+        """计算两个向量的余弦相似度"""
+        denom = float(np.linalg.norm(a) * np.linalg.norm(b))
+        return float(np.dot(a, b) / denom) if denom else 0.0
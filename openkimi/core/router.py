@@ -0,0 +1,118 @@
+import logging
+import math
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence
+
+FAST_PATH = "fast"
+FULL_PATH = "full"
+
+class QueryRouter:
+    """
+    查询路由器：用廉价特征判断一轮对话是否需要框架生成+MPR
+
+    简单查询（短、信息熵低、检索命中足够强或根本没有可检索内容）走快速路径，
+    只调用一次LLM直接回答；其余查询保持完整的框架+MPR路径。
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_query_tokens: int = 32,
+        max_entropy: float = 4.5,
+        min_hit_score: float = 0.5
+    ):
+        """
+        初始化查询路由器
+
+        Args:
+            enabled: 是否启用快速路径，禁用时所有查询都走完整路径
+            max_query_tokens: 快速路径允许的最大查询token数
+            max_entropy: 快速路径允许的最大token熵（比特）
+            min_hit_score: 存在检索结果时，最佳命中所需的最低余弦相似度
+        """
+        self.logger = logging.getLogger(__name__)
+        self.enabled = enabled
+        self.max_query_tokens = max_query_tokens
+        self.max_entropy = max_entropy
+        self.min_hit_score = min_hit_score
+        self.stats: Dict[str, Dict[str, float]] = {
+            FAST_PATH: {"count": 0, "total_latency": 0.0},
+            FULL_PATH: {"count": 0, "total_latency": 0.0}
+        }
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> "QueryRouter":
+        """根据 config['router'] 创建路由器"""
+        config = config or {}
+        return cls(
+            enabled=config.get("enabled", True),
+            max_query_tokens=config.get("max_query_tokens", 32),
+            max_entropy=config.get("max_entropy", 4.5),
+            min_hit_score=config.get("min_hit_score", 0.5)
+        )
+
+    @staticmethod
+    def token_entropy(tokens: Sequence[Any]) -> float:
+        """计算token序列的香农熵（比特），与语言无关，中文查询同样适用"""
+        total = len(tokens)
+        if total == 0:
+            return 0.0
+        entropy = 0.0
+        for freq in Counter(tokens).values():
+            p = freq / total
+            entropy -= p * math.log2(p)
+        return entropy
+
+    def classify(self, tokens: Sequence[Any], hit_scores: List[float]) -> str:
+        """
+        判断查询应走的路径
+
+        Args:
+            tokens: 查询的token序列
+            hit_scores: 检索命中的相似度列表（无检索内容时为空）
+
+        Returns:
+            FAST_PATH 或 FULL_PATH
+        """
+        if self.precheck(tokens) == FULL_PATH:
+            return FULL_PATH
+        entropy = self.token_entropy(tokens)
+        if hit_scores and max(hit_scores) < self.min_hit_score:
+            # 有相关文档但命中较弱，需要框架引导推理
+            return FULL_PATH
+        self.logger.debug(f"快速路径: tokens={len(tokens)}, entropy={entropy:.2f}, best_hit={max(hit_scores) if hit_scores else None}")
+        return FAST_PATH
+
+    def precheck(self, tokens: Sequence[Any]) -> Optional[str]:
+        """
+        只看查询本身（长度、熵）的路由判断，不需要等待检索
+
+        Args:
+            tokens: 查询的token序列
+
+        Returns:
+            查询本身已排除快速路径时为 FULL_PATH，否则为None（需结合检索命中由 classify 决定）
+        """
+        if not self.enabled:
+            return FULL_PATH
+        if len(tokens) > self.max_query_tokens:
+            return FULL_PATH
+        if self.token_entropy(tokens) > self.max_entropy:
+            return FULL_PATH
+        return None
+
+    def record(self, path: str, latency: float) -> None:
+        """记录一次路由结果及该轮耗时（秒）"""
+        self.stats[path]["count"] += 1
+        self.stats[path]["total_latency"] += latency
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """获取各路径的调用次数、总耗时和平均耗时"""
+        return {
+            path: {
+                "count": stat["count"],
+                "total_latency": stat["total_latency"],
+                "avg_latency": stat["total_latency"] / stat["count"] if stat["count"] else 0.0
+            }
+            for path, stat in self.stats.items()
+        }
@@ -0,0 +1,48 @@
+import io
+import json
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+SNAPSHOT_VERSION = 1
+
+_META_KEY = "__meta__"
+
+def pack_bundle(meta: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> bytes:
+    """
+    将元数据和numpy数组打包为紧凑的二进制快照
+
+    元数据以JSON编码后作为uint8数组保存，与其它数组一起写入未压缩的npz容器，
+    读取时无需pickle，向量数据可直接按原始字节加载。
+
+    Args:
+        meta: 可JSON序列化的元数据
+        arrays: 数组字典，键名不能为 "__meta__"
+
+    Returns:
+        快照字节串
+    """
+    if _META_KEY in arrays:
+        raise ValueError(f"数组名称 {_META_KEY} 为保留字段")
+    payload = dict(arrays)
+    payload[_META_KEY] = np.frombuffer(json.dumps(meta, ensure_ascii=False).encode("utf-8"), dtype=np.uint8)
+    buffer = io.BytesIO()
+    np.savez(buffer, **payload)
+    return buffer.getvalue()
+
+def unpack_bundle(data: bytes) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """
+    解析 pack_bundle 生成的快照
+
+    Args:
+        data: 快照字节串
+
+    Returns:
+        (元数据, 数组字典)
+    """
+    with np.load(io.BytesIO(data), allow_pickle=False) as bundle:
+        arrays = {name: bundle[name] for name in bundle.files}
+    meta_bytes = arrays.pop(_META_KEY, None)
+    if meta_bytes is None:
+        raise ValueError("无效的快照：缺少元数据")
+    return json.loads(meta_bytes.tobytes().decode("utf-8")), arrays
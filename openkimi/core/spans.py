@@ -0,0 +1,97 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+class Span:
+    """一段计时区间，时间戳为 time.perf_counter() 的单调值"""
+
+    __slots__ = ("name", "start", "end", "attrs")
+
+    def __init__(self, name: str, start: float, end: Optional[float] = None, attrs: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.attrs = attrs or {}
+
+    @property
+    def duration(self) -> float:
+        """区间时长（秒），未结束时为0"""
+        return (self.end - self.start) if self.end is not None else 0.0
+
+class SpanRecorder:
+    """
+    一轮对话的轻量计时记录器
+
+    只在区间开始和结束时各读取一次单调时钟，不做任何格式化，
+    开销足够低，可以在生产环境常开。token数、缓存命中等信息作为区间属性记录。
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans: List[Span] = []
+        self.attrs: Dict[str, Any] = {}
+
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[Span]:
+        """
+        记录一个区间，可在 with 块内通过返回的 Span 补充属性
+
+        Args:
+            name: 区间名称
+            **attrs: 区间属性，如 tokens_in、tokens_out、cache_hit
+        """
+        current = Span(name, time.perf_counter(), attrs=attrs)
+        try:
+            yield current
+        finally:
+            current.end = time.perf_counter()
+            self.spans.append(current)
+
+    def add(self, name: str, start: float, end: float, **attrs: Any) -> Span:
+        """
+        添加一个已经计时完成的区间（例如流水线阶段）
+
+        Args:
+            name: 区间名称
+            start: 开始时间（perf_counter 值）
+            end: 结束时间（perf_counter 值）
+            **attrs: 区间属性
+
+        Returns:
+            新增的 Span
+        """
+        recorded = Span(name, start, end, attrs)
+        self.spans.append(recorded)
+        return recorded
+
+    def find(self, name: str) -> Optional[Span]:
+        """按名称查找最近记录的区间"""
+        for recorded in reversed(self.spans):
+            if recorded.name == name:
+                return recorded
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        导出为可JSON序列化的字典
+
+        Returns:
+            {"total": 总耗时, **轮次属性, "spans": [{"name", "start", "end", "duration", **属性}]}，
+            start/end 为相对于记录器创建时刻的秒数
+        """
+        spans = sorted(self.spans, key=lambda s: s.start)
+        end = max((s.end for s in spans if s.end is not None), default=self.origin)
+        return {
+            "total": end - self.origin,
+            **self.attrs,
+            "spans": [
+                {
+                    "name": s.name,
+                    "start": s.start - self.origin,
+                    "end": (s.end if s.end is not None else s.start) - self.origin,
+                    "duration": s.duration,
+                    **s.attrs
+                }
+                for s in spans
+            ]
+        }
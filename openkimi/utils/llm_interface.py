@@ -1,9 +1,14 @@
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterator
 import os
+import json
+import threading
 import requests
 from abc import ABC, abstractmethod
 from dotenv import load_dotenv
 
+from openkimi.utils.tracing import traced
+from openkimi.utils.usage import metered, report_usage
+
 # Load environment variables from .env file, if it exists
 load_dotenv()
 
@@ -26,6 +31,26 @@ class LLMInterface(ABC):
         """
         pass
         
+    def stream_generate(self, prompt: str, max_new_tokens: int = 512, temperature: float = 0.7, **kwargs) -> Iterator[str]:
+        """
+        流式生成文本。默认实现一次性返回完整结果，支持流式输出的后端应覆盖此方法。
+        
+        Args:
+            prompt: 输入提示
+            max_new_tokens: 最大生成 token 数
+            temperature: 控制生成随机性
+            **kwargs: 其他特定于实现的参数
+            
+        Yields:
+            生成的文本片段
+        """
+        yield self.generate(prompt, max_new_tokens=max_new_tokens, temperature=temperature, **kwargs)
+        
+    @property
+    def supports_streaming(self) -> bool:
+        """后端是否能在生成过程中逐步返回 token。"""
+        return False
+        
     @abstractmethod
     def get_tokenizer(self):
         """获取与此 LLM 关联的 tokenizer。"""
@@ -66,6 +91,8 @@ class DummyLLM(LLMInterface):
         self.max_context = 2048 # Assume a common context length
         print("DummyLLM初始化完成")
         
+    @traced("DummyLLM.generate", category="llm")
+    @metered
     def generate(self, prompt: str, max_new_tokens: int = 50, temperature: float = 0.7, **kwargs) -> str:
         """
         简单的文本生成，仅用于测试
@@ -156,6 +183,8 @@ class LocalLLM(LLMInterface):
             print(f"Error loading local model {model_path}: {e}")
             raise
         
+    @traced("LocalLLM.generate", category="llm")
+    @metered
     def generate(self, prompt: str, max_new_tokens: int = 512, temperature: float = 0.7, **kwargs) -> str:
         """
         使用本地模型生成文本
@@ -200,6 +229,40 @@ class LocalLLM(LLMInterface):
             traceback.print_exc()
             return "[Error generating response]"
             
+    @traced("LocalLLM.stream_generate", category="llm")
+    @metered
+    def stream_generate(self, prompt: str, max_new_tokens: int = 512, temperature: float = 0.7, **kwargs) -> Iterator[str]:
+        """
+        使用 TextIteratorStreamer 在后台线程生成，并在 token 解码后立即返回
+        """
+        from transformers import TextIteratorStreamer
+        
+        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        generation_kwargs = {
+            **inputs,
+            "max_new_tokens": max_new_tokens,
+            "temperature": temperature if temperature > 0 else None,
+            "do_sample": temperature > 0,
+            "pad_token_id": self.tokenizer.eos_token_id,
+            "streamer": streamer,
+            **kwargs
+        }
+        generation_kwargs = {k: v for k, v in generation_kwargs.items() if v is not None}
+        
+        thread = threading.Thread(target=self.model.generate, kwargs=generation_kwargs, daemon=True)
+        thread.start()
+        try:
+            for text in streamer:
+                if text:
+                    yield text
+        finally:
+            thread.join()
+            
+    @property
+    def supports_streaming(self) -> bool:
+        return True
+            
     def get_tokenizer(self):
         return self.tokenizer
         
@@ -244,6 +307,8 @@ class APIBasedLLM(LLMInterface):
              print(f"Warning: Failed to load tokenizer {tokenizer_name}. Using gpt2 fallback. Error: {e}")
              self.tokenizer = AutoTokenizer.from_pretrained("gpt2")
 
+    @traced("APIBasedLLM.generate", category="llm")
+    @metered
     def generate(self, prompt: str, max_new_tokens: int = 512, temperature: float = 0.7, **kwargs) -> str:
         """
         通过API生成文本 (using Chat Completion endpoint)
@@ -269,6 +334,10 @@ class APIBasedLLM(LLMInterface):
             response.raise_for_status()  # Raise an exception for bad status codes
             
             result = response.json()
+            usage = result.get("usage") or {}
+            if "prompt_tokens" in usage and "completion_tokens" in usage:
+                # 以API计费口径的真实用量为准
+                report_usage(usage["prompt_tokens"], usage["completion_tokens"])
             if result.get("choices") and len(result["choices"]) > 0:
                 # Get content from the first choice's message
                 message_content = result["choices"][0].get("message", {}).get("content")
@@ -294,6 +363,55 @@ class APIBasedLLM(LLMInterface):
             print(f"An unexpected error occurred during API call: {e}")
             return "[Unexpected API error]"
             
+    @traced("APIBasedLLM.stream_generate", category="llm")
+    @metered
+    def stream_generate(self, prompt: str, max_new_tokens: int = 512, temperature: float = 0.7, **kwargs) -> Iterator[str]:
+        """
+        通过API流式生成文本 (Chat Completion endpoint, server-sent events)
+        """
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        payload = {
+            "model": self.model_name,
+            "messages": [
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": max_new_tokens,
+            "temperature": temperature,
+            **kwargs,
+            "stream": True
+        }
+        
+        try:
+            with requests.post(self.api_url, headers=headers, json=payload, stream=True) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        chunk = json.loads(data)
+                    except ValueError:
+                        print(f"Warning: Could not decode stream chunk: {data}")
+                        continue
+                    choices = chunk.get("choices") or []
+                    if choices:
+                        content = (choices[0].get("delta") or {}).get("content")
+                        if content:
+                            yield content
+        except requests.exceptions.RequestException as e:
+            print(f"Error streaming from LLM API at {self.api_url}: {e}")
+            yield "[API request error]"
+            
+    @property
+    def supports_streaming(self) -> bool:
+        return True
+            
     def get_tokenizer(self):
         return self.tokenizer
         
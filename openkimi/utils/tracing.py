@@ -0,0 +1,215 @@
+"""
+请求级追踪：记录一轮对话中跨模块的嵌套事件，并导出为 Chrome trace JSON
+
+可直接在 Perfetto (https://ui.perfetto.dev) 或 chrome://tracing 中打开。
+未激活 Tracer 时，trace()/traced 只做一次 ContextVar 读取，几乎没有开销。
+"""
+
+import asyncio
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+_current_tracer: ContextVar[Optional["Tracer"]] = ContextVar("openkimi_tracer", default=None)
+
+class Tracer:
+    """
+    一次请求的事件收集器
+
+    事件按所在的执行轨道分组：协程按 asyncio 任务、线程池工作按线程，
+    同一轨道上的事件按时间嵌套显示。
+    """
+
+    def __init__(self, name: str = "turn", metadata: Optional[Dict[str, Any]] = None):
+        """
+        初始化追踪器
+
+        Args:
+            name: 追踪名称（如会话ID），写入 trace 元数据
+            metadata: 额外的元数据，可选
+        """
+        self.name = name
+        self.metadata = metadata or {}
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.events: List[Dict[str, Any]] = []
+        self._tracks: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def _track(self) -> int:
+        """当前执行轨道的ID：在 asyncio 任务中按任务区分，否则按线程区分"""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            track_id, track_name = id(task), task.get_name()
+        else:
+            thread = threading.current_thread()
+            track_id, track_name = thread.ident or 0, thread.name
+        if track_id not in self._tracks:
+            with self._lock:
+                self._tracks.setdefault(track_id, track_name)
+        return track_id
+
+    def add_event(self, name: str, category: str, start: float, end: float, args: Optional[Dict[str, Any]] = None,
+                  track: Optional[int] = None) -> None:
+        """
+        添加一个完整事件
+
+        Args:
+            name: 事件名称
+            category: 事件类别，如 "engine"、"rag"、"llm"
+            start: 开始时间（perf_counter 值）
+            end: 结束时间（perf_counter 值）
+            args: 事件参数，可选
+            track: 执行轨道ID，默认取当前轨道
+        """
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - self.origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": self.pid,
+            "tid": track if track is not None else self._track(),
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name: str, category: str = "engine", **args: Any) -> Iterator[Dict[str, Any]]:
+        """
+        记录一个嵌套事件，可在 with 块内向返回的字典补充参数
+
+        Args:
+            name: 事件名称
+            category: 事件类别
+            **args: 事件参数
+        """
+        track = self._track()
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.add_event(name, category, start, time.perf_counter(), args, track=track)
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """
+        导出为 Chrome trace 格式
+
+        Returns:
+            {"traceEvents": [...], "displayTimeUnit": "ms", "otherData": {...}}
+        """
+        with self._lock:
+            events = sorted(self.events, key=lambda e: (e["ts"], -e["dur"]))
+            tracks = dict(self._tracks)
+        thread_names = [
+            {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": track_id, "args": {"name": track_name}}
+            for track_id, track_name in tracks.items()
+        ]
+        return {
+            "traceEvents": thread_names + events,
+            "displayTimeUnit": "ms",
+            "otherData": {"name": self.name, **self.metadata}
+        }
+
+    def write(self, directory: str, filename: Optional[str] = None) -> str:
+        """
+        将 trace 写入目录
+
+        Args:
+            directory: 输出目录，不存在时自动创建
+            filename: 文件名，默认为 "<name>-<时间戳>.json"
+
+        Returns:
+            写入的文件路径
+        """
+        os.makedirs(directory, exist_ok=True)
+        filename = filename or f"{self.name}-{int(time.time() * 1000)}.json"
+        path = os.path.join(directory, filename)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f, ensure_ascii=False)
+        return path
+
+def current_tracer() -> Optional[Tracer]:
+    """当前上下文中激活的 Tracer，未激活时为None"""
+    return _current_tracer.get()
+
+@contextmanager
+def activate(tracer: Optional[Tracer]) -> Iterator[Optional[Tracer]]:
+    """
+    在当前上下文中激活 tracer（None 表示不追踪）
+
+    asyncio 任务和 asyncio.to_thread 会复制上下文，因此其中的调用也会被追踪。
+    """
+    token = _current_tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current_tracer.reset(token)
+
+@contextmanager
+def trace(name: str, category: str = "engine", **args: Any) -> Iterator[Dict[str, Any]]:
+    """
+    在激活的 Tracer 中记录一个事件；未激活时为空操作
+
+    Args:
+        name: 事件名称
+        category: 事件类别
+        **args: 事件参数
+    """
+    tracer = _current_tracer.get()
+    if tracer is None:
+        yield args
+        return
+    with tracer.span(name, category, **args) as event_args:
+        yield event_args
+
+def traced(name: Optional[str] = None, category: str = "engine") -> Callable:
+    """
+    函数装饰器：调用时记录一个事件，支持普通函数、协程函数和生成器函数
+
+    Args:
+        name: 事件名称，默认为函数的 __qualname__
+        category: 事件类别
+    """
+    def decorator(func: Callable) -> Callable:
+        event_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _current_tracer.get() is None:
+                    return await func(*args, **kwargs)
+                with trace(event_name, category):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def gen_wrapper(*args, **kwargs):
+                if _current_tracer.get() is None:
+                    yield from func(*args, **kwargs)
+                    return
+                with trace(event_name, category):
+                    yield from func(*args, **kwargs)
+            return gen_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_tracer.get() is None:
+                return func(*args, **kwargs)
+            with trace(event_name, category):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,206 @@
+"""
+LLM token用量计量：统计每次 LLM 调用实际的提示/生成token数，并按流水线阶段归类
+
+后端的 generate/stream_generate 用 @metered 装饰；用量记入当前上下文中激活的 UsageMeter，
+标签取自 usage_stage() 设置的阶段名。未激活 UsageMeter 时只做一次 ContextVar 读取。
+"""
+
+import functools
+import inspect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, Callable, Dict, Iterator, List, Optional
+
+_current_meter: ContextVar[Optional["UsageMeter"]] = ContextVar("openkimi_usage_meter", default=None)
+_current_stage: ContextVar[str] = ContextVar("openkimi_usage_stage", default="other")
+# 单次调用内由后端上报的真实用量（例如API响应中的 usage 字段）
+_reported_usage: ContextVar[Optional[List[int]]] = ContextVar("openkimi_reported_usage", default=None)
+
+class UsageMeter:
+    """
+    token用量累加器，按阶段分别统计
+
+    可指定父计量器（例如轮次计量器的父级为会话计量器），记录时同时累加到父级。
+    """
+
+    def __init__(self, parent: Optional["UsageMeter"] = None):
+        """
+        初始化计量器
+
+        Args:
+            parent: 父计量器，可选
+        """
+        self.parent = parent
+        self.by_stage: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, prompt_tokens: int, completion_tokens: int) -> None:
+        """
+        记录一次LLM调用
+
+        Args:
+            stage: 阶段名，如 "framework"、"solution"、"ingest"
+            prompt_tokens: 提示token数
+            completion_tokens: 生成token数
+        """
+        with self._lock:
+            entry = self.by_stage.setdefault(stage, {"prompt_tokens": 0, "completion_tokens": 0, "calls": 0})
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["calls"] += 1
+        if self.parent is not None:
+            self.parent.record(stage, prompt_tokens, completion_tokens)
+
+    def _total(self, key: str) -> int:
+        with self._lock:
+            return sum(entry[key] for entry in self.by_stage.values())
+
+    @property
+    def prompt_tokens(self) -> int:
+        return self._total("prompt_tokens")
+
+    @property
+    def completion_tokens(self) -> int:
+        return self._total("completion_tokens")
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def calls(self) -> int:
+        return self._total("calls")
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        导出为可JSON序列化的字典
+
+        Returns:
+            {"prompt_tokens", "completion_tokens", "total_tokens", "calls", "by_stage": {阶段: {...}}}
+        """
+        with self._lock:
+            by_stage = {stage: dict(entry) for stage, entry in self.by_stage.items()}
+        prompt_tokens = sum(entry["prompt_tokens"] for entry in by_stage.values())
+        completion_tokens = sum(entry["completion_tokens"] for entry in by_stage.values())
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "calls": sum(entry["calls"] for entry in by_stage.values()),
+            "by_stage": by_stage
+        }
+
+def current_meter() -> Optional[UsageMeter]:
+    """当前上下文中激活的 UsageMeter，未激活时为None"""
+    return _current_meter.get()
+
+@contextmanager
+def metering(meter: Optional[UsageMeter]) -> Iterator[Optional[UsageMeter]]:
+    """
+    在当前上下文中激活 meter（None 表示不计量）
+
+    asyncio 任务和 asyncio.to_thread 会复制上下文，因此其中的LLM调用也会被计量。
+    """
+    token = _current_meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _current_meter.reset(token)
+
+@contextmanager
+def usage_stage(name: str) -> Iterator[str]:
+    """设置之后的LLM调用所属的阶段名（嵌套时以最内层为准）"""
+    token = _current_stage.set(name)
+    try:
+        yield name
+    finally:
+        _current_stage.reset(token)
+
+async def staged(stream: AsyncGenerator[Any, None], name: str) -> AsyncGenerator[Any, None]:
+    """
+    让异步生成器中的LLM调用归入阶段 name
+
+    生成器在每次 yield 后可能由不同的上下文恢复，因此只在每次取下一个片段时设置阶段。
+    """
+    try:
+        while True:
+            with usage_stage(name):
+                try:
+                    chunk = await stream.__anext__()
+                except StopAsyncIteration:
+                    break
+            yield chunk
+    finally:
+        await stream.aclose()
+
+async def metering_stream(stream: AsyncGenerator[Any, None], meter: Optional[UsageMeter]) -> AsyncGenerator[Any, None]:
+    """
+    让异步生成器中的LLM调用记入 meter（与 staged 相同，只在每次取下一个片段时激活）
+    """
+    try:
+        while True:
+            with metering(meter):
+                try:
+                    chunk = await stream.__anext__()
+                except StopAsyncIteration:
+                    break
+            yield chunk
+    finally:
+        await stream.aclose()
+
+def report_usage(prompt_tokens: int, completion_tokens: int) -> None:
+    """
+    后端上报本次调用的真实用量（例如API返回的 usage），优先于 @metered 的分词器计数
+
+    Args:
+        prompt_tokens: 提示token数
+        completion_tokens: 生成token数
+    """
+    reported = _reported_usage.get()
+    if reported is not None:
+        reported[:] = [prompt_tokens, completion_tokens]
+
+def _count(model: Any, text: str) -> int:
+    return len(model.get_tokenizer().encode(text)) if text else 0
+
+def metered(func: Callable) -> Callable:
+    """
+    LLMInterface.generate / stream_generate 的装饰器：调用结束后把用量记入激活的 UsageMeter
+
+    未上报真实用量时，用后端自己的分词器计算提示和生成内容的token数；流式调用在生成结束后统计。
+    """
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def gen_wrapper(self, prompt: str, *args, **kwargs):
+            if _current_meter.get() is None:
+                yield from func(self, prompt, *args, **kwargs)
+                return
+            chunks = []
+            for chunk in func(self, prompt, *args, **kwargs):
+                chunks.append(chunk)
+                yield chunk
+            # 迭代可能在不同线程（复制的上下文）中推进，记录时重新读取计量器和阶段
+            meter = _current_meter.get()
+            if meter is not None:
+                meter.record(_current_stage.get(), _count(self, prompt), _count(self, "".join(chunks)))
+        return gen_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, prompt: str, *args, **kwargs):
+        meter = _current_meter.get()
+        if meter is None:
+            return func(self, prompt, *args, **kwargs)
+        token = _reported_usage.set([])
+        try:
+            result = func(self, prompt, *args, **kwargs)
+            reported = _reported_usage.get()
+        finally:
+            _reported_usage.reset(token)
+        if reported:
+            prompt_tokens, completion_tokens = reported
+        else:
+            prompt_tokens, completion_tokens = _count(self, prompt), _count(self, result if isinstance(result, str) else "")
+        meter.record(_current_stage.get(), prompt_tokens, completion_tokens)
+        return result
+    return wrapper
@@ -3,14 +3,34 @@
 
 import os
 import sys
+import tempfile
+import threading
+import time
+import asyncio
+import concurrent.futures
 import unittest
+import numpy as np
 
 # 添加项目根目录到路径
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from openkimi import KimiEngine
+from openkimi.bulk_ingest import BulkIngestor, find_documents
 from openkimi.core import TextProcessor, RAGManager, FrameworkGenerator
-from openkimi.utils.llm_interface import DummyLLM
+from openkimi.core.pipeline import Stage, StagePipeline, StageTimeoutError
+from openkimi.core.router import QueryRouter, FAST_PATH, FULL_PATH
+from openkimi.core.history import ConversationHistory
+from openkimi.core.snapshot import pack_bundle, unpack_bundle
+from openkimi.core.budget import BudgetItem, TokenBudgetPlanner
+from openkimi.core.cache import SemanticCache
+from openkimi.core.docstore import DocumentStore
+from openkimi.core.digest import RollingSummarizer
+from openkimi.core.ingest_queue import IngestPlan, IngestionQueue
+from openkimi.core.spans import SpanRecorder
+from openkimi.utils.llm_interface import DummyLLM, SimpleTokenizer, TokenCounter
+from openkimi.utils.tracing import Tracer, activate, trace, traced
+from openkimi.utils.prompt_loader import load_prompt
+from openkimi.utils.usage import UsageMeter, metered, metering, metering_stream, report_usage, usage_stage
 
 class TestTextProcessor(unittest.TestCase):
     """文本处理器测试"""
@@ -37,6 +57,31 @@ class TestTextProcessor(unittest.TestCase):
         useful, less_useful = self.processor.classify_by_entropy(batches, threshold=2.0)
         
         self.assertEqual(len(useful) + len(less_useful), 2)
+        
+    def test_split_terminates_with_overlap(self):
+        words = " ".join(f"w{i}." if i % 7 == 6 else f"w{i}" for i in range(95))
+        batches = TextProcessor(batch_size=20, overlap_size=5).split_into_batches(words)
+        self.assertTrue(batches[-1].endswith("w94"))
+        self.assertLess(len(batches), 20)
+        
+    def test_content_defined_chunks_survive_insertion(self):
+        processor = TextProcessor(batch_size=32, chunking="content")
+        words = [f"w{(i * 7919) % 251}" for i in range(2000)]
+        original = processor.split_into_batches(" ".join(words))
+        edited = processor.split_into_batches(" ".join(words[:1000] + ["inserted"] + words[1000:]))
+        self.assertEqual(" ".join(original).split(), words)
+        original_hashes = {TextProcessor.chunk_hash(chunk) for chunk in original}
+        reused = sum(TextProcessor.chunk_hash(chunk) in original_hashes for chunk in edited)
+        self.assertGreaterEqual(reused, len(edited) - 2)
+        self.assertTrue(all(len(chunk.split()) <= 32 for chunk in edited))
+        
+    def test_compress_extractive_respects_budget_and_query(self):
+        text = ("Filler filler filler filler. Quicksort partitions arrays around a pivot. "
+                "Photosynthesis converts light into chemical energy. Filler filler filler again.")
+        count = lambda t: len(t.split())
+        compressed = self.processor.compress_extractive(text, 7, count, query="how does quicksort partition arrays")
+        self.assertEqual(compressed, "Quicksort partitions arrays around a pivot.")
+        self.assertLessEqual(count(self.processor.compress_extractive(text, 12, count)), 12)
 
 class TestRAGManager(unittest.TestCase):
     """RAG管理器测试"""
@@ -70,6 +115,482 @@ class TestFrameworkGenerator(unittest.TestCase):
         framework = "1. 步骤一\n2. 步骤二"
         solution = self.framework_gen.generate_solution(query, framework)
         self.assertIsNotNone(solution)
+        
+    def test_hierarchical_synthesis_keeps_details_as_one_paragraph(self):
+        candidates = ["概述A\n\n细节一. 细节二\n\n建议A", "概述A\n\n细节三\n\n建议B"]
+        solution = self.framework_gen._hierarchical_synthesis("问题", "框架", candidates)
+        # 详细说明合成为一段，而不是逐字符拆成段落
+        paragraphs = solution.split("\n\n")
+        self.assertEqual(len(paragraphs), 3)
+        self.assertEqual(paragraphs[:2], ["概述A", "细节一. 细节二"])
+        self.assertIn(paragraphs[2], ("建议A", "建议B"))
+
+class TestStagePipeline(unittest.TestCase):
+    """阶段DAG执行器测试"""
+    
+    @staticmethod
+    def _sleep_stage(value, delay):
+        async def func(deps):
+            await asyncio.sleep(delay)
+            return value
+        return func
+        
+    def test_independent_stages_run_concurrently(self):
+        async def join(deps):
+            return deps["a"] + deps["b"]
+        pipeline = StagePipeline([
+            Stage("a", self._sleep_stage(1, 0.2)),
+            Stage("b", self._sleep_stage(2, 0.2)),
+            Stage("c", join, deps=("a", "b")),
+        ])
+        start = time.perf_counter()
+        results = asyncio.run(pipeline.run())
+        elapsed = time.perf_counter() - start
+        
+        self.assertEqual(results["c"], 3)
+        self.assertLess(elapsed, 0.35)
+        self.assertGreaterEqual(pipeline.timings["c"]["start"], pipeline.timings["a"]["end"])
+        
+    def test_timeout_uses_fallback(self):
+        pipeline = StagePipeline([Stage("slow", self._sleep_stage("late", 1.0), timeout=0.05, fallback="fallback")])
+        self.assertEqual(asyncio.run(pipeline.run())["slow"], "fallback")
+        
+    def test_timeout_without_fallback_raises(self):
+        pipeline = StagePipeline([Stage("slow", self._sleep_stage("late", 1.0), timeout=0.05)])
+        with self.assertRaises(StageTimeoutError):
+            asyncio.run(pipeline.run())
+            
+    def test_unknown_dependency_rejected(self):
+        with self.assertRaises(ValueError):
+            StagePipeline([Stage("a", self._sleep_stage(1, 0), deps=("missing",))])
+
+class TestQueryRouter(unittest.TestCase):
+    """查询路由器测试"""
+    
+    def setUp(self):
+        self.router = QueryRouter(max_query_tokens=8, max_entropy=3.0, min_hit_score=0.5)
+        
+    def test_short_query_takes_fast_path(self):
+        self.assertEqual(self.router.classify(list("你好"), []), FAST_PATH)
+        
+    def test_long_or_weakly_grounded_query_takes_full_path(self):
+        self.assertEqual(self.router.classify(list(range(20)), []), FULL_PATH)
+        self.assertEqual(self.router.classify([1, 2, 3], [0.2, 0.1]), FULL_PATH)
+        self.assertEqual(self.router.classify([1, 2, 3], [0.9]), FAST_PATH)
+        
+    def test_precheck_only_rules_out_fast_path(self):
+        self.assertEqual(self.router.precheck(list(range(20))), FULL_PATH)
+        self.assertIsNone(self.router.precheck([1, 2, 3]))
+        self.assertEqual(QueryRouter(enabled=False).precheck([1]), FULL_PATH)
+        
+    def test_stats(self):
+        self.router.record(FAST_PATH, 0.5)
+        self.router.record(FAST_PATH, 1.5)
+        stats = self.router.get_stats()
+        self.assertEqual(stats[FAST_PATH]["count"], 2)
+        self.assertAlmostEqual(stats[FAST_PATH]["avg_latency"], 1.0)
+        self.assertEqual(stats[FULL_PATH]["count"], 0)
+
+class TestConversationHistory(unittest.TestCase):
+    """会话历史测试"""
+    
+    def setUp(self):
+        # SimpleTokenizer 按字符计数，"user: abc" 为 9 个token
+        self.history = ConversationHistory(TokenCounter(SimpleTokenizer()))
+        for content in ["a" * 10, "b" * 20, "c" * 30]:
+            self.history.append({"role": "user", "content": content})
+            
+    def test_cached_counts_and_prefix_sums(self):
+        self.assertEqual([self.history.token_count(i) for i in range(3)], [16, 26, 36])
+        self.assertEqual(self.history.total_tokens, 78)
+        self.assertEqual(self.history.tokens_between(1), 62)
+        
+    def test_window_start(self):
+        self.assertEqual(self.history.window_start(1000), 0)
+        self.assertEqual(self.history.window_start(62), 1)
+        self.assertEqual(self.history.window_start(61), 2)
+        self.assertEqual(self.history.window_start(10), 3)
+        
+    def test_list_compatibility(self):
+        self.assertEqual(len(self.history), 3)
+        self.assertEqual(self.history[-1]["content"], "c" * 30)
+        self.history.clear()
+        self.assertFalse(self.history)
+        self.assertEqual(self.history.window_start(10), 0)
+        
+    def test_fork_is_copy_on_write(self):
+        forked = self.history.fork()
+        forked.append({"role": "assistant", "content": "d"})
+        self.history.append({"role": "user", "content": "e"})
+        self.assertEqual([m["content"] for m in forked][-1], "d")
+        self.assertEqual([m["content"] for m in self.history][-1], "e")
+        self.assertEqual((len(forked), len(self.history)), (4, 4))
+        self.assertEqual(forked.total_tokens, 78 + 12)
+        
+    def test_diff_against_client_messages(self):
+        messages = [dict(m) for m in self.history]
+        extra = {"role": "assistant", "content": "d"}
+        self.assertEqual(self.history.diff([]), (3, []))
+        self.assertEqual(self.history.diff(messages), (3, []))
+        # 客户端只发送到第二条消息（重新生成其后的回答）：截断
+        self.assertEqual(self.history.diff(messages[:2]), (2, []))
+        self.assertEqual(self.history.diff(messages + [extra]), (3, [extra]))
+        # 客户端只发送最近的一段
+        self.assertEqual(self.history.diff(messages[1:] + [extra]), (3, [extra]))
+        # 客户端改写了第二条消息
+        edited = {"role": "user", "content": "x"}
+        self.assertEqual(self.history.diff([messages[0], edited]), (1, [edited]))
+        self.history.truncate(1)
+        self.assertEqual((len(self.history), self.history.total_tokens), (1, 16))
+
+class TestSnapshotBundle(unittest.TestCase):
+    """会话快照格式测试"""
+    
+    def test_roundtrip(self):
+        meta = {"session_id": "s-1", "history": [{"role": "user", "content": "你好"}]}
+        embeddings = np.arange(12, dtype=np.float32).reshape(3, 4)
+        restored_meta, arrays = unpack_bundle(pack_bundle(meta, {"rag_embeddings": embeddings}))
+        
+        self.assertEqual(restored_meta, meta)
+        np.testing.assert_array_equal(arrays["rag_embeddings"], embeddings)
+        self.assertEqual(arrays["rag_embeddings"].dtype, np.float32)
+
+class TestTokenBudgetPlanner(unittest.TestCase):
+    """token预算规划器测试"""
+    
+    def test_required_items_and_density_order(self):
+        items = [
+            BudgetItem("history", "query", 10, 1.0, required=True, order=3),
+            BudgetItem("rag", "dense", 20, 0.9, order=4),
+            BudgetItem("rag", "sparse", 80, 0.8, order=5),
+            BudgetItem("history", "old", 30, 0.2, order=1),
+        ]
+        selected = TokenBudgetPlanner(60).plan(items)
+        self.assertEqual([item.text for item in selected], ["old", "query", "dense"])
+        
+    def test_best_single_item_beats_greedy(self):
+        items = [
+            BudgetItem("rag", "small", 1, 0.1),
+            BudgetItem("rag", "large", 100, 5.0),
+        ]
+        selected = TokenBudgetPlanner(100).plan(items)
+        self.assertEqual([item.text for item in selected], ["large"])
+
+class _KeywordEncoder:
+    """测试用的embedding模型：按关键词出现次数编码"""
+    
+    KEYWORDS = ["cat", "dog", "sort", "graph"]
+    
+    def encode(self, texts):
+        if isinstance(texts, str):
+            return self.encode([texts])[0]
+        return np.array([[text.count(k) for k in self.KEYWORDS] for text in texts], dtype=np.float32)
+
+class TestRAGManagerConsistency(unittest.TestCase):
+    """RAG存储在并发读写下的一致性测试"""
+    
+    def test_batch_is_published_at_once(self):
+        seen = []
+        storing = threading.Event()
+        class Encoder(_KeywordEncoder):
+            def encode(inner, texts):
+                # 编码进行中（其他线程可能在检索），存储里还看不到这一批的任何条目
+                if storing.is_set() and isinstance(texts, str):
+                    seen.append((len(rag.texts), len(rag.embeddings), rag.retrieve_with_scores("cat", top_k=5)))
+                return super().encode(texts)
+        rag = RAGManager(DummyLLM(), embedding_model=Encoder(), vector_dimension=4)
+        rag.summarize_text = lambda text: text
+        storing.set()
+        summaries = rag.batch_store(["cat", "dog", "cat"])
+        storing.clear()
+        self.assertEqual(summaries, ["cat", "dog", "cat"])
+        self.assertTrue(seen)
+        self.assertTrue(all(entry == (0, 0, []) for entry in seen))
+        self.assertEqual(rag.texts, ["cat", "dog"])
+        self.assertEqual(len(rag.embeddings), 2)
+        if rag.use_faiss and rag.index is not None:
+            self.assertEqual(rag.index.ntotal, 2)
+        self.assertEqual(rag.retrieve("cat", top_k=1), ["cat"])
+        
+class TestRollingSummarizer(unittest.TestCase):
+    """后台滚动摘要测试"""
+    
+    def test_summary_is_merged_after_idle(self):
+        summarizer = RollingSummarizer(lambda digest, turns: f"{digest}|{turns}", idle_seconds=0.0)
+        summarizer.schedule(["a", "b"], 2)
+        summarizer.wait(5)
+        self.assertEqual(summarizer.current(), ("|a\n\nb", 2))
+        
+    def test_cancel_discards_pending_summary(self):
+        summarizer = RollingSummarizer(lambda digest, turns: "digest", idle_seconds=5.0)
+        summarizer.schedule(["a"], 1)
+        start = time.perf_counter()
+        self.assertTrue(summarizer.cancel())
+        summarizer.wait(5)
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual(summarizer.current(), ("", 0))
+        self.assertEqual(summarizer.stats["cancelled"], 1)
+        
+class TestIngestionQueue(unittest.TestCase):
+    """后台摄入队列测试"""
+    
+    def test_chunks_are_stored_incrementally(self):
+        stored = []
+        visible_at_store = []
+        finished = []
+        def plan(text):
+            words = text.split()
+            return IngestPlan(text, [(word, "context") for word in words], words)
+        def store(plan, start, end):
+            visible_at_store.append(len(stored))
+            stored.extend(plan.chunks[start:end])
+        ingest_queue = IngestionQueue(plan, store, lambda plan, ok: finished.append(ok), batch_size=2)
+        job_id = ingest_queue.submit("a b c d e", name="doc.txt")
+        self.assertTrue(ingest_queue.wait(5))
+        progress = ingest_queue.get(job_id)
+        self.assertEqual(progress["status"], "done")
+        self.assertEqual((progress["chunks_done"], progress["chunks_total"]), (5, 5))
+        self.assertEqual(visible_at_store, [0, 2, 4])
+        self.assertEqual(finished, [True])
+        self.assertEqual(ingest_queue.progress()["pending"], 0)
+        
+    def test_failed_job_reports_error(self):
+        finished = []
+        def store(plan, start, end):
+            raise RuntimeError("boom")
+        ingest_queue = IngestionQueue(lambda text: IngestPlan(text, [(text, "rag")], [text]), store,
+                                      lambda plan, ok: finished.append(ok))
+        job_id = ingest_queue.submit("text")
+        self.assertTrue(ingest_queue.wait(5))
+        self.assertEqual(ingest_queue.get(job_id)["status"], "error")
+        self.assertEqual(ingest_queue.get(job_id)["error"], "boom")
+        self.assertEqual(finished, [False])
+        
+    def test_idle_worker_exits_and_restarts(self):
+        stored = []
+        ingest_queue = IngestionQueue(lambda text: IngestPlan(text, [(text, "rag")], [text]),
+                                      lambda plan, start, end: stored.extend(plan.chunks[start:end]),
+                                      lambda plan, ok: None, idle_timeout=0.05)
+        ingest_queue.submit("first")
+        self.assertTrue(ingest_queue.wait(5))
+        worker = ingest_queue._worker
+        if worker is not None:
+            worker.join(5)
+        self.assertIsNone(ingest_queue._worker)
+        ingest_queue.submit("second")
+        self.assertTrue(ingest_queue.wait(5))
+        self.assertEqual([text for text, _ in stored], ["first", "second"])
+        
+    def test_finished_jobs_expire(self):
+        ingest_queue = IngestionQueue(lambda text: None, lambda plan, start, end: None,
+                                      lambda plan, ok: None, job_ttl=0.0)
+        job_id = ingest_queue.submit("text")
+        self.assertTrue(ingest_queue.wait(5))
+        time.sleep(0.01)
+        self.assertIsNone(ingest_queue.get(job_id))
+        self.assertEqual(ingest_queue.progress()["jobs"], [])
+        
+    def test_shutdown_cancels_and_rejects_new_jobs(self):
+        release = threading.Event()
+        finished = []
+        def store(plan, start, end):
+            release.wait(5)
+        ingest_queue = IngestionQueue(lambda text: IngestPlan(text, [(word, "rag") for word in text.split()], text.split()),
+                                      store, lambda plan, ok: finished.append(ok), batch_size=1)
+        first = ingest_queue.submit("a b c")
+        second = ingest_queue.submit("d e")
+        self.assertEqual(ingest_queue.shutdown(), 2)
+        release.set()
+        self.assertTrue(ingest_queue.wait(5))
+        self.assertEqual(ingest_queue.get(first)["status"], "cancelled")
+        self.assertEqual(ingest_queue.get(second)["status"], "cancelled")
+        with self.assertRaises(RuntimeError):
+            ingest_queue.submit("f")
+        worker = ingest_queue._worker
+        if worker is not None:
+            worker.join(5)
+        self.assertIsNone(ingest_queue._worker)
+        
+class _EchoLLM:
+    """按字符计数的测试后端，可选择上报API口径的用量"""
+    
+    def __init__(self, reported=None):
+        self.reported = reported
+        
+    def get_tokenizer(self):
+        return SimpleTokenizer()
+        
+    @metered
+    def generate(self, prompt, **kwargs):
+        if self.reported:
+            report_usage(*self.reported)
+        return "ok"
+        
+    @metered
+    def stream_generate(self, prompt, **kwargs):
+        yield "o"
+        yield "k"
+        
+class _SlowStreamLLM(_EchoLLM):
+    """逐个片段延迟返回的流式测试后端"""
+    
+    supports_streaming = True
+    
+    @metered
+    def stream_generate(self, prompt, **kwargs):
+        for piece in ["a", "b", "c"]:
+            time.sleep(0.05)
+            yield piece
+            
+class TestStreaming(unittest.TestCase):
+    """流式生成测试"""
+    
+    def test_stream_generate_yields_backend_chunks(self):
+        dummy = DummyLLM()
+        self.assertEqual(list(dummy.stream_generate("你好")), [dummy.generate("你好")])
+        
+        async def collect(model):
+            return [chunk async for chunk in FrameworkGenerator(model)._stream("prompt")]
+        self.assertEqual(asyncio.run(collect(_SlowStreamLLM())), ["a", "b", "c"])
+        # 不支持流式的后端一次性生成
+        self.assertEqual(asyncio.run(collect(dummy)), [dummy.generate("prompt")])
+        
+    def test_stream_chat_reports_time_to_first_token(self):
+        engine = KimiEngine()
+        engine.framework_generator = FrameworkGenerator(_SlowStreamLLM())
+        request_meter = UsageMeter(parent=engine.session_usage)
+        async def consume():
+            stream = metering_stream(engine.stream_chat("你好"), request_meter)
+            return [(chunk, time.perf_counter()) async for chunk in stream]
+        received = asyncio.run(consume())
+        self.assertEqual(request_meter.to_dict()["by_stage"], engine.last_turn_usage["by_stage"])
+        self.assertGreater(request_meter.calls, 0)
+        self.assertEqual([chunk for chunk, _ in received], ["a", "b", "c"])
+        self.assertGreater(received[-1][1] - received[0][1], 0.08)
+        stats = engine.last_stream_stats
+        self.assertEqual(stats["chunks"], 3)
+        self.assertLess(stats["time_to_first_token"], stats["total_time"] - 0.08)
+        self.assertEqual(engine.conversation_history[-1]["content"], "abc")
+        
+class TestUsageMeter(unittest.TestCase):
+    """LLM token用量计量测试"""
+    
+    def test_calls_are_counted_by_stage_and_rolled_up(self):
+        session = UsageMeter()
+        turn = UsageMeter(parent=session)
+        llm = _EchoLLM()
+        llm.generate("untracked")
+        with metering(turn):
+            with usage_stage("framework"):
+                llm.generate("abcd")
+            with usage_stage("solution"):
+                self.assertEqual("".join(llm.stream_generate("abc")), "ok")
+        self.assertEqual(turn.to_dict()["by_stage"], {
+            "framework": {"prompt_tokens": 4, "completion_tokens": 2, "calls": 1},
+            "solution": {"prompt_tokens": 3, "completion_tokens": 2, "calls": 1}
+        })
+        self.assertEqual(session.total_tokens, 11)
+        
+    def test_reported_usage_takes_precedence(self):
+        meter = UsageMeter()
+        with metering(meter):
+            _EchoLLM(reported=(100, 7)).generate("abcd")
+        self.assertEqual((meter.prompt_tokens, meter.completion_tokens, meter.calls), (100, 7, 1))
+        
+class TestDocumentStore(unittest.TestCase):
+    """原文向量存储测试"""
+    
+    def test_add_dedupes_and_search_ranks_by_cosine(self):
+        store = DocumentStore(_KeywordEncoder())
+        self.assertEqual(store.add(["cat cat", "dog", "sort graph", "cat cat"]), 3)
+        self.assertEqual(store.add(["dog"]), 0)
+        self.assertEqual([text for text, _ in store.search("cat", top_k=2)], ["cat cat"])
+        self.assertEqual(store.search_batch(["graph", "dog"], top_k=1), [[("sort graph", store.search("graph")[0][1])], [("dog", 1.0)]])
+        
+    def test_export_and_load_state(self):
+        store = DocumentStore(_KeywordEncoder())
+        store.add(["cat", "dog"])
+        restored = DocumentStore(_KeywordEncoder())
+        restored.load_state(*store.export_state())
+        self.assertEqual(restored.search("dog"), store.search("dog"))
+        
+    def test_fork_is_copy_on_write(self):
+        store = DocumentStore(_KeywordEncoder())
+        store.add(["cat"])
+        forked = store.fork()
+        forked.add(["dog"])
+        forked.clear()
+        forked.add(["graph"])
+        self.assertEqual(store.texts, ["cat"])
+        self.assertEqual(forked.texts, ["graph"])
+        self.assertEqual(store.search("cat")[0][0], "cat")
+
+class TestSemanticCache(unittest.TestCase):
+    """语义回答缓存测试"""
+    
+    def test_similar_query_hits_only_with_same_fingerprint(self):
+        cache = SemanticCache(similarity_threshold=0.9)
+        cache.store(np.array([1.0, 0.0]), "doc-a", "answer")
+        self.assertEqual(cache.lookup(np.array([0.99, 0.05]), "doc-a"), "answer")
+        self.assertIsNone(cache.lookup(np.array([0.99, 0.05]), "doc-b"))
+        self.assertIsNone(cache.lookup(np.array([0.0, 1.0]), "doc-a"))
+        self.assertEqual(cache.get_stats(), {"hits": 1, "misses": 2, "entries": 1})
+        
+    def test_lru_eviction_and_ttl(self):
+        cache = SemanticCache(max_entries=1)
+        cache.store(np.array([1.0, 0.0]), "", "first")
+        cache.store(np.array([0.0, 1.0]), "", "second")
+        self.assertIsNone(cache.lookup(np.array([1.0, 0.0]), ""))
+        cache.ttl = -1
+        self.assertIsNone(cache.lookup(np.array([0.0, 1.0]), ""))
+        self.assertEqual(cache.get_stats()["entries"], 0)
+
+class TestSpanRecorder(unittest.TestCase):
+    """计时区间记录器测试"""
+    
+    def test_spans_are_relative_and_ordered(self):
+        recorder = SpanRecorder()
+        recorder.attrs["tokens_in"] = 3
+        with recorder.span("solution", tokens_out=5):
+            time.sleep(0.01)
+        recorder.add("retrieve", recorder.origin, recorder.origin + 0.001, hits=2)
+        result = recorder.to_dict()
+        self.assertEqual(result["tokens_in"], 3)
+        self.assertEqual([s["name"] for s in result["spans"]], ["retrieve", "solution"])
+        self.assertEqual(result["spans"][0]["start"], 0.0)
+        self.assertEqual(result["spans"][0]["hits"], 2)
+        self.assertGreaterEqual(result["spans"][1]["duration"], 0.01)
+        self.assertEqual(result["spans"][1]["tokens_out"], 5)
+        self.assertAlmostEqual(result["total"], result["spans"][1]["end"])
+
+class TestTracing(unittest.TestCase):
+    """请求级追踪测试"""
+    
+    def test_nested_events_export_as_chrome_trace(self):
+        @traced("inner", category="rag")
+        def inner():
+            return 1
+            
+        @traced("outer")
+        async def outer():
+            with trace("step", category="llm", tokens=3):
+                return await asyncio.to_thread(inner)
+                
+        tracer = Tracer(name="session")
+        with activate(tracer):
+            self.assertEqual(asyncio.run(outer()), 1)
+        events = {e["name"]: e for e in tracer.to_chrome_trace()["traceEvents"] if e["ph"] == "X"}
+        self.assertEqual(set(events), {"outer", "step", "inner"})
+        self.assertEqual(events["step"]["args"], {"tokens": 3})
+        self.assertEqual(events["inner"]["cat"], "rag")
+        self.assertLessEqual(events["outer"]["ts"], events["step"]["ts"])
+        self.assertGreaterEqual(events["outer"]["ts"] + events["outer"]["dur"], events["inner"]["ts"] + events["inner"]["dur"])
+        
+    def test_no_events_without_active_tracer(self):
+        tracer = Tracer()
+        with trace("ignored"):
+            pass
+        self.assertEqual(tracer.events, [])
 
 class TestKimiEngine(unittest.TestCase):
     """Kimi引擎集成测试"""
@@ -84,5 +605,433 @@ class TestKimiEngine(unittest.TestCase):
         response = self.engine.chat("这个文本是关于什么的？")
         self.assertIsNotNone(response)
         
+    def test_chat_only_session_defers_rag_init(self):
+        self.assertFalse(self.engine.has_rag_store)
+        response = self.engine.chat("你好")
+        self.assertIsNotNone(response)
+        self.assertFalse(self.engine.has_rag_store)
+        timings = self.engine.get_init_timings()
+        self.assertIn("llm_interface", timings)
+        self.assertNotIn("rag_manager", timings)
+        
+    def test_evicted_turns_are_indexed_and_retrieved(self):
+        self.engine.config["history"]["window_tokens"] = 40
+        self.engine.turn_store = DocumentStore(_KeywordEncoder())
+        messages = ["my cat is orange"] + [f"filler message number {i} without keywords" for i in range(10)]
+        for content in messages:
+            self.engine.conversation_history.append({"role": "user", "content": content})
+        indexed = self.engine._index_evicted_turns()
+        self.assertGreater(indexed, 0)
+        self.assertEqual(self.engine.evicted_upto, indexed)
+        self.assertEqual(self.engine._index_evicted_turns(), 0)
+        hits = self.engine._retrieve("cat", query_embedding=_KeywordEncoder().encode("cat"))
+        self.assertEqual(hits[0][0], "user: my cat is orange")
+        
+    def test_rolling_summary_replaces_aging_turns(self):
+        self.engine.config["history"].update(rolling_summary=True, summary_idle_seconds=0.0,
+                                             summary_keep_messages=2, summary_min_tokens=1)
+        self.engine.chat("first question about the garden")
+        self.engine.chat("second question about the weather")
+        self.engine.rolling_summarizer.wait(5)
+        digest, upto = self.engine.rolling_summarizer.current()
+        self.assertTrue(digest)
+        self.assertEqual(upto, len(self.engine.conversation_history) - 2)
+        context, _ = self.engine._plan_context([])
+        self.assertTrue(context.startswith("summary: "))
+        self.assertNotIn("first question", context)
+        
+    def test_fork_branches_conversation_independently(self):
+        self.engine.chat("shared question")
+        forked = self.engine.fork("branch")
+        self.assertEqual(forked.get_session_id(), "branch")
+        self.assertEqual(len(forked.conversation_history), 2)
+        forked.chat("what if")
+        self.assertEqual(len(forked.conversation_history), 4)
+        self.assertEqual(len(self.engine.conversation_history), 2)
+        forked.reset()
+        self.assertEqual(len(forked.conversation_history), 0)
+        self.assertEqual(len(self.engine.conversation_history), 2)
+        
+    def test_reconcile_history_appends_only_new_turns(self):
+        turns = [{"role": "user", "content": "q1"}, {"role": "assistant", "content": "a1"}]
+        self.assertEqual(self.engine.reconcile_history(turns), 2)
+        self.assertEqual(self.engine.reconcile_history(turns), 0)
+        turns += [{"role": "user", "content": "q2"}, {"role": "assistant", "content": "a2"}]
+        self.assertEqual(self.engine.reconcile_history(turns), 2)
+        self.assertEqual(len(self.engine.conversation_history), 4)
+        # 重新生成最后的回答
+        turns[-1] = {"role": "assistant", "content": "a2'"}
+        self.assertEqual(self.engine.reconcile_history(turns), 1)
+        self.assertEqual([m["content"] for m in self.engine.conversation_history], ["q1", "a1", "q2", "a2'"])
+        # 重新生成 a2'：客户端只重发 q2 之前的轮次，q2 与旧回答被截断后由本轮重新追加
+        self.assertEqual(self.engine.reconcile_history(turns[:2]), 0)
+        self.assertEqual([m["content"] for m in self.engine.conversation_history], ["q1", "a1"])
+        self.engine.chat("q2")
+        self.assertEqual([m["content"] for m in self.engine.conversation_history][:3], ["q1", "a1", "q2"])
+        self.assertEqual(len(self.engine.conversation_history), 4)
+        
+    def test_precomputed_prompt_attaches_like_ingest(self):
+        self.engine.document_store = DocumentStore(_KeywordEncoder())
+        prompt = load_prompt("cot_system")
+        artifact = self.engine.precompute_prompt(prompt, name="steps")
+        self.assertEqual(len(self.engine.document_store), 0)
+        session = self.engine.fork()
+        self.assertTrue(session.attach_prompt(artifact))
+        self.assertFalse(session.attach_prompt(artifact))
+        ingested = self.engine.fork()
+        ingested.ingest(prompt)
+        self.assertEqual(session.context_fingerprint, ingested.context_fingerprint)
+        self.assertEqual(session.chunk_table, ingested.chunk_table)
+        self.assertEqual(session.document_store.texts, ingested.document_store.texts)
+        
+    def test_attach_prompt_stores_before_bookkeeping_without_loading_model(self):
+        self.engine.document_store = DocumentStore(_KeywordEncoder())
+        artifact = self.engine.precompute_prompt(load_prompt("cot_system"), name="steps")
+        session = KimiEngine()
+        self.assertTrue(session.attach_prompt(artifact))
+        self.assertFalse(session.has_rag_store)
+        self.assertFalse(session.document_store.embedding_model.loaded)
+        self.assertEqual(len(session.document_store), len(artifact.doc_texts))
+        
+        failing = KimiEngine()
+        failing.document_store = DocumentStore(_KeywordEncoder())
+        add = failing.document_store.add
+        def failing_add(texts, embeddings=None):
+            raise RuntimeError("store failed")
+        failing.document_store.add = failing_add
+        with self.assertRaises(RuntimeError):
+            failing.attach_prompt(artifact)
+        self.assertEqual((failing.ingest_digests, failing.chunk_table, failing.context_fingerprint), ({}, {}, ""))
+        failing.document_store.add = add
+        self.assertTrue(failing.attach_prompt(artifact))
+        self.assertEqual(failing.context_fingerprint, session.context_fingerprint)
+        
+    def test_framework_is_speculated_only_when_query_rules_out_fast_path(self):
+        self.engine.document_store = DocumentStore(_KeywordEncoder())
+        self.engine.document_store.add(["the cat sat"])
+        def slow_retrieve(query, query_embedding=None):
+            time.sleep(0.2)
+            return [("the cat sat", 0.9)]
+        framework_calls = []
+        async def slow_framework(query, context):
+            framework_calls.append(query)
+            await asyncio.sleep(0.2)
+            return "framework"
+        self.engine._retrieve = slow_retrieve
+        self.engine.framework_generator.generate_framework = slow_framework
+        
+        # 查询本身就排除了快速路径：框架与检索并发生成
+        self.engine.router.max_query_tokens = 2
+        start = time.perf_counter()
+        results = asyncio.run(self.engine._run_pipeline(self.engine._build_turn_stages("cat? " * 5)))
+        self.assertLess(time.perf_counter() - start, 0.35)
+        timings = self.engine.last_stage_timings
+        self.assertLess(timings["framework"]["start"], timings["retrieve"]["end"])
+        self.assertEqual((results["route"], results["framework"]), (FULL_PATH, "framework"))
+        self.assertEqual(len(framework_calls), 1)
+        
+        # 短查询且命中强：等路由结果，快速路径下不调用框架生成
+        self.engine.router.max_query_tokens = 32
+        results = asyncio.run(self.engine._run_pipeline(self.engine._build_turn_stages("cat?")))
+        self.assertEqual((results["route"], results["framework"]), (FAST_PATH, ""))
+        self.assertEqual(len(framework_calls), 1)
+        
+        # 短查询但命中弱：路由结果出来后再生成框架
+        self.engine._retrieve = lambda query, query_embedding=None: [("the cat sat", 0.1)]
+        results = asyncio.run(self.engine._run_pipeline(self.engine._build_turn_stages("cat?")))
+        self.assertEqual((results["route"], results["framework"]), (FULL_PATH, "framework"))
+        self.assertEqual(len(framework_calls), 2)
+        
+    def test_compress_reports_ratio_and_caches(self):
+        text = "\n\n".join(f"Paragraph {i} talks about topic {i} in some detail." * 5 for i in range(20))
+        result = self.engine.compress(text, 100, mode="extractive")
+        self.assertLessEqual(result["compressed_tokens"], 100)
+        self.assertAlmostEqual(result["ratio"], result["compressed_tokens"] / result["original_tokens"])
+        self.assertFalse(result["cached"])
+        self.assertTrue(self.engine.compress(text, 100, mode="extractive")["cached"])
+        self.engine.config["compress"]["segment_tokens"] = 500
+        
+        async def collect():
+            return [event async for event in self.engine.compress_stream(text, 200, mode="extractive")]
+        events = asyncio.run(collect())
+        self.assertTrue(events[-1]["done"])
+        self.assertEqual(len(events) - 1, events[0]["segments"])
+        self.assertGreater(events[0]["segments"], 1)
+        
+    def test_retrieve_reuses_document_store_encoder(self):
+        self.engine.document_store = DocumentStore(_KeywordEncoder())
+        self.engine.document_store.add(["the cat sat", "a dog barked"])
+        hits = self.engine._retrieve("cat")
+        self.assertEqual(hits[0][0], "the cat sat")
+        self.assertFalse(self.engine.has_rag_store)
+        
+    def test_retrieve_returns_scored_hits_without_llm(self):
+        self.assertEqual(self.engine.retrieve(["cat"]), [[]])
+        self.engine.document_store = DocumentStore(_KeywordEncoder())
+        self.engine.document_store.add(["the cat sat", "a dog barked", "sort the graph"])
+        results = self.engine.retrieve(["cat", "dog"], top_k=1)
+        self.assertEqual([[hit["text"] for hit in hits] for hits in results], [["the cat sat"], ["a dog barked"]])
+        self.assertEqual(results[0][0]["source"], "document")
+        self.assertAlmostEqual(results[0][0]["score"], 1.0, places=5)
+        self.assertEqual(self.engine.get_usage_stats()["calls"], 0)
+        
+    def test_turn_usage_feeds_session_usage(self):
+        self.engine.chat("你好")
+        turn = self.engine.last_turn_usage
+        self.assertGreater(turn["calls"], 0)
+        self.assertIn("solution", turn["by_stage"])
+        self.assertEqual(self.engine.last_turn_spans["usage"], turn)
+        self.assertEqual(self.engine.get_usage_stats()["total_tokens"], turn["total_tokens"])
+        
+    def test_request_meter_excludes_other_session_usage(self):
+        self.engine.chat("warm up")
+        before = self.engine.session_usage.calls
+        request_meter = UsageMeter(parent=self.engine.session_usage)
+        with metering(request_meter):
+            self.engine.chat("你好")
+        # 后台摘要等记入会话计量器的用量不计入请求
+        self.engine.session_usage.record("rolling_summary", 5, 5)
+        self.assertEqual(request_meter.to_dict(), self.engine.last_turn_usage)
+        self.assertEqual(self.engine.session_usage.calls, before + request_meter.calls + 1)
+        
+        # 在运行中的事件循环里调用同步 chat() 时也记入调用方的计量器
+        loop_meter = UsageMeter(parent=self.engine.session_usage)
+        async def chat_inside_loop():
+            with metering(loop_meter):
+                return self.engine.chat("你好")
+        asyncio.run(chat_inside_loop())
+        self.assertEqual(loop_meter.to_dict(), self.engine.last_turn_usage)
+        
+    def test_response_cache_key_follows_last_reply_and_skips_empty_global_context(self):
+        self.engine.config["cache"]["enabled"] = True
+        self.engine.response_cache = self.engine._create_response_cache()
+        self.engine.document_store = DocumentStore(_KeywordEncoder())
+        answer = self.engine.chat("tell me about the cat")
+        # 同一会话中重复提问命中
+        self.assertEqual(self.engine.chat("tell me about the cat"), answer)
+        self.assertEqual(self.engine.get_cache_stats()["hits"], 1)
+        followup = self.engine.chat("and the graph?")
+        self.assertEqual(self.engine.get_cache_stats()["hits"], 1)
+        # 同样的追问，上一轮回复不同：不命中
+        history = self.engine.conversation_history
+        history.truncate(0)
+        history.append({"role": "user", "content": "tell me about the dog"})
+        history.append({"role": "assistant", "content": "dogs bark"})
+        self.engine.chat("and the graph?")
+        self.assertEqual(self.engine.get_cache_stats()["hits"], 1)
+        # 上一轮回复相同（仅空白不同）：命中
+        history.truncate(0)
+        history.append({"role": "user", "content": "tell me about the cat"})
+        history.append({"role": "assistant", "content": f"  {answer}\n"})
+        self.assertEqual(self.engine.chat("and the graph?"), followup)
+        self.assertEqual(self.engine.get_cache_stats()["hits"], 2)
+        
+        shared = SemanticCache()
+        sessions = []
+        for _ in range(2):
+            session = KimiEngine()
+            session.config["cache"].update(enabled=True, scope="global")
+            session.response_cache = shared
+            session.document_store = DocumentStore(_KeywordEncoder())
+            sessions.append(session)
+        # 未摄入任何内容（指纹为空）时不使用全局缓存
+        sessions[0].chat("tell me about the cat")
+        sessions[1].chat("tell me about the cat")
+        self.assertEqual(shared.get_stats(), {"hits": 0, "misses": 0, "entries": 0})
+        for session in sessions:
+            session.ingest(load_prompt("cot_system"))
+        sessions[0].chat("what about the dog")
+        sessions[1].chat("what about the dog")
+        self.assertEqual(shared.get_stats()["hits"], 1)
+        
+    def test_repeated_ingest_skips_known_text(self):
+        def ingested(text):
+            self.engine._finish_ingest(self.engine._plan_ingest(text, precompress=False), True)
+        document = "第一段内容。" * 20
+        self.assertEqual(self.engine._new_ingest_text(document), document)
+        ingested(document)
+        self.assertEqual(self.engine._new_ingest_text(document), "")
+        self.assertEqual(self.engine._new_ingest_text(document + "新增的段落。"), "新增的段落。")
+        ingested(document + "新增的段落。")
+        self.assertEqual(self.engine._new_ingest_text(document + "新增的段落。"), "")
+        self.assertEqual(self.engine._new_ingest_text("另一份文档"), "另一份文档")
+        self.engine.reset()
+        self.assertEqual(self.engine._new_ingest_text(document), document)
+        
+    def test_failed_ingest_is_not_recorded(self):
+        self.engine.document_store = DocumentStore(_KeywordEncoder())
+        prompt = load_prompt("cot_system")
+        store_chunks = self.engine._store_chunks
+        def failing_store(chunks, concurrency=1):
+            raise RuntimeError("store failed")
+        self.engine._store_chunks = failing_store
+        with self.assertRaises(RuntimeError):
+            self.engine.ingest(prompt)
+        self.assertEqual(self.engine._new_ingest_text(prompt), prompt)
+        self.assertEqual(self.engine._new_ingest_text(prompt + " more"), prompt + " more")
+        self.assertEqual((self.engine._reserved_digests, self.engine._reserved_chunks), ({}, {}))
+        self.engine._store_chunks = store_chunks
+        self.engine.ingest(prompt)
+        self.assertGreater(len(self.engine.document_store), 0)
+        self.assertEqual(self.engine._new_ingest_text(prompt), "")
+        
+    def test_failed_background_ingest_is_retried(self):
+        self.engine.document_store = DocumentStore(_KeywordEncoder())
+        store_chunks = self.engine._store_chunks
+        def failing_store(chunks, concurrency=1):
+            raise RuntimeError("store failed")
+        self.engine._store_chunks = failing_store
+        job_id = self.engine.ingest_in_background(load_prompt("cot_system"))
+        self.assertTrue(self.engine.ingest_queue.wait(5))
+        self.assertEqual(self.engine.get_ingest_progress(job_id)["status"], "error")
+        self.assertEqual((self.engine.chunk_table, self.engine.ingest_digests, self.engine.context_fingerprint), ({}, {}, ""))
+        self.engine._store_chunks = store_chunks
+        job_id = self.engine.ingest_in_background(load_prompt("cot_system"))
+        self.assertTrue(self.engine.ingest_queue.wait(5))
+        self.assertEqual(self.engine.get_ingest_progress(job_id)["status"], "done")
+        self.assertEqual(len(self.engine.document_store), len(self.engine.chunk_table))
+        self.assertGreater(len(self.engine.chunk_table), 0)
+        self.assertEqual(len(self.engine.ingest_digests), 1)
+        
+    def test_reset_drains_background_ingest_first(self):
+        self.engine.ingest_queue.batch_size = 1
+        self.engine.document_store = DocumentStore(_KeywordEncoder())
+        store_chunks = self.engine._store_chunks
+        def slow_store(chunks, concurrency=1):
+            time.sleep(0.05)
+            store_chunks(chunks, concurrency)
+        self.engine._store_chunks = slow_store
+        self.engine.processor.split_into_batches = lambda text: text.split("\n")
+        self.engine.processor.classify_by_entropy = lambda batches, threshold=3.0: (batches, [])
+        job_id = self.engine.ingest_in_background("\n".join(f"cat number {i}" for i in range(20)))
+        deadline = time.monotonic() + 5
+        while self.engine.get_ingest_progress(job_id)["chunks_done"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.engine.reset()
+        self.assertEqual(self.engine.get_ingest_progress(job_id)["status"], "cancelled")
+        time.sleep(0.1)
+        self.assertEqual((len(self.engine.document_store), self.engine.chunk_table, self.engine.ingest_digests), (0, {}, {}))
+        
+    def test_snapshot_restore_roundtrip_reuses_model(self):
+        self.engine.document_store = DocumentStore(_KeywordEncoder())
+        self.engine.ingest(load_prompt("cot_system"))
+        self.engine.document_store.add(["the cat sat"])
+        self.engine.chat("where is the cat?")
+        data = self.engine.snapshot()
+        
+        encoder = _KeywordEncoder()
+        restored = KimiEngine()
+        restored.document_store = DocumentStore(encoder)
+        restored.chat("an unrelated question")
+        restored.restore(data)
+        self.assertIs(restored.document_store.embedding_model, encoder)
+        self.assertFalse(restored.has_rag_store)
+        self.assertEqual(restored.document_store.texts, self.engine.document_store.texts)
+        self.assertEqual(restored.conversation_history.to_list(), self.engine.conversation_history.to_list())
+        self.assertEqual((restored.context_fingerprint, restored.chunk_table, restored.ingest_digests),
+                         (self.engine.context_fingerprint, self.engine.chunk_table, self.engine.ingest_digests))
+        self.assertEqual((restored.get_usage_stats()["calls"], restored.last_turn_usage, restored.last_turn_spans), (0, {}, {}))
+        self.assertEqual(restored._retrieve("cat")[0][0], "the cat sat")
+        self.assertEqual(restored._new_ingest_text(load_prompt("cot_system")), "")
+        
+    def test_chat_batch_preserves_order_and_dedupes(self):
+        queries = ["你好", "今天天气怎么样？", "你好"]
+        results = self.engine.chat_batch(queries, concurrency=2)
+        self.assertEqual([r["query"] for r in results], queries)
+        self.assertTrue(all(r["error"] is None and r["answer"] for r in results))
+        self.assertEqual(results[0]["answer"], results[2]["answer"])
+        self.assertIn("solution", [span["name"] for span in results[1]["spans"]["spans"]])
+        self.assertEqual(len(self.engine.conversation_history), 0)
+        
+class TestBulkIngest(unittest.TestCase):
+    """批量摄入工具测试"""
+    
+    def test_ingest_directory_and_skip_completed(self):
+        engine = KimiEngine()
+        engine.document_store = DocumentStore(_KeywordEncoder())
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, "sub"))
+            with open(os.path.join(root, "sub", "prompt.txt"), "w", encoding="utf-8") as f:
+                f.write(load_prompt("cot_system"))
+            with open(os.path.join(root, "ignored.bin"), "wb") as f:
+                f.write(b"\x00")
+            self.assertEqual(find_documents(root), [os.path.join(root, "sub", "prompt.txt")])
+            output = os.path.join(root, "corpus.bundle")
+            ingestor = BulkIngestor(engine, root, output, workers=1, llm_concurrency=2)
+            report = ingestor.run()
+            self.assertEqual((report["documents"], report["failed"]), (1, 0))
+            self.assertGreater(report["chunks"], 0)
+            self.assertTrue(os.path.exists(output) and os.path.exists(ingestor.progress_path))
+            self.assertEqual(len(engine.document_store), report["chunks"])
+            report = ingestor.run()
+            self.assertEqual((report["documents"], report["skipped"]), (0, 1))
+            
+    def test_failed_document_is_retried(self):
+        engine = KimiEngine()
+        engine.document_store = DocumentStore(_KeywordEncoder())
+        store_chunks = engine._store_chunks
+        def failing_store(chunks, concurrency=1):
+            raise RuntimeError("store failed")
+        engine._store_chunks = failing_store
+        with tempfile.TemporaryDirectory() as root:
+            with open(os.path.join(root, "prompt.txt"), "w", encoding="utf-8") as f:
+                f.write(load_prompt("cot_system"))
+            ingestor = BulkIngestor(engine, root, os.path.join(root, "corpus.bundle"), workers=1)
+            report = ingestor.run()
+            self.assertEqual((report["documents"], report["failed"]), (0, 1))
+            self.assertEqual((ingestor.completed, engine.ingest_digests, engine.chunk_table), ({}, {}, {}))
+            engine._store_chunks = store_chunks
+            report = ingestor.run()
+            self.assertEqual((report["documents"], report["failed"], report["skipped"]), (1, 0, 0))
+            self.assertGreater(report["chunks"], 0)
+            self.assertEqual(len(engine.document_store), report["chunks"])
+            
+    def test_in_flight_documents_are_bounded(self):
+        engine = KimiEngine()
+        engine.document_store = DocumentStore(_KeywordEncoder())
+        submitted = []
+        class RecordingPool(concurrent.futures.ThreadPoolExecutor):
+            def submit(self, fn, *args, **kwargs):
+                submitted.append(args[0])
+                return super().submit(fn, *args, **kwargs)
+        submitted_at_ingest = []
+        ingest_prepared = engine.ingest_prepared
+        def recording_ingest(*args, **kwargs):
+            submitted_at_ingest.append(len(submitted))
+            return ingest_prepared(*args, **kwargs)
+        engine.ingest_prepared = recording_ingest
+        process_pool = concurrent.futures.ProcessPoolExecutor
+        concurrent.futures.ProcessPoolExecutor = RecordingPool
+        try:
+            with tempfile.TemporaryDirectory() as root:
+                for i in range(6):
+                    with open(os.path.join(root, f"doc{i}.txt"), "w", encoding="utf-8") as f:
+                        f.write(f"document {i} about the cat. " * 20)
+                report = BulkIngestor(engine, root, os.path.join(root, "corpus.bundle"), workers=1).run()
+        finally:
+            concurrent.futures.ProcessPoolExecutor = process_pool
+        self.assertEqual(report["documents"], 6)
+        # workers=1 时最多 2 个文档在进程池中，取出一个后立即补充一个
+        self.assertEqual(submitted_at_ingest[0], 3)
+        self.assertEqual(len(submitted), 6)
+        
+    def test_resume_refuses_changed_config(self):
+        engine = KimiEngine()
+        engine.document_store = DocumentStore(_KeywordEncoder())
+        with tempfile.TemporaryDirectory() as root:
+            with open(os.path.join(root, "prompt.txt"), "w", encoding="utf-8") as f:
+                f.write(load_prompt("cot_system"))
+            output = os.path.join(root, "corpus.bundle")
+            BulkIngestor(engine, root, output, workers=1).run()
+            
+            same = KimiEngine()
+            self.assertTrue(BulkIngestor(same, root, output, workers=1).resume())
+            changed = KimiEngine()
+            changed.config["processor"]["chunking"] = "sentences"
+            with self.assertRaises(ValueError) as error:
+                BulkIngestor(changed, root, output, workers=1).resume()
+            self.assertIn("processor", str(error.exception))
+            self.assertEqual(changed.config["processor"]["chunking"], "sentences")
+            
 if __name__ == "__main__":
     unittest.main() 
\ No newline at end of file